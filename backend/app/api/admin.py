@@ -0,0 +1,33 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from ..api.auth import get_admin_user
+from ..core.profiler import ProfileBusy, profiler
+from ..services.sharding import worker_id
+
+
+router = APIRouter()
+
+
+@router.post("/profile")
+async def profile(
+    seconds: float = Query(10.0, gt=0),
+    interval_ms: float = Query(5.0, ge=1.0),
+    memory: bool = True,
+    top: int = Query(25, ge=1, le=200),
+    format: str = Query("json", pattern="^(json|collapsed)$"),
+    admin=Depends(get_admin_user),
+):
+  """
+  Profile this worker for ``seconds`` (capped at PROFILE_MAX_SECONDS).
+
+  ``format=collapsed`` returns just the stacks, ready for flamegraph.pl or
+  speedscope; ``json`` adds the sample count and the top allocating lines.
+  """
+  try:
+    result = await profiler.profile(seconds, interval_ms=interval_ms, memory=memory and format == "json", top=top)
+  except ProfileBusy as e:
+    raise HTTPException(status_code=409, detail=str(e))
+  if format == "collapsed":
+    return PlainTextResponse(result["collapsed"] + "\n")
+  return {"worker": worker_id, **result}
@@ -1,8 +1,13 @@
+from typing import Optional
+
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
+from pymongo.errors import DuplicateKeyError
 
-from ..core.security import hash_password, verify_password, create_access_token, decode_token
+from ..core.cache import TTLCache
+from ..core.config import settings
+from ..core.security import hash_password_async, verify_password_async, create_access_token, decode_token, invalidate_subject_tokens, token_cache
 from ..db.session import get_db
 from ..models.user import UserCreate, UserPublic
 
@@ -17,14 +22,54 @@ class TokenResponse(BaseModel):
   token: str
 
 
+# token -> resolved user, so protected endpoints skip the users lookup on repeat calls
+user_cache: TTLCache[UserPublic] = TTLCache(
+    max_entries=settings.AUTH_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.AUTH_CACHE_TTL_SECONDS,
+)
+
+
+def invalidate_user(email: str):
+  """Forget everything cached for a user; call whenever their account changes."""
+  user_cache.remove_if(lambda token, user: user.email == email)
+  invalidate_subject_tokens(email)
+
+
 async def get_current_user(token: str = Depends(oauth2_scheme), db=Depends(get_db)) -> UserPublic:
+  user = user_cache.get(token)
+  if user is not None:
+    return user
   subject = decode_token(token)
   if subject is None:
     raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
   user_doc = await db["users"].find_one({"email": subject})
   if not user_doc:
     raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-  return UserPublic(id=str(user_doc["_id"]), email=user_doc["email"])
+  user = UserPublic(id=str(user_doc["_id"]), email=user_doc["email"])
+  # Bounded by the verified token's remaining lifetime, so this never outlives the token itself
+  remaining = token_cache.ttl_remaining(token)
+  if remaining is not None:
+    user_cache.set(token, user, ttl_seconds=remaining)
+  return user
+
+
+async def websocket_user(token: Optional[str], db) -> Optional[UserPublic]:
+  """The user a websocket's ``token`` query parameter authenticates, if any."""
+  if not token:
+    return None
+  try:
+    return await get_current_user(token, db)
+  except HTTPException:
+    return None
+
+
+admin_emails = {email.strip().lower() for email in settings.ADMIN_EMAILS.split(",") if email.strip()}
+
+
+async def get_admin_user(current_user: UserPublic = Depends(get_current_user)) -> UserPublic:
+  if current_user.email.lower() not in admin_emails:
+    raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+  return current_user
 
 
 @router.post("/register", status_code=201)
@@ -33,9 +78,14 @@ async def register(payload: UserCreate, db=Depends(get_db)):
       existing = await db["users"].find_one({"email": payload.email})
       if existing:
           raise HTTPException(status_code=400, detail="Email already registered")
-      hashed = hash_password(payload.password)
+      hashed = await hash_password_async(payload.password)
       doc = {"email": payload.email, "hashed_password": hashed}
-      result = await db["users"].insert_one(doc)
+      try:
+        result = await db["users"].insert_one(doc)
+      except DuplicateKeyError:
+        # Lost a race with a concurrent registration; the unique email index caught it
+        raise HTTPException(status_code=400, detail="Email already registered")
+      invalidate_user(payload.email)
       return {"id": str(result.inserted_id), "email": payload.email}
   except HTTPException:
       raise
@@ -52,7 +102,7 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db=Depends(get
   user_doc = await db["users"].find_one({"email": form_data.username})
   if not user_doc:
     raise HTTPException(status_code=400, detail="Incorrect email or password")
-  if not verify_password(form_data.password, user_doc["hashed_password"]):
+  if not await verify_password_async(form_data.password, user_doc["hashed_password"]):
     raise HTTPException(status_code=400, detail="Incorrect email or password")
   token = create_access_token(subject=user_doc["email"])
   user = UserPublic(id=str(user_doc["_id"]), email=user_doc["email"])
@@ -1,30 +1,26 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header
+from pymongo import DeleteMany, ReturnDocument, UpdateOne
 from ..api.auth import get_current_user
 from ..db.session import get_db
 from ..models.cart import CartItem, CartResponse
+from ..models.order import CheckoutResponse
+from ..services.automation_engine import request_evaluation, user_changed
+from ..services.cart_cache import cart_cache, checkouts, manual_adds, manual_removes
+from ..services.order_pipeline import checkout, order_from_doc, order_pipeline
+from ..services.rule_index import rule_index
 
 router = APIRouter()
 
 @router.get("/", response_model=CartResponse)
 async def get_cart(current_user=Depends(get_current_user), db=Depends(get_db)):
-    cursor = db["cart"].find({"user_id": current_user.id})
-    items = []
-    async for doc in cursor:
-        items.append(
-            CartItem(
-                symbol=doc.get("symbol"),
-                name=doc.get("name"),
-                price=doc.get("price"),
-                quantity=doc.get("quantity", 1),
-                auto_added=doc.get("auto_added", False)
-            )
-        )
+    cart = await cart_cache.get_user_cart(db, current_user.id)
+    items = [CartItem(**entry) for entry in cart.values()]
     return CartResponse(items=items)
 
 @router.post("/add", status_code=201)
 async def add_to_cart(item: CartItem, current_user=Depends(get_current_user), db=Depends(get_db)):
     # Manual additions from Dashboard: always set auto_added=False to prevent bot from deleting it
-    await db["cart"].update_one(
+    doc = await db["cart"].find_one_and_update(
         {"user_id": current_user.id, "symbol": item.symbol},
         {
             "$set": {
@@ -37,18 +33,51 @@ async def add_to_cart(item: CartItem, current_user=Depends(get_current_user), db
             }
         },
         upsert=True,
+        return_document=ReturnDocument.AFTER,
     )
+    cart_cache.set_item(current_user.id, doc)
+    manual_adds.inc()
+    user_changed(current_user.id, "cart")
     return {"status": "ok"}
 
-@router.post("/buy")
-async def buy_cart(current_user=Depends(get_current_user), db=Depends(get_db)):
-    await db["cart"].delete_many({"user_id": current_user.id})
-    return {"status": "bought"}
+@router.post("/buy", response_model=CheckoutResponse)
+async def buy_cart(
+    current_user=Depends(get_current_user),
+    db=Depends(get_db),
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key"),
+):
+    # The cart snapshot comes from the cache: one insert_many and one bulk_write
+    # whatever the number of items
+    cart = await cart_cache.get_user_cart(db, current_user.id)
+    items = [dict(item) for item in cart.values()]
+    checkout_id, orders, inserted = await checkout(db, current_user.id, items, idempotency_key)
+    # Take off only what this call ordered: an add that landed during the checkout
+    # stays in the cart (a new row, or the extra quantity on an existing one), and
+    # a retried checkout does not remove items its first attempt already ordered
+    quantities = {doc["symbol"]: doc["quantity"] for doc in inserted}
+    if quantities:
+        ops = [
+            UpdateOne({"user_id": current_user.id, "symbol": symbol}, {"$inc": {"quantity": -quantity}})
+            for symbol, quantity in quantities.items()
+        ]
+        ops.append(DeleteMany({"user_id": current_user.id, "symbol": {"$in": list(quantities)}, "quantity": {"$lte": 0}}))
+        await db["cart"].bulk_write(ops, ordered=True)
+    cart_cache.remove_bought(current_user.id, quantities)
+    checkouts.inc()
+    order_pipeline.submit(inserted)
+    # Rules that are still in range should add their stock back right away
+    rule_index.mark_pending(current_user.id)
+    for symbol in rule_index.user_symbols(current_user.id):
+        await request_evaluation(symbol)
+    user_changed(current_user.id, "cart")
+    return CheckoutResponse(status="bought", checkout_id=checkout_id, orders=[order_from_doc(doc) for doc in orders])
 
 @router.delete("/remove/{symbol}")
 async def remove_from_cart(symbol: str, current_user=Depends(get_current_user), db=Depends(get_db)):
     # 1. Remove item from cart
     await db["cart"].delete_one({"user_id": current_user.id, "symbol": symbol})
+    cart_cache.remove_item(current_user.id, symbol)
+    manual_removes.inc()
     
     # 2. Deactivate any active automation rule for this stock symbol to prevent re-adding loop
     # We do this because if the user manually removes it, they clearly don't want it right now.
@@ -56,5 +85,7 @@ async def remove_from_cart(symbol: str, current_user=Depends(get_current_user),
         {"user_id": current_user.id, "symbol": symbol, "active": True},
         {"$set": {"active": False}}
     )
+    rule_index.deactivate(current_user.id, symbol)
+    user_changed(current_user.id, "rules")
     
     return {"status": "removed and bot deactivated for this stock"}
@@ -1,12 +1,69 @@
-from fastapi import APIRouter, Depends
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import APIRouter, Depends, HTTPException, Query
 
 from ..api.auth import get_current_user
+from ..core.config import settings
+from ..db.session import get_db
+from ..models.order import OrderPage, PaperOrder, PaperOrderCreate
+from ..services.cluster import LeaderUnavailable, on_market_leader
+from ..services.order_pipeline import order_from_doc, order_pipeline
 
 
 router = APIRouter()
 
 
-@router.get("/")
-async def list_orders(current_user=Depends(get_current_user)):
-  return []
+@router.get("/", response_model=OrderPage)
+async def list_orders(
+    cursor: str | None = None,
+    limit: int = Query(50, ge=1, le=settings.ORDER_PAGE_MAX),
+    current_user=Depends(get_current_user),
+    db=Depends(get_db),
+):
+  # Newest first, keyset-paginated on (user_id, _id) so every page is an index range scan
+  query = {"user_id": current_user.id}
+  if cursor:
+    try:
+      query["_id"] = {"$lt": ObjectId(cursor)}
+    except InvalidId:
+      raise HTTPException(status_code=400, detail="Invalid cursor")
+  docs = await db["orders"].find(query).sort("_id", -1).limit(limit + 1).to_list(limit + 1)
+  next_cursor = str(docs[limit - 1]["_id"]) if len(docs) > limit else None
+  return OrderPage(items=[order_from_doc(doc) for doc in docs[:limit]], next_cursor=next_cursor)
 
+
+@router.get("/pipeline")
+async def order_pipeline_stats(current_user=Depends(get_current_user)):
+  return order_pipeline.stats()
+
+
+@router.post("/paper", response_model=PaperOrder, status_code=201)
+async def place_paper_order(payload: PaperOrderCreate, current_user=Depends(get_current_user)):
+  """Market, limit or stop order on the paper exchange (the market leader's); fills are pushed over /ws."""
+  order = await _on_exchange(
+      "paper_submit", user_id=current_user.id, symbol=payload.symbol.upper(), side=payload.side,
+      quantity=payload.quantity, kind=payload.kind, price=payload.price, stop_price=payload.stop_price,
+  )
+  if order["status"] == "rejected":
+    raise HTTPException(status_code=404, detail="Stock not found")
+  return PaperOrder(**order)
+
+
+@router.delete("/paper/{order_id}", response_model=PaperOrder)
+async def cancel_paper_order(order_id: int, current_user=Depends(get_current_user)):
+  order = await _on_exchange("paper_cancel", order_id=order_id, user_id=current_user.id)
+  if order is None:
+    raise HTTPException(status_code=404, detail="Open order not found")
+  return PaperOrder(**order)
+
+
+@router.get("/book/{symbol}")
+async def order_book(symbol: str, levels: int = Query(10, ge=1, le=100)):
+  return await _on_exchange("book_depth", symbol=symbol.upper(), levels=levels)
+
+
+async def _on_exchange(operation: str, **kwargs):
+  try:
+    return await on_market_leader(operation, **kwargs)
+  except LeaderUnavailable as e:
+    raise HTTPException(status_code=503, detail=str(e))
@@ -0,0 +1,17 @@
+from fastapi import APIRouter, Depends, HTTPException
+
+from ..api.auth import get_current_user
+from ..models.portfolio import PortfolioResponse
+from ..services.cluster import LeaderUnavailable, on_market_leader
+
+
+router = APIRouter()
+
+
+@router.get("/", response_model=PortfolioResponse)
+async def get_portfolio(current_user=Depends(get_current_user)):
+  # Served from the market leader's memory; prices and P&L are kept current tick by tick
+  try:
+    return await on_market_leader("portfolio", user_id=current_user.id)
+  except LeaderUnavailable as e:
+    raise HTTPException(status_code=503, detail=str(e))
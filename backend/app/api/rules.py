@@ -3,46 +3,52 @@ from bson import ObjectId
 from ..api.auth import get_current_user
 from ..db.session import get_db
 from ..models.rule import RuleCreate, RuleInDB
+from ..services.automation_engine import request_evaluation, user_changed
+from ..services.cart_cache import cart_cache
+from ..services.rule_index import IndexedRule, rule_index
+from ..services.sharding import shard_map
 
 router = APIRouter()
 
+def _rule_out(doc: dict, rule_id) -> RuleInDB:
+    return RuleInDB(
+        id=str(rule_id),
+        user_id=str(doc["user_id"]),
+        symbol=doc["symbol"],
+        indicator=doc.get("indicator", "price"),
+        min_price=doc.get("min_price"),
+        max_price=doc.get("max_price"),
+        window=doc.get("window"),
+        slow_window=doc.get("slow_window"),
+        min_value=doc.get("min_value"),
+        max_value=doc.get("max_value"),
+        quantity=doc.get("quantity", 1),
+        active=doc.get("active", True),
+    )
+
 @router.post("/", response_model=RuleInDB, status_code=201)
 async def create_rule(payload: RuleCreate, current_user=Depends(get_current_user), db=Depends(get_db)):
     doc = {
         "user_id": current_user.id,
         "symbol": payload.symbol.upper(),
-        "min_price": payload.min_price,
-        "max_price": payload.max_price,
-        "quantity": payload.quantity,
+        **payload.model_dump(exclude={"symbol"}, exclude_none=True),
         "active": True,
     }
     result = await db["rules"].insert_one(doc)
-    return RuleInDB(
-        id=str(result.inserted_id),
-        user_id=current_user.id,
-        symbol=payload.symbol.upper(),
-        min_price=payload.min_price,
-        max_price=payload.max_price,
-        quantity=payload.quantity,
-        active=True,
-    )
+    # Evaluated by whichever worker owns this user; the others just hear about it
+    if shard_map.owns(current_user.id):
+        rule_index.add(IndexedRule.from_doc({**doc, "_id": result.inserted_id}))
+        await cart_cache.ensure_users(db, [current_user.id])
+        await request_evaluation(doc["symbol"])
+    user_changed(current_user.id, "rules")
+    return _rule_out(doc, result.inserted_id)
 
 @router.get("/", response_model=list[RuleInDB])
 async def list_rules(current_user=Depends(get_current_user), db=Depends(get_db)):
     cursor = db["rules"].find({"user_id": current_user.id})
     rules: list[RuleInDB] = []
     async for doc in cursor:
-        rules.append(
-            RuleInDB(
-                id=str(doc["_id"]),
-                user_id=str(doc["user_id"]),
-                symbol=doc["symbol"],
-                min_price=doc["min_price"],
-                max_price=doc["max_price"],
-                quantity=doc.get("quantity", 1),
-                active=doc.get("active", True),
-            )
-        )
+        rules.append(_rule_out(doc, doc["_id"]))
     return rules
 
 @router.delete("/{rule_id}")
@@ -53,4 +59,6 @@ async def delete_rule(rule_id: str, current_user=Depends(get_current_user), db=D
     })
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Rule not found or unauthorized")
+    rule_index.remove(rule_id)
+    user_changed(current_user.id, "rules")
     return {"message": "Rule deleted successfully"}
@@ -1,16 +1,36 @@
-from fastapi import APIRouter, Depends, HTTPException
+import math
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 
 from ..models.stock import Stock
 from ..api.auth import get_current_user
 from ..services.market_simulator import market_simulator
+from ..services.market_snapshot import market_snapshot
+from ..services.quote_fetcher import quote_fetcher
+from ..services.tick_store import INTERVALS, tick_store
 
 
 router = APIRouter()
 
 
 @router.get("/", response_model=list[Stock])
-async def list_stocks():
-  return market_simulator.get_all_stocks()
+async def list_stocks(request: Request, since: str | None = None):
+  # Bodies are pre-encoded once per market version; polling clients can revalidate
+  # with If-None-Match or ask only for what changed with ?since=<X-Market-Seq>
+  headers = {"ETag": market_snapshot.etag, "X-Market-Seq": market_snapshot.token}
+  if since is not None:
+    body = market_snapshot.delta(since)
+    if body is not None:
+      return Response(content=body, media_type="application/json", headers=headers)
+  elif request.headers.get("if-none-match") == market_snapshot.etag:
+    return Response(status_code=304, headers=headers)
+  return Response(content=market_snapshot.full(), media_type="application/json", headers=headers)
+
+
+@router.get("/sources")
+async def quote_sources():
+  """Cache, hedging and per-source health (latency percentiles, error rate, breaker state) of the quote fetcher."""
+  return quote_fetcher.stats()
 
 
 @router.get("/{symbol}", response_model=Stock)
@@ -19,3 +39,27 @@ async def get_stock(symbol: str):
   if not stock:
       raise HTTPException(status_code=404, detail="Stock not found")
   return stock
+
+
+@router.get("/{symbol}/history")
+async def get_stock_history(
+    symbol: str,
+    interval: str = "1m",
+    start: float | None = None,
+    end: float | None = None,
+    limit: int = Query(500, ge=1, le=5000),
+):
+  """OHLC bars (unix-second bucket start, open, high, low, close, tick count) for a time range."""
+  if interval not in INTERVALS:
+    raise HTTPException(status_code=400, detail=f"interval must be one of {', '.join(INTERVALS)}")
+  symbol = symbol.upper()
+  if not market_simulator.get_stock(symbol):
+    raise HTTPException(status_code=404, detail="Stock not found")
+  # No end: up to the latest bar, which is ahead of the wall clock when a replay runs faster than real time
+  end = math.inf if end is None else end
+  start = 0.0 if start is None else start
+  return {
+      "symbol": symbol,
+      "interval": interval,
+      "bars": tick_store.bars(symbol, interval, start, end, limit),
+  }
@@ -0,0 +1,77 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Generic, Hashable, Optional, Tuple, TypeVar
+
+V = TypeVar("V")
+
+
+class TTLCache(Generic[V]):
+  """Bounded LRU mapping whose entries also expire after a time-to-live."""
+
+  def __init__(self, max_entries: int, ttl_seconds: float):
+    self.max_entries = max_entries
+    self.ttl_seconds = ttl_seconds
+    self._entries: "OrderedDict[Hashable, Tuple[float, V]]" = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+  def __contains__(self, key: Hashable) -> bool:
+    entry = self._entries.get(key)
+    return entry is not None and entry[0] > time.monotonic()
+
+  def ttl_remaining(self, key: Hashable) -> Optional[float]:
+    entry = self._entries.get(key)
+    if entry is None:
+      return None
+    remaining = entry[0] - time.monotonic()
+    return remaining if remaining > 0 else None
+
+  def get(self, key: Hashable, default: Any = None) -> Optional[V]:
+    entry = self._entries.get(key)
+    if entry is None:
+      self.misses += 1
+      return default
+    expires_at, value = entry
+    if expires_at <= time.monotonic():
+      del self._entries[key]
+      self.misses += 1
+      return default
+    self._entries.move_to_end(key)
+    self.hits += 1
+    return value
+
+  def set(self, key: Hashable, value: V, ttl_seconds: Optional[float] = None):
+    ttl = self.ttl_seconds if ttl_seconds is None else min(ttl_seconds, self.ttl_seconds)
+    self._entries[key] = (time.monotonic() + ttl, value)
+    self._entries.move_to_end(key)
+    while len(self._entries) > self.max_entries:
+      self._entries.popitem(last=False)
+      self.evictions += 1
+
+  def pop(self, key: Hashable, default: Any = None) -> Optional[V]:
+    entry = self._entries.pop(key, None)
+    return default if entry is None else entry[1]
+
+  def remove_if(self, predicate: Callable[[Hashable, V], bool]) -> int:
+    keys = [key for key, (_, value) in self._entries.items() if predicate(key, value)]
+    for key in keys:
+      del self._entries[key]
+    return len(keys)
+
+  def clear(self):
+    self._entries.clear()
+
+  def stats(self) -> dict:
+    lookups = self.hits + self.misses
+    return {
+        "entries": len(self._entries),
+        "max_entries": self.max_entries,
+        "hits": self.hits,
+        "misses": self.misses,
+        "evictions": self.evictions,
+        "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+    }
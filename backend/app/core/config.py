@@ -5,11 +5,66 @@ from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
   MONGO_URI: str = "mongodb://localhost:27017/stockdb"
+  DB_AUDIT_QUERIES: bool = False
   JWT_SECRET_KEY: str = "change-me"
   JWT_ALGORITHM: str = "HS256"
   ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7
   REDIS_URL: str | None = None
+  CLUSTER_PREFIX: str = "stockapp"
+  CLUSTER_LEASE_SECONDS: float = 10.0
+  CLUSTER_MEMBER_TTL_SECONDS: float = 3.0
   FRONTEND_ORIGIN: str = "http://localhost:5173"
+  CART_CACHE_MAX_USERS: int = 10000
+  AUTH_CACHE_TTL_SECONDS: int = 60
+  AUTH_CACHE_MAX_ENTRIES: int = 10000
+  PASSWORD_HASH_EXECUTOR: str = "process"
+  PASSWORD_HASH_WORKERS: int = 2
+  PASSWORD_HASH_MAX_CONCURRENCY: int = 8
+  WS_SEND_QUEUE_SIZE: int = 256
+  WS_QUEUE_POLICY: str = "coalesce"
+  WS_SEND_TIMEOUT_SECONDS: float = 5.0
+  WS_MAX_CONSECUTIVE_DROPS: int = 1024
+  WS_MAX_SYMBOLS: int = 500
+  MARKET_SYMBOLS: int = 30
+  MARKET_TICK_SECONDS: float = 60.0
+  MARKET_SEED: int | None = None
+  MARKET_MODEL: str = "random_walk"
+  MARKET_VOLATILITY: float = 0.015
+  MARKET_SOURCE: str = "simulator"
+  MARKET_REPLAY_FILE: str | None = None
+  MARKET_REPLAY_SPEED: float = 1.0
+  MARKET_REPLAY_LOOP: bool = False
+  TICK_STORE_MAX_TICKS: int = 4096
+  TICK_STORE_MAX_BARS: int = 1440
+  TICK_STORE_SPILL_TO_MONGO: bool = False
+  TICK_STORE_SPILL_SECONDS: float = 30.0
+  QUOTE_CACHE_TTL_SECONDS: float = 1.0
+  QUOTE_STALE_SECONDS: float = 30.0
+  QUOTE_CACHE_MAX_ENTRIES: int = 5000
+  QUOTE_BATCH_WINDOW_MS: float = 10.0
+  QUOTE_EXECUTOR_WORKERS: int = 4
+  QUOTE_SERVER_URL: str | None = None
+  QUOTE_SERVER_RATE_PER_SECOND: float = 0.0
+  NSE_RATE_PER_SECOND: float = 3.0
+  YAHOO_RATE_PER_SECOND: float = 2.0
+  QUOTE_SOURCE_TIMEOUT_SECONDS: float = 5.0
+  QUOTE_HEDGE_DEFAULT_MS: float = 500.0
+  QUOTE_BREAKER_FAILURES: int = 5
+  QUOTE_BREAKER_ERROR_RATE: float = 0.5
+  QUOTE_BREAKER_RESET_SECONDS: float = 30.0
+  ORDER_WORKERS: int = 4
+  ORDER_MAX_RETRIES: int = 3
+  ORDER_RETRY_BASE_SECONDS: float = 0.5
+  ORDER_QUEUE_SIZE: int = 10000
+  ORDER_FLUSH_SECONDS: float = 0.2
+  ORDER_PAGE_MAX: int = 200
+  PORTFOLIO_FLUSH_SECONDS: float = 1.0
+  # Comma-separated emails allowed to use /api/admin
+  ADMIN_EMAILS: str = ""
+  PROFILE_MAX_SECONDS: float = 60.0
+  # 0 disables the slow-path log lines
+  SLOW_REQUEST_MS: float = 500.0
+  SLOW_TICK_MS: float = 250.0
 
   class Config:
     env_file = ".env"
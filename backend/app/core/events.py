@@ -0,0 +1,110 @@
+"""
+In-process async pub/sub for per-symbol price changes.
+
+Producers (the market simulator and the live fetchers) call ``price_bus.publish``
+whenever a symbol's price moves; consumers hold a ``Subscription`` and await the
+ticks they care about instead of polling on a timer.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set
+
+from ..models.stock import Stock
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class PriceTick:
+    symbol: str
+    name: str
+    price: float
+    change: float
+    timestamp: float = field(default_factory=time.time)
+
+    @classmethod
+    def from_stock(cls, stock: Stock) -> "PriceTick":
+        return cls(symbol=stock.symbol, name=stock.name, price=stock.price, change=stock.change)
+
+
+class Subscription:
+    def __init__(self, bus: "PriceBus", symbols: Optional[Iterable[str]] = None, maxsize: int = 10000):
+        self._bus = bus
+        self.symbols: Optional[Set[str]] = set(symbols) if symbols is not None else None
+        self.queue: asyncio.Queue[PriceTick] = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def wants(self, symbol: str) -> bool:
+        return self.symbols is None or symbol in self.symbols
+
+    def put_nowait(self, tick: PriceTick):
+        if self.queue.full():
+            # Slow consumer: the oldest tick is the least useful one
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(tick)
+
+    async def get(self) -> PriceTick:
+        return await self.queue.get()
+
+    async def get_batch(self, coalesce: bool = True) -> List[PriceTick]:
+        """
+        Wait for at least one tick, then drain the queue.
+
+        With ``coalesce`` only the latest tick per symbol is kept; otherwise every
+        tick is returned in arrival order.
+        """
+        ticks = [await self.queue.get()]
+        while not self.queue.empty():
+            ticks.append(self.queue.get_nowait())
+        if not coalesce:
+            return ticks
+        latest: Dict[str, PriceTick] = {}
+        for tick in ticks:
+            latest[tick.symbol] = tick
+        return list(latest.values())
+
+    def close(self):
+        self._bus.unsubscribe(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> PriceTick:
+        return await self.get()
+
+
+class PriceBus:
+    def __init__(self):
+        self._subscriptions: List[Subscription] = []
+        self.last: Dict[str, PriceTick] = {}
+        self.published = 0
+
+    def subscribe(self, symbols: Optional[Iterable[str]] = None, maxsize: int = 10000) -> Subscription:
+        subscription = Subscription(self, symbols=symbols, maxsize=maxsize)
+        self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+
+    def publish(self, tick: PriceTick) -> bool:
+        """Fan a tick out to every interested subscriber. Returns False if the price did not change."""
+        previous = self.last.get(tick.symbol)
+        if previous is not None and previous.price == tick.price:
+            return False
+        self.last[tick.symbol] = tick
+        self.published += 1
+        for subscription in self._subscriptions:
+            if subscription.wants(tick.symbol):
+                subscription.put_nowait(tick)
+        return True
+
+    def publish_stock(self, stock: Stock) -> bool:
+        return self.publish(PriceTick.from_stock(stock))
+
+
+price_bus = PriceBus()
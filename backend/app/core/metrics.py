@@ -0,0 +1,227 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+Instruments are created once at import time and their labelled children are
+looked up once and kept by the code that updates them. Updating a metric on
+a hot path is an attribute add, with no allocation and no lock. Everything
+that updates them runs on the event loop thread. Values that already live
+elsewhere (queue depths, cache hit counts, per-job histograms) are not
+copied on every change. ``collector`` functions read them at scrape time
+instead.
+
+    requests = registry.counter("http_requests_total", "Requests", ("route",))
+    orders = requests.labels("/api/orders")
+    orders.inc()
+"""
+import asyncio
+import math
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Seconds; spans sub-millisecond handlers up to minute-long scheduled jobs
+DEFAULT_BUCKETS = (
+  0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+class Histogram:
+  """
+  Fixed-bucket histogram in the Prometheus layout.
+
+  The bucket counts are allocated once. ``observe`` is a bisect plus two
+  integer adds. All callers run on the event loop thread, so it needs no
+  lock.
+  """
+
+  __slots__ = ("bounds", "counts", "sum", "count")
+
+  def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+    self.bounds: List[float] = sorted(buckets)
+    # One extra slot for +Inf
+    self.counts: List[int] = [0] * (len(self.bounds) + 1)
+    self.sum = 0.0
+    self.count = 0
+
+  def observe(self, value: float):
+    self.counts[bisect_left(self.bounds, value)] += 1
+    self.sum += value
+    self.count += 1
+
+  def quantile(self, q: float) -> Optional[float]:
+    """Upper bound of the bucket holding the q-quantile; None when empty or beyond the last bucket."""
+    if not self.count:
+      return None
+    rank = q * self.count
+    seen = 0
+    for bound, count in zip(self.bounds, self.counts):
+      seen += count
+      if seen >= rank:
+        return bound
+    return None
+
+  def summary(self) -> dict:
+    def ms(value: Optional[float]) -> Optional[float]:
+      return None if value is None else round(value * 1000, 2)
+    return {
+      "count": self.count,
+      "mean_ms": ms(self.sum / self.count) if self.count else None,
+      "p50_ms": ms(self.quantile(0.50)),
+      "p95_ms": ms(self.quantile(0.95)),
+      "p99_ms": ms(self.quantile(0.99)),
+    }
+
+
+class Counter:
+  __slots__ = ("value",)
+
+  def __init__(self):
+    self.value = 0.0
+
+  def inc(self, amount: float = 1.0):
+    self.value += amount
+
+
+class Gauge:
+  __slots__ = ("value",)
+
+  def __init__(self):
+    self.value = 0.0
+
+  def set(self, value: float):
+    self.value = value
+
+  def inc(self, amount: float = 1.0):
+    self.value += amount
+
+  def dec(self, amount: float = 1.0):
+    self.value -= amount
+
+
+class Family:
+  """One named metric and its children, one per combination of label values."""
+
+  def __init__(self, name: str, help: str, kind: str, labelnames: Sequence[str], factory: Callable[[], object]):
+    self.name = name
+    self.help = help
+    self.kind = kind
+    self.labelnames = tuple(labelnames)
+    self._factory = factory
+    self.children: Dict[Tuple[str, ...], object] = {}
+    if not self.labelnames:
+      self.children[()] = factory()
+
+  def labels(self, *values: str):
+    values = tuple(str(value) for value in values)
+    child = self.children.get(values)
+    if child is None:
+      if len(values) != len(self.labelnames):
+        raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+      child = self.children[values] = self._factory()
+    return child
+
+  def __getattr__(self, attr):
+    # An unlabelled family behaves like its single child: family.inc(), family.observe(...)
+    if attr.startswith("_") or self.labelnames:
+      raise AttributeError(attr)
+    return getattr(self.children[()], attr)
+
+  def samples(self) -> Iterable[Tuple[Dict[str, str], object]]:
+    for values, child in self.children.items():
+      yield dict(zip(self.labelnames, values)), child
+
+
+# (name, kind, help, [(labels, Counter | Gauge | Histogram | number)])
+Collected = Tuple[str, str, str, List[Tuple[Dict[str, str], object]]]
+
+
+def _escape(value: str) -> str:
+  return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: Dict[str, str], extra: str = "") -> str:
+  parts = [f'{key}="{_escape(value)}"' for key, value in labels.items()]
+  if extra:
+    parts.append(extra)
+  return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+  if math.isinf(value):
+    return "+Inf" if value > 0 else "-Inf"
+  return repr(float(value))
+
+
+def _le(bound: float) -> str:
+  return 'le="' + _number(bound) + '"'
+
+
+class Registry:
+  def __init__(self):
+    self.families: Dict[str, Family] = {}
+    self.collectors: List[Callable[[], Iterable[Collected]]] = []
+
+  def _family(self, name: str, help: str, kind: str, labelnames: Sequence[str], factory) -> Family:
+    if name in self.families:
+      raise ValueError(f"Metric {name} is already registered")
+    family = self.families[name] = Family(name, help, kind, labelnames, factory)
+    return family
+
+  def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Family:
+    return self._family(name, help, "counter", labelnames, Counter)
+
+  def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Family:
+    return self._family(name, help, "gauge", labelnames, Gauge)
+
+  def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Family:
+    return self._family(name, help, "histogram", labelnames, lambda: Histogram(buckets))
+
+  def collector(self, fn: Callable[[], Iterable[Collected]]):
+    self.collectors.append(fn)
+    return fn
+
+  def render(self) -> str:
+    lines: List[str] = []
+    # Collectors first: some of them fold buffered samples into registered families
+    collected: List[Collected] = []
+    for collector in self.collectors:
+      collected.extend(collector())
+    collected[:0] = [
+      (family.name, family.kind, family.help, list(family.samples())) for family in self.families.values()
+    ]
+    for name, kind, help, samples in collected:
+      lines.append(f"# HELP {name} {help}")
+      lines.append(f"# TYPE {name} {kind}")
+      for labels, value in samples:
+        if isinstance(value, Histogram):
+          cumulative = 0
+          for bound, count in zip(value.bounds, value.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(labels, _le(bound))} {cumulative}")
+          lines.append(f"{name}_bucket{_labels(labels, _le(math.inf))} {value.count}")
+          lines.append(f"{name}_sum{_labels(labels)} {_number(value.sum)}")
+          lines.append(f"{name}_count{_labels(labels)} {value.count}")
+        else:
+          number = value.value if isinstance(value, (Counter, Gauge)) else value
+          lines.append(f"{name}{_labels(labels)} {_number(number)}")
+    return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+loop_lag = registry.histogram(
+  "event_loop_lag_seconds",
+  "How late the event loop woke a sleeping coroutine",
+  buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+loop_lag_last = registry.gauge("event_loop_lag_last_seconds", "Most recent event loop lag sample")
+
+
+async def watch_loop_lag(interval: float = 0.5):
+  """Sleep ``interval`` over and over; anything beyond it is time the loop was busy elsewhere."""
+  loop = asyncio.get_running_loop()
+  while True:
+    started = loop.time()
+    await asyncio.sleep(interval)
+    lag = max(0.0, loop.time() - started - interval)
+    loop_lag.observe(lag)
+    loop_lag_last.set(lag)
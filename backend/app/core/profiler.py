@@ -0,0 +1,180 @@
+"""
+On-demand profiling of the running server, and slow-path logging.
+
+``SamplingProfiler`` samples the event loop thread's Python stack from a
+background thread (``sys._current_frames``) for a bounded number of seconds.
+Nothing is installed on the loop itself, so a handler or tick that holds the
+loop shows up in the samples as it runs. The samples are returned as collapsed
+stacks (``root;caller;callee count``), the input format of flamegraph.pl and
+speedscope. With ``memory`` on, tracemalloc traces allocations for the same
+window and the lines that allocated the most are reported. Tracing slows every
+allocation, which is why it is limited to the profile window.
+
+``SlowRequestLogger`` is an ASGI middleware that logs any HTTP request slower
+than ``SLOW_REQUEST_MS``, under its route template so the log lines group.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, List, Optional, Sequence
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Paths in labels are shown relative to the backend directory
+_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) + os.sep
+
+
+def _short(filename: str) -> str:
+  return filename[len(_ROOT):] if filename.startswith(_ROOT) else filename
+
+
+class ProfileBusy(RuntimeError):
+  pass
+
+
+class SamplingProfiler:
+  def __init__(self, max_seconds: float = 60.0):
+    self.max_seconds = max_seconds
+    self._labels: Dict[object, str] = {}
+    self._running = False
+
+  @property
+  def running(self) -> bool:
+    return self._running
+
+  def _label(self, code) -> str:
+    label = self._labels.get(code)
+    if label is None:
+      label = self._labels[code] = f"{code.co_name} ({_short(code.co_filename)}:{code.co_firstlineno})"
+    return label
+
+  def _collapse(self, frame) -> str:
+    labels: List[str] = []
+    while frame is not None:
+      labels.append(self._label(frame.f_code))
+      frame = frame.f_back
+    labels.reverse()
+    return ";".join(labels)
+
+  def _sample(self, thread_id: int, seconds: float, interval: float, stacks: Counter) -> int:
+    # Runs on its own thread; the sampled thread keeps running between samples
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+      frame = sys._current_frames().get(thread_id)
+      if frame is not None:
+        stacks[self._collapse(frame)] += 1
+        samples += 1
+      del frame
+      time.sleep(interval)
+    return samples
+
+  @staticmethod
+  def _allocations(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, top: int) -> List[dict]:
+    ignore = [
+      tracemalloc.Filter(False, tracemalloc.__file__),
+      tracemalloc.Filter(False, __file__),
+      tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+      tracemalloc.Filter(False, "<unknown>"),
+    ]
+    diff = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), "lineno")
+    return [
+      {
+        "location": f"{_short(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+        "size_kb": round(stat.size_diff / 1024, 1),
+        "count": stat.count_diff,
+      }
+      for stat in diff[:top]
+      if stat.size_diff > 0
+    ]
+
+  async def profile(self, seconds: float, interval_ms: float = 5.0, memory: bool = True, top: int = 25) -> dict:
+    """Sample the calling (event loop) thread for ``seconds``; one profile at a time."""
+    if self._running:
+      raise ProfileBusy("A profile is already running")
+    seconds = min(max(seconds, 0.1), self.max_seconds)
+    interval = max(interval_ms, 1.0) / 1000
+    self._running = True
+    started_tracing = False
+    before: Optional[tracemalloc.Snapshot] = None
+    try:
+      if memory:
+        if not tracemalloc.is_tracing():
+          tracemalloc.start()
+          started_tracing = True
+        before = tracemalloc.take_snapshot()
+      stacks: Counter = Counter()
+      samples = await asyncio.to_thread(self._sample, threading.get_ident(), seconds, interval, stacks)
+      allocations = None
+      if memory:
+        allocations = self._allocations(before, tracemalloc.take_snapshot(), top)
+    finally:
+      if started_tracing:
+        tracemalloc.stop()
+      self._running = False
+    return {
+      "seconds": seconds,
+      "interval_ms": interval * 1000,
+      "samples": samples,
+      # Most frequent stacks first
+      "collapsed": "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()),
+      "top_allocations": allocations,
+    }
+
+
+profiler = SamplingProfiler(settings.PROFILE_MAX_SECONDS)
+
+
+def _route_template(scope) -> str:
+  path = scope["path"]
+  route = getattr(scope.get("route"), "path", None)
+  if not route:
+    return path
+  # Routes of an included router may be stored without the router's prefix.
+  # The prefix has no parameters, so it is the request path minus the route's segments.
+  depth = route.rstrip("/").count("/")
+  segments = path.rstrip("/").split("/")
+  return "/".join(segments[:len(segments) - depth]) + route
+
+
+class SlowRequestLogger:
+  """Log HTTP requests under ``prefix`` that take longer than ``threshold_ms``."""
+
+  def __init__(self, app, threshold_ms: float, prefix: str = "/api/", exclude: Sequence[str] = ()):
+    self.app = app
+    self.threshold = threshold_ms / 1000
+    self.prefix = prefix
+    # Endpoints that are slow by design, like the profiler itself
+    self.exclude = tuple(exclude)
+
+  async def __call__(self, scope, receive, send):
+    if (
+        scope["type"] != "http"
+        or self.threshold <= 0
+        or not scope["path"].startswith(self.prefix)
+        or scope["path"].startswith(self.exclude)
+    ):
+      await self.app(scope, receive, send)
+      return
+    status = [500]
+
+    async def send_wrapper(message):
+      if message["type"] == "http.response.start":
+        status[0] = message["status"]
+      await send(message)
+
+    started = time.perf_counter()
+    try:
+      await self.app(scope, receive, send_wrapper)
+    finally:
+      elapsed = time.perf_counter() - started
+      if elapsed > self.threshold:
+        # Logged under the route template, so requests for different ids group together
+        logger.warning(f"Slow request: {scope['method']} {_route_template(scope)} -> {status[0]} took {elapsed * 1000:.0f}ms")
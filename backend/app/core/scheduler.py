@@ -1,12 +1,283 @@
+"""
+Background job scheduler for the event loop.
+
+Three kinds of job:
+
+* ``every``: periodic. ``fixed_rate`` keeps a run started every ``interval``
+  whatever the runs take, without drift. A run still going when the next one
+  is due is handled by the ``overlap`` policy: ``skip`` drops the new run,
+  ``coalesce`` runs once more as soon as the current run ends, ``allow``
+  starts it concurrently. ``fixed_delay`` waits ``interval`` after each run
+  ends. ``jitter`` adds a random delay, as a fraction of the interval, so
+  jobs with the same interval in several workers spread out.
+* ``consume``: runs a handler for each batch an awaitable source produces
+  (e.g. a price bus subscription).
+* ``supervise``: a long-running coroutine that is restarted if it crashes.
+
+A failing run never kills its job. The error is logged and counted, and the
+job backs off exponentially (``backoff_seconds`` doubling up to
+``max_backoff_seconds``) until a run succeeds. Every job records its run
+durations in a histogram. ``Scheduler.stop`` cancels all jobs and waits for
+them, and is called from the app's lifespan on shutdown.
+"""
 import asyncio
-from collections.abc import Callable, Awaitable
+import logging
+import random
+import time
+from collections.abc import Awaitable, Callable
+from typing import Any, Dict, List, Optional, Set
 
+from .metrics import Histogram, registry
 
-async def start_interval_task(interval_seconds: int, task: Callable[[], Awaitable[None]]):
-  async def _runner():
+logger = logging.getLogger(__name__)
+
+FIXED_RATE, FIXED_DELAY = "fixed_rate", "fixed_delay"
+OVERLAP_POLICIES = ("skip", "coalesce", "allow")
+
+
+class ScheduledTask:
+  def __init__(
+      self,
+      scheduler: "Scheduler",
+      name: str,
+      fn: Callable[..., Awaitable[Any]],
+      interval: float = 0.0,
+      mode: str = FIXED_RATE,
+      jitter: float = 0.0,
+      overlap: str = "skip",
+      backoff_seconds: float = 1.0,
+      max_backoff_seconds: float = 60.0,
+  ):
+    if mode not in (FIXED_RATE, FIXED_DELAY):
+      raise ValueError(f"Unknown schedule mode {mode!r}")
+    if overlap not in OVERLAP_POLICIES:
+      raise ValueError(f"Unknown overlap policy {overlap!r}; expected one of {OVERLAP_POLICIES}")
+    self.scheduler = scheduler
+    self.name = name
+    self.fn = fn
+    self.interval = interval
+    self.mode = mode
+    self.jitter = jitter
+    self.overlap = overlap
+    self.backoff_seconds = backoff_seconds
+    self.max_backoff_seconds = max_backoff_seconds
+    self.durations = Histogram()
+    self.runs = 0
+    self.failures = 0
+    self.consecutive_failures = 0
+    self.skipped = 0
+    self.missed = 0
+    self.restarts = 0
+    self.last_error: Optional[str] = None
+    self.last_run_at: Optional[float] = None
+    self.running = 0
+    self._rerun = False
+    self._runner: Optional[asyncio.Task] = None
+    self._in_flight: Set[asyncio.Task] = set()
+
+  @property
+  def backoff(self) -> float:
+    if not self.consecutive_failures:
+      return 0.0
+    return min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (self.consecutive_failures - 1))
+
+  def _jitter(self) -> float:
+    return random.uniform(0.0, self.jitter * self.interval) if self.jitter else 0.0
+
+  def _failed(self, error: Exception, what: str):
+    self.failures += 1
+    self.consecutive_failures += 1
+    self.last_error = f"{type(error).__name__}: {error}"
+    logger.exception(f"Scheduled task {self.name} {what} ({self.consecutive_failures} in a row)")
+
+  async def _execute(self, *args) -> bool:
+    self.runs += 1
+    self.running += 1
+    self.last_run_at = time.time()
+    started = time.perf_counter()
+    try:
+      await self.fn(*args)
+      self.consecutive_failures = 0
+      return True
+    except asyncio.CancelledError:
+      raise
+    except Exception as e:
+      self._failed(e, "failed")
+      return False
+    finally:
+      self.running -= 1
+      self.durations.observe(time.perf_counter() - started)
+
+  async def _execute_coalesced(self):
+    await self._execute()
+    while self._rerun:
+      self._rerun = False
+      await self._execute()
+
+  def _start_run(self):
+    run = asyncio.create_task(self._execute_coalesced())
+    self._in_flight.add(run)
+    run.add_done_callback(self._in_flight.discard)
+
+  async def _run_periodic(self):
+    loop = asyncio.get_running_loop()
+    next_at = loop.time() + self._jitter()
+    while True:
+      delay = next_at - loop.time()
+      if delay > 0:
+        await asyncio.sleep(delay)
+      if self.mode == FIXED_DELAY:
+        await self._execute()
+        next_at = loop.time() + max(self.interval, self.backoff) + self._jitter()
+        continue
+      if self.running and self.overlap == "skip":
+        self.skipped += 1
+      elif self.running and self.overlap == "coalesce":
+        self._rerun = True
+      else:
+        self._start_run()
+      now = loop.time()
+      next_at += self.interval
+      if next_at <= now:
+        # The loop was blocked past one or more due times: do not fire them all at once
+        missed = int((now - next_at) // self.interval) + 1 if self.interval > 0 else 0
+        self.missed += missed
+        next_at += missed * self.interval
+      if self.consecutive_failures:
+        next_at = max(next_at, now + self.backoff)
+      next_at += self._jitter()
+
+  async def _run_consumer(self, source: Callable[[], Awaitable[Any]]):
     while True:
-      await task()
-      await asyncio.sleep(interval_seconds)
+      try:
+        batch = await source()
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        # Same as a failing handler: count it, back off, keep consuming
+        self._failed(e, "could not get its next batch")
+        await asyncio.sleep(self.backoff)
+        continue
+      if not await self._execute(batch):
+        await asyncio.sleep(self.backoff)
 
-  asyncio.create_task(_runner())
+  async def _run_supervised(self):
+    while True:
+      started = time.monotonic()
+      if await self._execute():
+        # Returned normally: the job is done
+        return
+      if time.monotonic() - started > self.max_backoff_seconds:
+        # Ran fine for a good while before this crash; do not keep escalating the backoff
+        self.consecutive_failures = 1
+      self.restarts += 1
+      await asyncio.sleep(self.backoff)
 
+  def cancel(self):
+    if self._runner is not None:
+      self._runner.cancel()
+    for run in list(self._in_flight):
+      run.cancel()
+    if self.scheduler.tasks.get(self.name) is self:
+      del self.scheduler.tasks[self.name]
+
+  def stats(self) -> dict:
+    return {
+      "mode": self.mode,
+      "interval": self.interval,
+      "runs": self.runs,
+      "running": self.running,
+      "failures": self.failures,
+      "consecutive_failures": self.consecutive_failures,
+      "skipped": self.skipped,
+      "missed": self.missed,
+      "restarts": self.restarts,
+      "last_error": self.last_error,
+      "last_run_at": self.last_run_at,
+      "duration": self.durations.summary(),
+    }
+
+
+class Scheduler:
+  def __init__(self):
+    self.tasks: Dict[str, ScheduledTask] = {}
+
+  def _add(self, task: ScheduledTask, runner: Awaitable[None]) -> ScheduledTask:
+    previous = self.tasks.get(task.name)
+    if previous is not None:
+      previous.cancel()
+    self.tasks[task.name] = task
+    task._runner = asyncio.create_task(runner, name=f"scheduler:{task.name}")
+    return task
+
+  def every(
+      self,
+      name: str,
+      fn: Callable[[], Awaitable[Any]],
+      interval: float,
+      mode: str = FIXED_RATE,
+      jitter: float = 0.0,
+      overlap: str = "skip",
+      backoff_seconds: float = 1.0,
+      max_backoff_seconds: float = 60.0,
+  ) -> ScheduledTask:
+    if mode == FIXED_RATE and interval <= 0:
+      raise ValueError("fixed_rate needs a positive interval")
+    task = ScheduledTask(self, name, fn, interval, mode, jitter, overlap, backoff_seconds, max_backoff_seconds)
+    return self._add(task, task._run_periodic())
+
+  def consume(
+      self,
+      name: str,
+      source: Callable[[], Awaitable[Any]],
+      handler: Callable[[Any], Awaitable[Any]],
+      backoff_seconds: float = 0.1,
+      max_backoff_seconds: float = 5.0,
+  ) -> ScheduledTask:
+    task = ScheduledTask(self, name, handler, mode=FIXED_DELAY, backoff_seconds=backoff_seconds, max_backoff_seconds=max_backoff_seconds)
+    return self._add(task, task._run_consumer(source))
+
+  def supervise(
+      self,
+      name: str,
+      fn: Callable[[], Awaitable[Any]],
+      backoff_seconds: float = 1.0,
+      max_backoff_seconds: float = 60.0,
+  ) -> ScheduledTask:
+    task = ScheduledTask(self, name, fn, mode=FIXED_DELAY, backoff_seconds=backoff_seconds, max_backoff_seconds=max_backoff_seconds)
+    return self._add(task, task._run_supervised())
+
+  async def stop(self, timeout: float = 5.0):
+    """Cancel every job and wait (up to ``timeout``) for their runs to unwind."""
+    pending: List[asyncio.Task] = []
+    for task in list(self.tasks.values()):
+      pending.extend(task._in_flight)
+      if task._runner is not None:
+        pending.append(task._runner)
+      task.cancel()
+    if pending:
+      _, still_running = await asyncio.wait(pending, timeout=timeout)
+      if still_running:
+        logger.warning(f"{len(still_running)} scheduled runs did not stop within {timeout}s")
+
+  def stats(self) -> dict:
+    return {name: task.stats() for name, task in self.tasks.items()}
+
+
+scheduler = Scheduler()
+
+
+@registry.collector
+def _collect():
+  tasks = list(scheduler.tasks.items())
+  return [
+    ("scheduler_run_seconds", "histogram", "Duration of each scheduled run", [({"task": name}, task.durations) for name, task in tasks]),
+    ("scheduler_runs_total", "counter", "Scheduled runs started", [({"task": name}, task.runs) for name, task in tasks]),
+    ("scheduler_failures_total", "counter", "Scheduled runs that raised", [({"task": name}, task.failures) for name, task in tasks]),
+    ("scheduler_skipped_total", "counter", "Runs skipped because the previous one was still going", [({"task": name}, task.skipped) for name, task in tasks]),
+    ("scheduler_missed_total", "counter", "Due times missed while the loop was blocked", [({"task": name}, task.missed) for name, task in tasks]),
+  ]
+
+
+async def start_interval_task(interval_seconds: int, task: Callable[[], Awaitable[None]]):
+  scheduler.every(getattr(task, "__name__", "interval_task"), task, interval_seconds, mode=FIXED_DELAY)
@@ -1,10 +1,15 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 from jose import jwt, JWTError
 from passlib.context import CryptContext
 
+from .cache import TTLCache
 from .config import settings
+from .metrics import Histogram, registry
 
 
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
@@ -18,6 +23,111 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+class PasswordHasher:
+    """
+    Runs pbkdf2 hashing off the event loop on a bounded process (or thread) pool.
+
+    At most ``max_concurrency`` calls are handed to the pool at once; the rest
+    wait on a semaphore and are counted as queued. How long each call waited
+    for a slot and how long it then ran are kept in histograms.
+    """
+
+    def __init__(self, executor: str, workers: int, max_concurrency: int):
+        self.executor_kind = executor
+        self.workers = workers
+        self.max_concurrency = max_concurrency
+        self._executor: Executor | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self.queued = 0
+        self.in_flight = 0
+        self.max_queue_depth = 0
+        self.completed = 0
+        self.wait_seconds = Histogram()
+        self.run_seconds = Histogram()
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pwhash")
+        return self._executor
+
+    async def _run(self, fn, *args):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queued)
+        queued_at = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+        started = time.perf_counter()
+        self.wait_seconds.observe(started - queued_at)
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self.run_seconds.observe(time.perf_counter() - started)
+            self._semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    def stats(self) -> dict:
+        return {
+            "executor": self.executor_kind,
+            "workers": self.workers,
+            "max_concurrency": self.max_concurrency,
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "max_queue_depth": self.max_queue_depth,
+            "completed": self.completed,
+            "wait": self.wait_seconds.summary(),
+            "run": self.run_seconds.summary(),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(
+    executor=settings.PASSWORD_HASH_EXECUTOR,
+    workers=settings.PASSWORD_HASH_WORKERS,
+    max_concurrency=settings.PASSWORD_HASH_MAX_CONCURRENCY,
+)
+
+
+@registry.collector
+def _collect():
+    hasher = password_hasher
+    return [
+        ("password_hash_queued", "gauge", "Hash calls waiting for a pool slot", [({}, hasher.queued)]),
+        ("password_hash_in_flight", "gauge", "Hash calls running in the pool", [({}, hasher.in_flight)]),
+        ("password_hash_max_queue_depth", "gauge", "Most hash calls ever waiting at once", [({}, hasher.max_queue_depth)]),
+        ("password_hash_completed_total", "counter", "Hash and verify calls completed", [({}, hasher.completed)]),
+        ("password_hash_wait_seconds", "histogram", "Time a hash call waited for a pool slot", [({}, hasher.wait_seconds)]),
+        ("password_hash_run_seconds", "histogram", "Time a hash call ran in the pool", [({}, hasher.run_seconds)]),
+    ]
+
+
+async def hash_password_async(password: str) -> str:
+    return await password_hasher.hash(password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.verify(plain_password, hashed_password)
+
+
 def create_access_token(subject: str, expires_minutes: Optional[int] = None) -> str:
   if expires_minutes is None:
     expires_minutes = settings.ACCESS_TOKEN_EXPIRE_MINUTES
@@ -31,7 +141,17 @@ def create_access_token(subject: str, expires_minutes: Optional[int] = None) ->
   return encoded_jwt
 
 
+# token -> subject for signatures that already verified; never outlives the token's exp
+token_cache: TTLCache[str] = TTLCache(
+    max_entries=settings.AUTH_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.AUTH_CACHE_TTL_SECONDS,
+)
+
+
 def decode_token(token: str) -> Optional[str]:
+  cached = token_cache.get(token)
+  if cached is not None:
+    return cached
   try:
     payload = jwt.decode(
         token,
@@ -39,7 +159,21 @@ def decode_token(token: str) -> Optional[str]:
         algorithms=[settings.JWT_ALGORITHM],
     )
     subject: str | None = payload.get("sub")
-    return subject
   except JWTError:
     return None
+  expires_at = payload.get("exp")
+  if subject is not None and expires_at is not None:
+    token_cache.set(token, subject, ttl_seconds=max(0.0, float(expires_at) - time.time()))
+  return subject
+
+
+def token_expires_in(token: str) -> Optional[float]:
+  """Seconds left on a token that has already been verified; None if it has no exp."""
+  expires_at = jwt.get_unverified_claims(token).get("exp")
+  return None if expires_at is None else max(0.0, float(expires_at) - time.time())
+
+
+def invalidate_subject_tokens(subject: str):
+  """Drop cached verifications for every token issued to a subject."""
+  token_cache.remove_if(lambda token, cached: cached == subject)
 
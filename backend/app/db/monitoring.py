@@ -0,0 +1,78 @@
+"""
+Per collection and operation counts and latencies for every Mongo command.
+
+Motor runs pymongo on executor threads, so the command listener is called
+off the event loop. Instead of locking the metrics, the listener only
+appends a tuple to a deque; ``deque.append`` is atomic. The samples are
+folded into the histograms on the loop, at scrape time and by a periodic
+drain.
+"""
+from collections import deque
+from typing import Deque, Dict, Tuple
+
+from pymongo import monitoring
+
+from ..core.metrics import registry
+
+# Driver housekeeping, not application queries
+_IGNORED = {"hello", "ismaster", "isMaster", "ping", "saslStart", "saslContinue", "endSessions", "buildInfo"}
+
+command_seconds = registry.histogram(
+    "mongo_command_seconds",
+    "Mongo command latency",
+    ("collection", "op"),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+command_failures = registry.counter("mongo_command_failures_total", "Mongo commands that failed", ("collection", "op"))
+samples_dropped = registry.counter("mongo_metric_samples_dropped_total", "Samples lost because the buffer was full")
+
+
+class CommandMetrics(monitoring.CommandListener):
+    def __init__(self, buffer_size: int = 100_000):
+        self._collections: Dict[Tuple, str] = {}
+        self._samples: Deque[Tuple[str, str, float, bool]] = deque()
+        self._buffer_size = buffer_size
+
+    def started(self, event):
+        if event.command_name in _IGNORED:
+            return
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else event.command.get("collection", "")
+        self._collections[(event.connection_id, event.request_id)] = collection
+
+    def _record(self, event, ok: bool):
+        collection = self._collections.pop((event.connection_id, event.request_id), None)
+        if collection is None:
+            return
+        if len(self._samples) >= self._buffer_size:
+            samples_dropped.inc()
+            return
+        self._samples.append((collection, event.command_name, event.duration_micros / 1e6, ok))
+
+    def succeeded(self, event):
+        self._record(event, True)
+
+    def failed(self, event):
+        self._record(event, False)
+
+    def drain(self):
+        """Fold buffered samples into the metrics; call on the event loop."""
+        samples = self._samples
+        for _ in range(len(samples)):
+            collection, op, seconds, ok = samples.popleft()
+            command_seconds.labels(collection, op).observe(seconds)
+            if not ok:
+                command_failures.labels(collection, op).inc()
+
+
+command_metrics = CommandMetrics()
+
+
+@registry.collector
+def _collect():
+    command_metrics.drain()
+    return []
+
+
+async def drain_command_metrics():
+    command_metrics.drain()
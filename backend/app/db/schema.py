@@ -0,0 +1,149 @@
+"""
+Indexes for every collection the app queries, and an audit of the hot queries.
+
+``ensure_indexes`` runs once at startup, before any service touches Mongo.
+``create_indexes`` is a no-op for indexes that already exist, so it is cheap
+on every boot. Unique keys are part of correctness, not only speed. For
+example, ``cart (user_id, symbol)`` is what stops two concurrent upserts from
+adding the same stock twice.
+
+``audit_queries`` explains each query in ``HOT_QUERIES`` and reports any
+whose winning plan contains a ``COLLSCAN``. It runs at startup when
+``DB_AUDIT_QUERIES`` is set, and from the command line against any mongod:
+
+    python -m app.db.schema --audit
+"""
+import argparse
+import asyncio
+import logging
+from typing import Dict, List, NamedTuple, Optional
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+    ],
+    "cart": [
+        # Also serves the per-user reads and the {user_id: {$in: [...]}} warm-up
+        IndexModel([("user_id", ASCENDING), ("symbol", ASCENDING)], unique=True, name="user_symbol_unique"),
+    ],
+    "rules": [
+        # Rule index load at startup
+        IndexModel([("active", ASCENDING)], name="active"),
+        # Listing a user's rules; deactivating them when a stock is removed from the cart
+        IndexModel([("user_id", ASCENDING), ("symbol", ASCENDING), ("active", ASCENDING)], name="user_symbol_active"),
+    ],
+    "orders": [
+        # Keyset pagination, newest first
+        IndexModel([("user_id", ASCENDING), ("_id", DESCENDING)], name="user_newest"),
+        IndexModel([("user_id", ASCENDING), ("idempotency_key", ASCENDING)], unique=True, name="user_idempotency_unique"),
+        # Recovery sweep at startup looks for orders that never reached the broker
+        IndexModel([("status", ASCENDING)], name="status"),
+    ],
+    "positions": [
+        IndexModel([("user_id", ASCENDING), ("symbol", ASCENDING)], unique=True, name="user_symbol_unique"),
+    ],
+}
+
+
+class HotQuery(NamedTuple):
+    name: str
+    collection: str
+    filter: dict
+    sort: Optional[dict] = None
+
+
+_USER = "000000000000000000000000"
+
+# Representative shapes of the queries on request and startup paths; the values
+# only need the right types, the planner picks an index from the shape
+HOT_QUERIES: List[HotQuery] = [
+    HotQuery("auth.user_by_email", "users", {"email": "user@example.com"}),
+    HotQuery("cart.user_cart", "cart", {"user_id": _USER}),
+    HotQuery("cart.warm_users", "cart", {"user_id": {"$in": [_USER]}}),
+    HotQuery("cart.item", "cart", {"user_id": _USER, "symbol": "RELIANCE"}),
+    HotQuery("rules.active", "rules", {"active": True}),
+    HotQuery("rules.user_rules", "rules", {"user_id": _USER}),
+    HotQuery("rules.user_symbol_active", "rules", {"user_id": _USER, "symbol": "RELIANCE", "active": True}),
+    HotQuery("orders.page", "orders", {"user_id": _USER, "_id": {"$lt": ObjectId()}}, {"_id": -1}),
+    HotQuery("orders.checkout", "orders", {"user_id": _USER, "checkout_id": "x"}, {"_id": 1}),
+    HotQuery("orders.pending", "orders", {"status": "pending"}, {"_id": 1}),
+    HotQuery("positions.user", "positions", {"user_id": _USER, "symbol": "RELIANCE"}),
+]
+
+
+async def ensure_indexes(db):
+    for collection, indexes in INDEXES.items():
+        try:
+            await db[collection].create_indexes(indexes)
+        except OperationFailure as e:
+            if e.code != DUPLICATE_KEY:
+                raise
+            # Rows written before the unique key existed; the app still runs, but
+            # the key is not enforced until the duplicates are removed
+            logger.error(f"Could not build unique index on {collection}, it has duplicate rows: {e.details.get('errmsg', e)}")
+
+
+def plan_stages(plan: dict) -> List[str]:
+    """Every stage name in an explain plan tree, across the classic and SBE plan layouts."""
+    stages = []
+    pending = [plan]
+    while pending:
+        node = pending.pop()
+        if "stage" in node:
+            stages.append(node["stage"])
+        for key in ("inputStage", "queryPlan", "outerStage", "innerStage"):
+            if isinstance(node.get(key), dict):
+                pending.append(node[key])
+        pending.extend(node.get("inputStages", []))
+    return stages
+
+
+async def explain(db, query: HotQuery) -> dict:
+    command = {"find": query.collection, "filter": query.filter}
+    if query.sort:
+        command["sort"] = query.sort
+    result = await db.command({"explain": command, "verbosity": "queryPlanner"})
+    stages = plan_stages(result["queryPlanner"]["winningPlan"])
+    return {
+        "query": query.name,
+        "collection": query.collection,
+        "stages": stages,
+        "collscan": "COLLSCAN" in stages,
+    }
+
+
+async def audit_queries(db, queries: List[HotQuery] = HOT_QUERIES) -> List[dict]:
+    """Explain each hot query; logs a warning for every one that scans its whole collection."""
+    report = [await explain(db, query) for query in queries]
+    for entry in report:
+        if entry["collscan"]:
+            logger.warning(f"Query {entry['query']} on {entry['collection']} does a COLLSCAN: {' <- '.join(entry['stages'])}")
+    return report
+
+
+async def _main(audit: bool) -> int:
+    from .session import get_db
+
+    db = await get_db()
+    await ensure_indexes(db)
+    if not audit:
+        return 0
+    report = await audit_queries(db)
+    for entry in report:
+        flag = "COLLSCAN" if entry["collscan"] else "ok"
+        print(f"{flag:8} {entry['query']:28} {' <- '.join(entry['stages'])}")
+    return 1 if any(entry["collscan"] for entry in report) else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create indexes and optionally audit hot query plans")
+    parser.add_argument("--audit", action="store_true", help="explain the hot queries and fail on any COLLSCAN")
+    raise SystemExit(asyncio.run(_main(parser.parse_args().audit)))
@@ -1,5 +1,6 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from ..core.config import settings
+from .monitoring import command_metrics
 
 client: AsyncIOMotorClient | None = None
 db = None
@@ -9,7 +10,7 @@ async def get_db():
     global client, db
     if client is None:
         # Connect to Real MongoDB
-        client = AsyncIOMotorClient(settings.MONGO_URI)
+        client = AsyncIOMotorClient(settings.MONGO_URI, event_listeners=[command_metrics])
         db = client.get_default_database()
         print(f"✅ Connected to MongoDB at {settings.MONGO_URI}")
     return db
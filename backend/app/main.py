@@ -1,23 +1,70 @@
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
 from .core.config import settings
-from .api import auth, stocks, cart, orders, rules
+from .core.metrics import registry, watch_loop_lag
+from .core.profiler import SlowRequestLogger
+from .core.scheduler import FIXED_DELAY, scheduler
+from .core.security import password_hasher
+from .api import admin, auth, stocks, cart, orders, rules, portfolio
 from .websocket import price_socket
 from .services.automation_engine import start_automation_loop
-from .services.market_simulator import market_simulator
-import asyncio
+from .services.cluster import start_cluster, stop_cluster
+from .services.market_snapshot import start_market_snapshot
+from .services.matching_engine import start_matching_engine
+from .services.order_pipeline import order_pipeline, start_order_pipeline
+from .services.portfolio import flush_portfolio, start_portfolio
+from .services.tick_store import start_tick_store
+from .db.monitoring import drain_command_metrics
+from .db.schema import audit_queries, ensure_indexes
+from .db.session import get_db
 
 
 from pydantic import BaseModel
 
+logger = logging.getLogger(__name__)
+
 class ContactMessage(BaseModel):
     name: str
     email: str
     subject: str
     message: str
 
-app = FastAPI(title="Stock Trading Backend", version="1.0.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+  db = await get_db()
+  await ensure_indexes(db)
+  if settings.DB_AUDIT_QUERIES:
+    await audit_queries(db)
+  await start_cluster()
+  await start_automation_loop()
+  await price_socket.start_price_stream()
+  await start_market_snapshot()
+  await start_tick_store(db)
+  await start_order_pipeline(db)
+  await start_matching_engine()
+  await start_portfolio(db)
+  scheduler.supervise("loop_lag", watch_loop_lag)
+  scheduler.every("mongo_metrics", drain_command_metrics, 5.0, mode=FIXED_DELAY)
+  yield
+  # Stop the scheduled jobs first so nothing produces work for the services being torn down
+  await scheduler.stop()
+  await order_pipeline.stop()
+  # Before leaving the cluster: the next market leader loads positions from Mongo
+  try:
+    await flush_portfolio(db)
+  except Exception:
+    logger.exception("Failed to flush positions on shutdown")
+  await stop_cluster()
+  password_hasher.shutdown()
+
+
+app = FastAPI(title="Stock Trading Backend", version="1.0.0", lifespan=lifespan)
 
 @app.post("/api/contact")
 async def contact_support(payload: ContactMessage):
@@ -48,6 +95,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(SlowRequestLogger, threshold_ms=settings.SLOW_REQUEST_MS, exclude=("/api/admin/profile",))
 
 
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
@@ -55,11 +103,16 @@ app.include_router(stocks.router, prefix="/api/stocks", tags=["stocks"])
 app.include_router(cart.router, prefix="/api/cart", tags=["cart"])
 app.include_router(orders.router, prefix="/api/orders", tags=["orders"])
 app.include_router(rules.router, prefix="/api/rules", tags=["rules"])
+app.include_router(portfolio.router, prefix="/api/portfolio", tags=["portfolio"])
+app.include_router(admin.router, prefix="/api/admin", tags=["admin"])
 app.include_router(price_socket.router, prefix="/ws", tags=["ws"])
 
 
-@app.on_event("startup")
-async def on_startup():
-  asyncio.create_task(market_simulator.run_forever())
-  await start_automation_loop()
+@app.get("/api/scheduler")
+async def scheduler_stats():
+  return scheduler.stats()
+
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+  return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,62 @@
+from typing import Literal, Optional
+
+from pydantic import BaseModel, Field, model_validator
+
+
+class Order(BaseModel):
+    id: str
+    symbol: str
+    name: str
+    price: float
+    quantity: int
+    side: str = "buy"
+    # pending -> processing -> the broker's status (filled, open, rejected) | failed, set by the broker-submission workers
+    status: str = "pending"
+    checkout_id: str
+    created_at: float
+    attempts: int = 0
+    broker_ref: Optional[str] = None
+    error: Optional[str] = None
+    fill_price: Optional[float] = None
+
+
+class OrderPage(BaseModel):
+    items: list[Order]
+    # Pass back as ?cursor= to get the next (older) page; None on the last page
+    next_cursor: Optional[str] = None
+
+
+class CheckoutResponse(BaseModel):
+    status: str
+    checkout_id: str
+    orders: list[Order]
+
+
+class PaperOrderCreate(BaseModel):
+    symbol: str
+    side: Literal["buy", "sell"]
+    kind: Literal["market", "limit", "stop"] = "market"
+    quantity: int = Field(gt=0)
+    price: Optional[float] = None
+    stop_price: Optional[float] = None
+
+    @model_validator(mode="after")
+    def check_prices(self):
+        if self.kind == "limit" and self.price is None:
+            raise ValueError("price is required for limit orders")
+        if self.kind == "stop" and self.stop_price is None:
+            raise ValueError("stop_price is required for stop orders")
+        return self
+
+
+class PaperOrder(BaseModel):
+    id: str
+    symbol: str
+    side: str
+    kind: str
+    price: Optional[float] = None
+    stop_price: Optional[float] = None
+    quantity: int
+    filled: int
+    avg_price: Optional[float] = None
+    status: str
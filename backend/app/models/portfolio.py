@@ -0,0 +1,19 @@
+from pydantic import BaseModel
+
+
+class PositionOut(BaseModel):
+    symbol: str
+    quantity: int
+    avg_cost: float
+    price: float
+    market_value: float
+    unrealized_pnl: float
+    realized_pnl: float
+
+
+class PortfolioResponse(BaseModel):
+    positions: list[PositionOut]
+    market_value: float
+    cost_basis: float
+    unrealized_pnl: float
+    realized_pnl: float
@@ -1,18 +1,51 @@
-from pydantic import BaseModel
+from typing import Literal, Optional
+
+from pydantic import BaseModel, model_validator
+
+Indicator = Literal["price", "sma_cross", "ema_cross", "rsi", "pct_change"]
 
 
 class RuleCreate(BaseModel):
     symbol: str
-    min_price: float
-    max_price: float
+    # "price" is the classic min/max price band. Indicator rules fire while the
+    # indicator is within [min_value, max_value]; either bound may be left open.
+    # Crossovers use window as the fast and slow_window as the slow average and
+    # their value is fast - slow, so min_value=0 means "fast above slow".
+    indicator: Indicator = "price"
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    window: Optional[int] = None
+    slow_window: Optional[int] = None
+    min_value: Optional[float] = None
+    max_value: Optional[float] = None
     quantity: int = 1
 
+    @model_validator(mode="after")
+    def check_indicator_fields(self):
+        if self.indicator == "price":
+            if self.min_price is None or self.max_price is None:
+                raise ValueError("min_price and max_price are required for price rules")
+            return self
+        if not self.window or self.window < 1:
+            raise ValueError(f"window is required for {self.indicator} rules")
+        if self.indicator in ("sma_cross", "ema_cross"):
+            if not self.slow_window or self.slow_window <= self.window:
+                raise ValueError("slow_window must be greater than window")
+        if self.min_value is None and self.max_value is None:
+            raise ValueError("min_value or max_value is required for indicator rules")
+        return self
+
 
 class RuleInDB(BaseModel):
     id: str
     user_id: str
     symbol: str
-    min_price: float
-    max_price: float
+    indicator: Indicator = "price"
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    window: Optional[int] = None
+    slow_window: Optional[int] = None
+    min_value: Optional[float] = None
+    max_value: Optional[float] = None
     quantity: int
     active: bool = True
@@ -1,85 +1,324 @@
 import logging
-from bson import ObjectId
-from ..core.scheduler import start_interval_task
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, List, Optional, Set, Tuple
+
+from pymongo import DeleteOne, InsertOne, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from ..core.config import settings
+from ..core.events import PriceTick, Subscription, price_bus
+from ..core.metrics import registry
+from ..core.scheduler import scheduler
 from ..db.session import get_db
 from ..models.cart import CartItem
+from ..services.cart_cache import bot_adds, bot_removes, cart_cache, load_cart_cache
+from ..services.indicators import indicator_registry
+from ..services.rule_index import IndexedRule, SymbolMatch, load_rule_index, rule_index
+from ..services.sharding import shard_map
 from ..services.stock_fetcher import fetch_live_price
 from ..websocket.price_socket import manager
 
 logger = logging.getLogger(__name__)
-INTERVAL_SECONDS = 5
+_subscription: Optional[Subscription] = None
+
+DUPLICATE_KEY = 11000
+
+# Called with (user_id, kind) whenever a user's cart ("cart") or rules ("rules")
+# change in this worker; services.cluster relays them to the other workers
+user_change_listeners: List[Callable[[str, str], None]] = []
+
+
+@dataclass
+class TickStats:
+    """Bookkeeping for one automation tick (and running totals across ticks)."""
+    ticks: int = 0
+    symbols: int = 0
+    rules_evaluated: int = 0
+    writes: int = 0
+    collapsed: int = 0
+    skipped: int = 0
+    round_trips: int = 0
+
+    def add(self, other: "TickStats"):
+        self.ticks += other.ticks
+        self.symbols += other.symbols
+        self.rules_evaluated += other.rules_evaluated
+        self.writes += other.writes
+        self.collapsed += other.collapsed
+        self.skipped += other.skipped
+        self.round_trips += other.round_trips
+
+
+@dataclass
+class _TickPlan:
+    ops: list = field(default_factory=list)
+    # (index of the op it reports, user, message type, item)
+    notifications: List[Tuple[int, str, str, CartItem]] = field(default_factory=list)
+    users: Set[str] = field(default_factory=set)
+    skipped: int = 0
+    rejected: int = 0
+
+
+last_tick_stats = TickStats()
+total_tick_stats = TickStats()
+
+tick_duration = registry.histogram("automation_tick_seconds", "Time to evaluate one batch of price ticks")
+rules_per_tick = registry.histogram(
+    "automation_rules_per_tick",
+    "Rules evaluated per automation tick",
+    buckets=(0, 1, 10, 100, 1_000, 10_000, 100_000, 1_000_000),
+)
+rules_evaluated = registry.counter("automation_rules_evaluated_total", "Rules evaluated by the automation engine")
+cart_writes = registry.counter("automation_cart_writes_total", "Cart writes issued by the automation engine")
+
+
+def _plan_match(plan: _TickPlan, match: SymbolMatch, stock: PriceTick):
+    symbol = match.symbol
+
+    for rule in match.entered:
+        user_id = rule.user_id
+        # Check if item is already in cart for this user
+        cart_item = cart_cache.peek(user_id, symbol)
+
+        if not cart_item:
+            # Stock entered range: Add with specified quantity and tag as auto_added
+            doc = {
+                "user_id": user_id,
+                "symbol": symbol,
+                "name": stock.name,
+                "price": stock.price,
+                "quantity": rule.quantity,
+                "auto_added": True
+            }
+            plan.ops.append(InsertOne(doc))
+            plan.users.add(user_id)
+            plan.notifications.append((len(plan.ops) - 1, user_id, "cart_add", CartItem(
+                symbol=symbol,
+                name=stock.name,
+                price=stock.price,
+                quantity=rule.quantity,
+                auto_added=True
+            )))
+            # Write-through; also stops a second rule of the same user adding it twice
+            cart_cache.set_item(user_id, doc)
+        elif cart_item.get("price") != stock.price:
+            plan.ops.append(UpdateOne({"user_id": user_id, "symbol": symbol}, {"$set": {"price": stock.price}}))
+            cart_cache.set_price(user_id, symbol, stock.price)
+            plan.users.add(user_id)
+        else:
+            plan.skipped += 1
+
+    for rule in match.exited:
+        user_id = rule.user_id
+        cart_item = cart_cache.peek(user_id, symbol)
+        if cart_item and cart_item.get("auto_added"):
+            # It was added by the bot and is now out of range: AUTO-REMOVE
+            plan.ops.append(DeleteOne({"user_id": user_id, "symbol": symbol, "auto_added": True}))
+            plan.notifications.append((len(plan.ops) - 1, user_id, "cart_remove", CartItem(
+                symbol=symbol,
+                name=stock.name,
+                price=stock.price,
+                quantity=cart_item.get("quantity", 1),
+                auto_added=True
+            )))
+            cart_cache.remove_item(user_id, symbol)
+            plan.users.add(user_id)
+
+    # Still in range: keep the cart price of every matching user current,
+    # only writing the rows whose cached price is stale
+    stale_users = []
+    for rule in match.inside:
+        cart_item = cart_cache.peek(rule.user_id, symbol)
+        if cart_item is None:
+            continue
+        if cart_item.get("price") == stock.price:
+            plan.skipped += 1
+            continue
+        cart_cache.set_price(rule.user_id, symbol, stock.price)
+        stale_users.append(rule.user_id)
+    if stale_users:
+        plan.users.update(stale_users)
+        plan.ops.append(UpdateMany(
+            {"symbol": symbol, "user_id": {"$in": stale_users}},
+            {"$set": {"price": stock.price}}
+        ))
+
+
+def _retry_users(user_ids: Iterable[str]):
+    # The index already recorded this tick's enters and exits; without a full
+    # re-evaluation the lost cart writes would wait for the band to be crossed again
+    for user_id in user_ids:
+        rule_index.mark_pending(user_id)
+
 
-async def _automation_tick():
+async def _automation_tick(ticks: List[PriceTick]):
+    global last_tick_stats
+    started = time.perf_counter()
     db = await get_db()
-    # Continuous monitoring: we keep rules active unless deleted
-    cursor = db["rules"].find({"active": True})
-    
-    async for rule in cursor:
-        symbol = rule["symbol"]
-        user_id = str(rule["user_id"])
+    stats = TickStats(ticks=len(ticks))
+
+    # Indicators see every tick in order; rules only need the latest price per symbol
+    latest = {}
+    for tick in ticks:
+        indicator_registry.update(tick.symbol, tick.price, tick.timestamp)
+        latest[tick.symbol] = tick
+
+    # Only series that have active rules and whose value moved (or that have
+    # rules awaiting a first evaluation) are looked at; within a series the
+    # index hands back just the rules that crossed a boundary.
+    evaluated: List[Tuple[SymbolMatch, PriceTick]] = []
+    for tick in latest.values():
+        matches = rule_index.evaluate(tick.symbol, tick.price)
+        if matches:
+            stats.symbols += 1
+        for match in matches:
+            evaluated.append((match, tick))
+            stats.rules_evaluated += len(match.entered) + len(match.exited) + len(match.inside)
+
+    # Users with active rules are pinned in the cart cache; this only reads
+    # Mongo if one somehow is not resident
+    await cart_cache.ensure_users(db, (
+        rule.user_id for match, _ in evaluated for rule in (*match.entered, *match.exited)
+    ))
+
+    plan = _TickPlan()
+    for match, tick in evaluated:
+        _plan_match(plan, match, tick)
+
+    # Every cart mutation of this tick goes to Mongo in one round trip
+    if plan.ops:
+        try:
+            await db["cart"].bulk_write(plan.ops, ordered=False)
+        except BulkWriteError as e:
+            # A duplicate key means the row was added elsewhere first (a manual add,
+            # or another worker just before a rebalance); the rest of the batch applied
+            for user_id in plan.users:
+                cart_cache.invalidate(user_id)
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != DUPLICATE_KEY for error in errors):
+                _retry_users(plan.users)
+                raise
+            # Nothing happened for the rejected ops, so there is nothing to tell their users
+            rejected = {error["index"] for error in errors}
+            plan.notifications = [n for n in plan.notifications if n[0] not in rejected]
+            plan.rejected = len(rejected)
+        except Exception:
+            # The cache was updated optimistically; let these users reload from Mongo
+            for user_id in plan.users:
+                cart_cache.invalidate(user_id)
+            _retry_users(plan.users)
+            raise
+        stats.round_trips += 1
+        for user_id in plan.users:
+            user_changed(user_id, "cart")
+    stats.writes = len(plan.ops) - plan.rejected
+    stats.collapsed = max(0, len(plan.ops) - 1)
+    stats.skipped = plan.skipped
+
+    for _, user_id, message_type, item in plan.notifications:
+        if message_type == "cart_add":
+            bot_adds.inc()
+            logger.info(f"Bot ADDED {item.symbol} (₹{item.price}) for user {user_id}")
+        else:
+            bot_removes.inc()
+            logger.info(f"Bot REMOVED {item.symbol} (₹{item.price} - out of range) for user {user_id}")
+        # Notify frontend of the change
+        await manager.broadcast_price_update(user_id=user_id, message_type=message_type, item=item)
+
+    last_tick_stats = stats
+    total_tick_stats.add(stats)
+    elapsed = time.perf_counter() - started
+    tick_duration.observe(elapsed)
+    if settings.SLOW_TICK_MS > 0 and elapsed * 1000 > settings.SLOW_TICK_MS:
+        logger.warning(
+            f"Slow automation tick: {elapsed * 1000:.0f}ms for {stats.ticks} ticks, {stats.symbols} symbols, "
+            f"{stats.rules_evaluated} rules evaluated, {stats.writes} cart writes in {stats.round_trips} round trips"
+        )
+    rules_per_tick.observe(stats.rules_evaluated)
+    rules_evaluated.inc(stats.rules_evaluated)
+    cart_writes.inc(stats.writes)
+
+
+async def request_evaluation(symbol: str):
+    """Evaluate a symbol at its current price even if it has not moved, e.g. after a rule was added."""
+    if _subscription is None:
+        return
+    # Re-deliver the last published tick when there is one: indicators skip a
+    # timestamp they have already seen, so this does not count as a new sample
+    tick = price_bus.last.get(symbol)
+    if tick is None:
         stock = await fetch_live_price(symbol)
-        
         if stock is None:
-            continue
-            
-        in_range = rule["min_price"] <= stock.price <= rule["max_price"]
-        
-        # Check if item is already in cart for this user
-        cart_item = await db["cart"].find_one({"user_id": user_id, "symbol": symbol})
-        
-        if in_range:
-            if not cart_item:
-                # Stock entered range: Add with specified quantity and tag as auto_added
-                quantity = rule.get("quantity", 1)
-                await db["cart"].insert_one({
-                    "user_id": user_id,
-                    "symbol": symbol,
-                    "name": stock.name,
-                    "price": stock.price,
-                    "quantity": quantity,
-                    "auto_added": True
-                })
-                
-                logger.info(f"Bot ADDED {symbol} (₹{stock.price}) for user {user_id}")
-                
-                # Notify frontend of ADDITION
-                await manager.broadcast_price_update(
-                    user_id=user_id,
-                    message_type="cart_add",
-                    item=CartItem(
-                        symbol=symbol, 
-                        name=stock.name, 
-                        price=stock.price,
-                        quantity=quantity,
-                        auto_added=True
-                    )
-                )
-            else:
-                # Already in cart, just keep price updated if it's there
-                await db["cart"].update_one(
-                    {"_id": cart_item["_id"]},
-                    {"$set": {"price": stock.price}}
-                )
-        else:
-            # Stock is OUT of range
-            if cart_item and cart_item.get("auto_added"):
-                # It was added by the bot and is now out of range: AUTO-REMOVE
-                await db["cart"].delete_one({"_id": cart_item["_id"]})
-                
-                logger.info(f"Bot REMOVED {symbol} (₹{stock.price} - out of range) for user {user_id}")
-                
-                # Notify frontend of REMOVAL
-                await manager.broadcast_price_update(
-                    user_id=user_id,
-                    message_type="cart_remove",
-                    item=CartItem(
-                        symbol=symbol, 
-                        name=stock.name, 
-                        price=stock.price,
-                        quantity=cart_item.get("quantity", 1),
-                        auto_added=True
-                    )
-                )
+            return
+        tick = PriceTick.from_stock(stock)
+    _subscription.put_nowait(tick)
+
+
+def user_changed(user_id: str, kind: str):
+    for listener in user_change_listeners:
+        try:
+            listener(user_id, kind)
+        except Exception:
+            logger.exception("User change listener failed")
+
+
+async def _reevaluate(user_ids: Iterable[str]):
+    symbols = set()
+    for user_id in user_ids:
+        rule_index.mark_pending(user_id)
+        symbols |= rule_index.user_symbols(user_id)
+    for symbol in symbols:
+        await request_evaluation(symbol)
+
+
+async def sync_user_rules(db, user_id: str):
+    """Reload one user's rules from Mongo if this worker owns the user, otherwise drop them."""
+    rule_index.remove_user(user_id)
+    cart_cache.invalidate(user_id)
+    if not shard_map.owns(user_id):
+        return
+    async for doc in db["rules"].find({"user_id": user_id, "active": True}):
+        rule_index.add(IndexedRule.from_doc(doc))
+    await cart_cache.ensure_users(db, [user_id])
+    await _reevaluate([user_id])
+
+
+async def on_cart_changed(db, user_id: str):
+    """Another worker changed this user's cart: drop the cached copy, re-check their rules if owned here."""
+    cart_cache.invalidate(user_id)
+    if rule_index.has_user(user_id):
+        await cart_cache.ensure_users(db, [user_id])
+        await _reevaluate([user_id])
+
+
+async def rebalance_rules(db):
+    """After cluster membership changed: drop users now owned elsewhere, load the ones gained."""
+    dropped = [user_id for user_id in rule_index.user_ids() if not shard_map.owns(user_id)]
+    for user_id in dropped:
+        rule_index.remove_user(user_id)
+    present = set(rule_index.user_ids())
+    docs = [
+        doc async for doc in db["rules"].find({"active": True})
+        if doc["user_id"] not in present and shard_map.owns(doc["user_id"])
+    ]
+    for doc in docs:
+        rule_index.add(IndexedRule.from_doc(doc))
+    gained = {doc["user_id"] for doc in docs}
+    await cart_cache.ensure_users(db, gained)
+    await _reevaluate(gained)
+    logger.info(f"Rebalanced rules: dropped {len(dropped)} users, gained {len(gained)}, now {len(rule_index)} rules")
+
 
 async def start_automation_loop():
-    await start_interval_task(INTERVAL_SECONDS, _automation_tick)
+    global _subscription
+    db = await get_db()
+    await load_rule_index(db)
+    # Loaded after the rule index so users with active rules are kept resident
+    await load_cart_cache(db)
+    # React to price changes as they are published instead of polling every rule on a timer
+    _subscription = price_bus.subscribe()
+    # Every tick in order, one batch per run; a failing tick is logged and backed off, not fatal
+    scheduler.consume("automation", lambda: _subscription.get_batch(coalesce=False), _automation_tick)
+    for symbol in rule_index.symbols():
+        await request_evaluation(symbol)
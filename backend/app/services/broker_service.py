@@ -1,3 +1,16 @@
-async def place_order_for_user(user_id: str, symbol: str, quantity: int):
-  return {"status": "placed", "symbol": symbol, "quantity": quantity}
+from .cluster import on_market_leader
+from .matching_engine import BUY, MARKET
+
 
+async def place_order_for_user(user_id: str, symbol: str, quantity: int):
+  # Paper trading: cart orders are market buys on the matching engine, which
+  # lives on the market leader. LeaderUnavailable is retried by the pipeline.
+  order = await on_market_leader("paper_submit", user_id=user_id, symbol=symbol, side=BUY, quantity=quantity, kind=MARKET)
+  return {
+      "status": order["status"],
+      "order_id": order["id"],
+      "symbol": symbol,
+      "quantity": quantity,
+      "filled": order["filled"],
+      "avg_price": order["avg_price"],
+  }
@@ -0,0 +1,167 @@
+"""
+Write-through, in-process cache of every user's cart.
+
+Mongo stays the durable store: callers write to Mongo first and then mirror the
+change here. Reads (GET /api/cart and the automation engine) are served from
+memory. Users with active rules are never evicted so rule evaluation does not
+need to read the cart collection.
+"""
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional
+
+from ..core.config import settings
+from ..core.metrics import registry
+from ..services.rule_index import rule_index
+
+logger = logging.getLogger(__name__)
+
+cart_operations = registry.counter("cart_operations_total", "Cart changes by operation and who made them", ("op", "source"))
+manual_adds = cart_operations.labels("add", "manual")
+manual_removes = cart_operations.labels("remove", "manual")
+checkouts = cart_operations.labels("checkout", "manual")
+bot_adds = cart_operations.labels("add", "bot")
+bot_removes = cart_operations.labels("remove", "bot")
+
+CART_FIELDS = ("symbol", "name", "price", "quantity", "auto_added")
+
+
+def _entry(doc: dict) -> dict:
+    entry = {key: doc.get(key) for key in CART_FIELDS}
+    entry["quantity"] = doc.get("quantity", 1)
+    entry["auto_added"] = doc.get("auto_added", False)
+    return entry
+
+
+class CartCache:
+    def __init__(self, max_users: int, is_pinned: Callable[[str], bool] = lambda user_id: False):
+        self.max_users = max_users
+        self._is_pinned = is_pinned
+        self._users: "OrderedDict[str, Dict[str, dict]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._users
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def _store(self, user_id: str, items: Dict[str, dict]):
+        self._users[user_id] = items
+        self._users.move_to_end(user_id)
+        self._evict()
+
+    def _evict(self):
+        if len(self._users) <= self.max_users:
+            return
+        # Walk from least recently used; users with active rules stay resident
+        for user_id in list(self._users.keys()):
+            if len(self._users) <= self.max_users:
+                break
+            if self._is_pinned(user_id):
+                continue
+            del self._users[user_id]
+            self.evictions += 1
+
+    async def get_user_cart(self, db, user_id: str) -> Dict[str, dict]:
+        items = self._users.get(user_id)
+        if items is not None:
+            self.hits += 1
+            self._users.move_to_end(user_id)
+            return items
+        self.misses += 1
+        items = {doc["symbol"]: _entry(doc) async for doc in db["cart"].find({"user_id": user_id})}
+        self._store(user_id, items)
+        return items
+
+    async def ensure_users(self, db, user_ids: Iterable[str]):
+        """Load any of the given users that are not resident, in one query."""
+        missing = [user_id for user_id in set(user_ids) if user_id not in self._users]
+        if not missing:
+            return
+        self.misses += len(missing)
+        loaded: Dict[str, Dict[str, dict]] = {user_id: {} for user_id in missing}
+        async for doc in db["cart"].find({"user_id": {"$in": missing}}):
+            loaded[doc["user_id"]][doc["symbol"]] = _entry(doc)
+        for user_id, items in loaded.items():
+            self._store(user_id, items)
+
+    def peek(self, user_id: str, symbol: str) -> Optional[dict]:
+        items = self._users.get(user_id)
+        if items is None:
+            return None
+        self.hits += 1
+        return items.get(symbol)
+
+    def set_item(self, user_id: str, doc: dict):
+        items = self._users.get(user_id)
+        if items is None:
+            # Not resident: the next read will load the durable copy from Mongo
+            return
+        items[doc["symbol"]] = _entry(doc)
+
+    def set_price(self, user_id: str, symbol: str, price: float):
+        item = self._users.get(user_id, {}).get(symbol)
+        if item is not None:
+            item["price"] = price
+
+    def remove_item(self, user_id: str, symbol: str):
+        items = self._users.get(user_id)
+        if items is not None:
+            items.pop(symbol, None)
+
+    def remove_bought(self, user_id: str, quantities: Dict[str, int]):
+        """Take checked-out quantities off the cart; whatever was added since stays."""
+        items = self._users.get(user_id)
+        if items is None:
+            return
+        for symbol, quantity in quantities.items():
+            item = items.get(symbol)
+            if item is None:
+                continue
+            item["quantity"] -= quantity
+            if item["quantity"] <= 0:
+                del items[symbol]
+
+    def invalidate(self, user_id: str):
+        self._users.pop(user_id, None)
+
+    def load(self, docs: Iterable[dict], user_ids: Iterable[str] = ()):
+        self._users.clear()
+        # Users with rules but an empty cart are resident too, so a miss never means "not loaded"
+        for user_id in user_ids:
+            self._users[user_id] = {}
+        for doc in docs:
+            self._users.setdefault(doc["user_id"], {})[doc["symbol"]] = _entry(doc)
+        self._evict()
+        logger.info(f"Cart cache loaded {len(self._users)} users.")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "users": len(self._users),
+            "max_users": self.max_users,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+cart_cache = CartCache(max_users=settings.CART_CACHE_MAX_USERS, is_pinned=rule_index.has_user)
+
+
+@registry.collector
+def _collect():
+    return [
+        ("cart_cache_users", "gauge", "Users whose cart is resident", [({}, len(cart_cache))]),
+        ("cart_cache_hits_total", "counter", "Cart reads served from memory", [({}, cart_cache.hits)]),
+        ("cart_cache_misses_total", "counter", "Cart reads that went to Mongo", [({}, cart_cache.misses)]),
+    ]
+
+
+async def load_cart_cache(db):
+    docs = [doc async for doc in db["cart"].find({})]
+    cart_cache.load(docs, user_ids=rule_index.user_ids())
@@ -0,0 +1,373 @@
+"""
+Running several uvicorn workers (or nodes) as one app, coordinated over Redis.
+
+Without ``REDIS_URL`` nothing changes: the process runs the market itself and
+delivers notifications to its own sockets. With it:
+
+* Only the worker holding the ``market`` lease runs ``market_simulator``. It
+  forwards every batch of ticks it publishes on the ``ticks`` channel. The
+  other workers apply those ticks to their own simulator arrays and republish
+  them on their local ``price_bus``. Every consumer (websockets, snapshot,
+  rules, matching) therefore sees one market, whichever worker it is in. If
+  the leader dies, another worker takes the lease and continues from the last
+  relayed prices.
+* ``manager.notify_user`` delivers locally and also relays the message on the
+  ``user`` channel. Each worker delivers relayed messages to whatever sockets
+  that user has open there. A notification raised in one worker therefore
+  reaches a socket held by another.
+* Rule evaluation is sharded by user (see ``services/sharding.py``). Each
+  worker indexes and evaluates only the rules of the users it owns, so
+  evaluation throughput grows with the number of workers. Cart and rule
+  changes made through the API of one worker are announced on the same
+  channel. The owner reloads that user's rules, and every worker drops its
+  cached copy of the cart. When membership changes, workers drop the users
+  they lost and load the ones they gained. A dead worker's users move within
+  ``CLUSTER_MEMBER_TTL_SECONDS``.
+* The paper exchange (``matching_engine``) and the positions built from its
+  fills (``portfolio_book``) exist once, on the ``market`` lease holder.
+  ``on_market_leader`` runs a paper order, cancel, book or portfolio read
+  there: locally on the leader, and from any other worker as a request on the
+  ``rpc`` channel answered on that worker's ``reply`` channel, including the
+  market orders of the broker order pipeline. On taking the lease a worker
+  reloads positions from Mongo and starts applying fills and flushing them.
+  On losing it, it flushes its positions, stops both and drops its books.
+* The broker order pipeline runs in every worker on the checkouts it took.
+  Orders are claimed in Mongo before they are placed, so the recovery sweep
+  of several workers does not place one twice.
+
+Relayed messages are buffered and published in batches, one message per
+flush. ``notify_user`` stays synchronous, and a burst costs one round trip.
+"""
+import asyncio
+import logging
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from ..core.config import settings
+from ..core.events import PriceTick, price_bus
+from ..core.scheduler import scheduler
+from ..db.session import get_db
+from ..services.automation_engine import on_cart_changed, rebalance_rules, sync_user_rules, user_change_listeners
+from ..services.leases import RedisLease
+from ..services.market_simulator import market_simulator
+from ..services.matching_engine import book_depth, cancel_paper_order, matching_engine, submit_paper_order
+from ..services.portfolio import activate_portfolio, deactivate_portfolio, portfolio_summary
+from ..services.rule_index import rule_index
+from ..services.sharding import Membership, shard_map, worker_id
+from ..websocket.codec import dumps
+from ..websocket.price_socket import manager
+
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    import json
+    loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+# Operations that must run where the paper exchange lives; see on_market_leader
+LEADER_OPERATIONS: Dict[str, Callable[..., Awaitable[Any]]] = {
+    "paper_submit": submit_paper_order,
+    "paper_cancel": cancel_paper_order,
+    "book_depth": book_depth,
+    "portfolio": portfolio_summary,
+}
+
+
+class LeaderUnavailable(RuntimeError):
+    pass
+
+
+def _key(key) -> Optional[Hashable]:
+    # Coalescing keys are tuples; JSON brings them back as lists
+    if isinstance(key, list):
+        return tuple(_key(part) for part in key)
+    return key
+
+
+class RedisFanout:
+    def __init__(self, redis, worker: str, prefix: str = "stockapp", outbox_size: int = 10000):
+        self.redis = redis
+        self.worker = worker
+        self.prefix = prefix
+        self.tick_channel = f"{prefix}:ticks"
+        self.user_channel = f"{prefix}:user"
+        self.rpc_channel = f"{prefix}:rpc"
+        self.reply_channel = f"{prefix}:reply:{worker}"
+        self.market_lease = RedisLease(redis, f"{prefix}:lease:market", worker, settings.CLUSTER_LEASE_SECONDS)
+        self.membership = Membership(redis, f"{prefix}:members", shard_map, settings.CLUSTER_MEMBER_TTL_SECONDS)
+        self._outbox: List[list] = []
+        self._events: List[list] = []
+        self._outbox_size = outbox_size
+        self._outbox_ready = asyncio.Event()
+        self._inbound_events: asyncio.Queue = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._serving: set = set()
+        self.ticks_out = 0
+        self.ticks_in = 0
+        self.notifications_out = 0
+        self.notifications_in = 0
+        self.events_out = 0
+        self.events_in = 0
+        self.outbox_dropped = 0
+        self.publish_errors = 0
+        self.calls_out = 0
+        self.calls_served = 0
+        self.call_timeouts = 0
+
+    def relay(self, user_id: str, message: dict, key: Optional[Hashable] = None):
+        """Queue a notification for the other workers; called from ``manager.notify_user``."""
+        if len(self._outbox) >= self._outbox_size:
+            self.outbox_dropped += 1
+            return
+        self._outbox.append([user_id, message, key])
+        self._outbox_ready.set()
+
+    def relay_event(self, user_id: str, kind: str):
+        """Announce that a user's cart or rules changed here; a ``user_change_listeners`` entry."""
+        self._events.append([kind, user_id])
+        self._outbox_ready.set()
+
+    async def _flush_outbox(self):
+        while True:
+            await self._outbox_ready.wait()
+            self._outbox_ready.clear()
+            batch, self._outbox = self._outbox, []
+            events, self._events = self._events, []
+            if not batch and not events:
+                continue
+            try:
+                await self.redis.publish(self.user_channel, dumps({"origin": self.worker, "items": batch, "events": events}))
+                self.notifications_out += len(batch)
+                self.events_out += len(events)
+            except Exception as e:
+                self.publish_errors += 1
+                logger.warning(f"Dropped {len(batch)} relayed notifications and {len(events)} events: {e}")
+
+    async def _forward_ticks(self):
+        subscription = price_bus.subscribe()
+        while True:
+            # Every tick in order: followers apply exactly what the leader published
+            ticks = await subscription.get_batch(coalesce=False)
+            if not self.market_lease.held:
+                continue
+            payload = [[t.symbol, t.name, t.price, t.change, t.timestamp] for t in ticks]
+            try:
+                await self.redis.publish(self.tick_channel, dumps({"origin": self.worker, "ticks": payload}))
+                self.ticks_out += len(payload)
+            except Exception as e:
+                self.publish_errors += 1
+                logger.warning(f"Failed to forward {len(payload)} ticks: {e}")
+
+    def _apply_ticks(self, data: dict):
+        if data["origin"] == self.worker or self.market_lease.held:
+            return
+        for symbol, name, price, change, timestamp in data["ticks"]:
+            market_simulator.apply_tick(symbol, price, change)
+            price_bus.publish(PriceTick(symbol=symbol, name=name, price=price, change=change, timestamp=timestamp))
+        self.ticks_in += len(data["ticks"])
+
+    def _deliver(self, data: dict):
+        if data["origin"] == self.worker:
+            return
+        for user_id, message, key in data["items"]:
+            manager.deliver(user_id, message, _key(key))
+        self.notifications_in += len(data["items"])
+        for event in data.get("events", ()):
+            self._inbound_events.put_nowait(event)
+
+    async def _apply_events(self):
+        # One at a time, in arrival order, so a user's changes are applied in sequence
+        while True:
+            kind, user_id = await self._inbound_events.get()
+            self.events_in += 1
+            try:
+                db = await get_db()
+                if kind == "rules":
+                    await sync_user_rules(db, user_id)
+                else:
+                    await on_cart_changed(db, user_id)
+            except Exception:
+                logger.exception(f"Failed to apply {kind} change for user {user_id}")
+
+    async def call(self, operation: str, timeout: float = 5.0, **kwargs) -> Any:
+        """Run a ``LEADER_OPERATIONS`` entry on the market leader and return its result."""
+        call_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._calls[call_id] = future
+        self.calls_out += 1
+        try:
+            await self.redis.publish(self.rpc_channel, dumps({
+                "id": call_id, "origin": self.worker, "op": operation, "kwargs": kwargs,
+            }))
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.call_timeouts += 1
+            raise LeaderUnavailable(f"No market leader answered {operation} within {timeout}s")
+        finally:
+            self._calls.pop(call_id, None)
+
+    async def _serve(self, data: dict):
+        try:
+            reply = {"id": data["id"], "result": await LEADER_OPERATIONS[data["op"]](**data["kwargs"])}
+        except Exception as e:
+            logger.exception(f"Forwarded {data['op']} failed")
+            reply = {"id": data["id"], "error": f"{type(e).__name__}: {e}"}
+        self.calls_served += 1
+        await self.redis.publish(f"{self.prefix}:reply:{data['origin']}", dumps(reply))
+
+    def _on_call(self, data: dict):
+        # Only the leader answers; everyone else sees the request and ignores it
+        if not self.market_lease.held:
+            return
+        task = asyncio.create_task(self._serve(data))
+        self._serving.add(task)
+        task.add_done_callback(self._serving.discard)
+
+    def _on_reply(self, data: dict):
+        future = self._calls.get(data["id"])
+        if future is None or future.done():
+            return
+        if "error" in data:
+            future.set_exception(RuntimeError(data["error"]))
+        else:
+            future.set_result(data["result"])
+
+    async def _rebalance(self):
+        await rebalance_rules(await get_db())
+
+    async def _listen(self):
+        backoff = 0.5
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.tick_channel, self.user_channel, self.rpc_channel, self.reply_channel)
+                backoff = 0.5
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    data = loads(message["data"])
+                    channel = message["channel"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    if channel == self.tick_channel:
+                        self._apply_ticks(data)
+                    elif channel == self.user_channel:
+                        self._deliver(data)
+                    elif channel == self.rpc_channel:
+                        self._on_call(data)
+                    else:
+                        self._on_reply(data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Cluster subscription lost, reconnecting in {backoff:.1f}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 10.0)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    async def _run_market(self):
+        while True:
+            await self.market_lease.wait_acquired()
+            db = await get_db()
+            try:
+                # Pick up the fills the previous leader flushed
+                await activate_portfolio(db)
+            except Exception:
+                logger.exception("Failed to reload positions on becoming market leader")
+            market = market_simulator.schedule(scheduler)
+            await self.market_lease.wait_lost()
+            market.cancel()
+            matching_engine.clear()
+            try:
+                await deactivate_portfolio(db)
+            except Exception:
+                logger.exception("Failed to flush positions after losing the market lease")
+
+    async def start(self):
+        # Know the other members before the rule index is loaded, so it loads only this worker's shard
+        await self.membership.beat()
+        self.membership.on_change = self._rebalance
+        self._tasks = [
+            asyncio.create_task(self._listen()),
+            asyncio.create_task(self._flush_outbox()),
+            asyncio.create_task(self._apply_events()),
+            asyncio.create_task(self.membership.run()),
+            asyncio.create_task(self._forward_ticks()),
+            asyncio.create_task(self.market_lease.hold()),
+            asyncio.create_task(self._run_market()),
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        # Hand the market and this worker's users over now instead of after the TTLs.
+        # The lifespan has flushed positions already, so the next leader loads them.
+        try:
+            await self.market_lease.release()
+            await self.membership.leave()
+        except Exception:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "worker": self.worker,
+            "market_leader": self.market_lease.held,
+            "shards": shard_map.stats(),
+            "rules_owned": len(rule_index),
+            "ticks_out": self.ticks_out,
+            "ticks_in": self.ticks_in,
+            "notifications_out": self.notifications_out,
+            "notifications_in": self.notifications_in,
+            "events_out": self.events_out,
+            "events_in": self.events_in,
+            "outbox_dropped": self.outbox_dropped,
+            "publish_errors": self.publish_errors,
+            "calls_out": self.calls_out,
+            "calls_served": self.calls_served,
+            "call_timeouts": self.call_timeouts,
+        }
+
+
+fanout: Optional[RedisFanout] = None
+
+
+async def start_cluster():
+    """Start the market, alone or as one worker of a Redis-coordinated cluster."""
+    global fanout
+    if not settings.REDIS_URL:
+        market_simulator.schedule(scheduler)
+        return
+    if not REDIS_AVAILABLE:
+        raise RuntimeError("REDIS_URL is set but the redis package is not installed")
+    redis = aioredis.from_url(settings.REDIS_URL)
+    fanout = RedisFanout(redis, worker_id, prefix=settings.CLUSTER_PREFIX)
+    manager.fanout = fanout
+    user_change_listeners.append(fanout.relay_event)
+    await fanout.start()
+    logger.info(f"Worker {worker_id} joined cluster at {settings.REDIS_URL}")
+
+
+async def on_market_leader(operation: str, **kwargs) -> Any:
+    """Run a paper exchange or portfolio operation on the worker that owns them."""
+    if fanout is None or fanout.market_lease.held:
+        return await LEADER_OPERATIONS[operation](**kwargs)
+    return await fanout.call(operation, **kwargs)
+
+
+async def stop_cluster():
+    if fanout is not None:
+        await fanout.stop()
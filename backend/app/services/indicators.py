@@ -0,0 +1,186 @@
+"""
+Incremental technical indicators shared across rules.
+
+A series is identified by a key such as ``("rsi", 14)`` or
+``("sma_cross", 5, 20)``. Every (symbol, indicator, window) state is created
+once, reference counted by the rules that use it, and updated in O(1) per
+price tick, so many rules on the same indicator cost one update.
+"""
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+SeriesKey = Tuple
+PRICE_SERIES: SeriesKey = ("price",)
+INDICATORS = ("price", "sma_cross", "ema_cross", "rsi", "pct_change")
+
+
+def series_key(indicator: str, window: Optional[int] = None, slow_window: Optional[int] = None) -> SeriesKey:
+    if indicator == "price":
+        return PRICE_SERIES
+    if indicator in ("sma_cross", "ema_cross"):
+        return (indicator, window, slow_window)
+    return (indicator, window)
+
+
+class _SMA:
+    def __init__(self, window: int):
+        self.window = window
+        self._values: Deque[float] = deque()
+        self._sum = 0.0
+
+    def update(self, price: float) -> Optional[float]:
+        self._values.append(price)
+        self._sum += price
+        if len(self._values) > self.window:
+            self._sum -= self._values.popleft()
+        if len(self._values) < self.window:
+            return None
+        return self._sum / self.window
+
+
+class _EMA:
+    def __init__(self, window: int):
+        self.window = window
+        self._alpha = 2.0 / (window + 1)
+        self._value: Optional[float] = None
+        self._seen = 0
+
+    def update(self, price: float) -> Optional[float]:
+        self._seen += 1
+        if self._value is None:
+            self._value = price
+        else:
+            self._value += self._alpha * (price - self._value)
+        return self._value if self._seen >= self.window else None
+
+
+class _RSI:
+    """Wilder's RSI: simple averages over the first window, smoothed afterwards."""
+
+    def __init__(self, window: int):
+        self.window = window
+        self._last: Optional[float] = None
+        self._gain = 0.0
+        self._loss = 0.0
+        self._seen = 0
+
+    def update(self, price: float) -> Optional[float]:
+        if self._last is None:
+            self._last = price
+            return None
+        delta = price - self._last
+        self._last = price
+        gain, loss = max(delta, 0.0), max(-delta, 0.0)
+        self._seen += 1
+        if self._seen <= self.window:
+            self._gain += gain / self.window
+            self._loss += loss / self.window
+            if self._seen < self.window:
+                return None
+        else:
+            self._gain = (self._gain * (self.window - 1) + gain) / self.window
+            self._loss = (self._loss * (self.window - 1) + loss) / self.window
+        if self._loss == 0:
+            return 100.0
+        return 100.0 - 100.0 / (1.0 + self._gain / self._loss)
+
+
+class _PctChange:
+    """Percent change between the current price and the price ``window`` ticks ago."""
+
+    def __init__(self, window: int):
+        self.window = window
+        self._values: Deque[float] = deque(maxlen=window + 1)
+
+    def update(self, price: float) -> Optional[float]:
+        self._values.append(price)
+        if len(self._values) <= self.window:
+            return None
+        oldest = self._values[0]
+        return (price - oldest) / oldest * 100.0 if oldest else None
+
+
+_PRIMITIVES = {"sma": _SMA, "ema": _EMA, "rsi": _RSI, "pct_change": _PctChange}
+
+
+def _primitives_for(series: SeriesKey) -> Tuple[Tuple[str, int], ...]:
+    indicator = series[0]
+    if indicator == "sma_cross":
+        return (("sma", series[1]), ("sma", series[2]))
+    if indicator == "ema_cross":
+        return (("ema", series[1]), ("ema", series[2]))
+    return ((indicator, series[1]),)
+
+
+class IndicatorRegistry:
+    def __init__(self):
+        # symbol -> (primitive, window) -> state
+        self._states: Dict[str, Dict[Tuple[str, int], object]] = {}
+        self._refs: Dict[Tuple[str, Tuple[str, int]], int] = {}
+        # symbol -> series -> number of rules using it
+        self._series: Dict[str, Dict[SeriesKey, int]] = {}
+        self._values: Dict[str, Dict[SeriesKey, Optional[float]]] = {}
+        self._last_ts: Dict[str, float] = {}
+
+    def acquire(self, symbol: str, series: SeriesKey):
+        if series == PRICE_SERIES:
+            return
+        used = self._series.setdefault(symbol, {})
+        used[series] = used.get(series, 0) + 1
+        for primitive in _primitives_for(series):
+            key = (symbol, primitive)
+            self._refs[key] = self._refs.get(key, 0) + 1
+            states = self._states.setdefault(symbol, {})
+            if primitive not in states:
+                kind, window = primitive
+                states[primitive] = _PRIMITIVES[kind](window)
+
+    def release(self, symbol: str, series: SeriesKey):
+        if series == PRICE_SERIES or series not in self._series.get(symbol, {}):
+            return
+        used = self._series[symbol]
+        used[series] -= 1
+        if not used[series]:
+            del used[series]
+            if not used:
+                del self._series[symbol]
+        for primitive in _primitives_for(series):
+            key = (symbol, primitive)
+            self._refs[key] -= 1
+            if not self._refs[key]:
+                del self._refs[key]
+                del self._states[symbol][primitive]
+                if not self._states[symbol]:
+                    del self._states[symbol]
+        self._values.get(symbol, {}).pop(series, None)
+
+    def update(self, symbol: str, price: float, timestamp: float) -> Dict[SeriesKey, Optional[float]]:
+        """
+        Feed one price tick into every state for the symbol and return the value of each series in use.
+
+        Ticks at or before the last timestamp seen for the symbol are ignored, so
+        re-delivering a tick (e.g. to force a rule evaluation) does not skew the averages.
+        """
+        states = self._states.get(symbol)
+        if not states or timestamp <= self._last_ts.get(symbol, float("-inf")):
+            return self.values(symbol)
+        self._last_ts[symbol] = timestamp
+        primitive_values = {primitive: state.update(price) for primitive, state in states.items()}
+        values: Dict[SeriesKey, Optional[float]] = {}
+        for series in self._series.get(symbol, {}):
+            parts = [primitive_values[primitive] for primitive in _primitives_for(series)]
+            if any(part is None for part in parts):
+                values[series] = None
+            elif len(parts) == 2:
+                # Crossovers are expressed as fast - slow: positive once the fast average is above
+                values[series] = parts[0] - parts[1]
+            else:
+                values[series] = parts[0]
+        self._values[symbol] = values
+        return values
+
+    def values(self, symbol: str) -> Dict[SeriesKey, Optional[float]]:
+        return self._values.get(symbol, {})
+
+
+indicator_registry = IndicatorRegistry()
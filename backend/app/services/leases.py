@@ -0,0 +1,88 @@
+"""
+Named leases in Redis, held by at most one worker at a time.
+
+A lease is a key set with ``SET NX PX`` whose value is the holder's worker
+id. The holder renews it well inside its TTL; renewal and release are
+compare-and-set scripts, so a worker whose lease already expired and was
+taken over can never extend or delete the new holder's key. A worker that
+dies simply stops renewing, and another one acquires the lease within one TTL.
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+_RENEW = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class RedisLease:
+    def __init__(self, redis, name: str, owner: str, ttl_seconds: float = 10.0):
+        self.redis = redis
+        self.name = name
+        self.owner = owner
+        self.ttl_ms = int(ttl_seconds * 1000)
+        self.held = False
+        self._acquired = asyncio.Event()
+        self._lost = asyncio.Event()
+        self._lost.set()
+        self.acquisitions = 0
+        self.losses = 0
+
+    async def acquire(self) -> bool:
+        return bool(await self.redis.set(self.name, self.owner, nx=True, px=self.ttl_ms))
+
+    async def renew(self) -> bool:
+        return bool(await self.redis.eval(_RENEW, 1, self.name, self.owner, self.ttl_ms))
+
+    async def release(self):
+        if self.held:
+            await self.redis.eval(_RELEASE, 1, self.name, self.owner)
+            self._set_held(False)
+
+    def _set_held(self, held: bool):
+        if held == self.held:
+            return
+        self.held = held
+        if held:
+            self.acquisitions += 1
+            self._lost.clear()
+            self._acquired.set()
+            logger.info(f"Acquired lease {self.name} as {self.owner}")
+        else:
+            self.losses += 1
+            self._acquired.clear()
+            self._lost.set()
+            logger.info(f"Lost lease {self.name} as {self.owner}")
+
+    async def wait_acquired(self):
+        await self._acquired.wait()
+
+    async def wait_lost(self):
+        await self._lost.wait()
+
+    async def hold(self):
+        """Keep trying to take the lease, and keep renewing it while held; runs until cancelled."""
+        interval = self.ttl_ms / 3000
+        while True:
+            try:
+                self._set_held(await self.renew() if self.held else await self.acquire())
+            except Exception as e:
+                # Cannot prove we still hold it, so stop acting as the holder
+                logger.warning(f"Lease {self.name} check failed: {e}")
+                self._set_held(False)
+            await asyncio.sleep(interval)
+
+    def stats(self) -> dict:
+        return {"name": self.name, "held": self.held, "acquisitions": self.acquisitions, "losses": self.losses}
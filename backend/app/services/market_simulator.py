@@ -1,11 +1,19 @@
-import random
-import asyncio
 import logging
-from typing import Dict, List
+from collections.abc import Mapping
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+from ..core.config import settings
+from ..core.events import PriceTick, price_bus
+from ..core.metrics import registry
+from ..core.scheduler import FIXED_RATE, ScheduledTask, Scheduler
 from ..models.stock import Stock
 
 logger = logging.getLogger(__name__)
 
+symbols_moved = registry.counter("market_symbols_moved_total", "Symbol price changes produced by the simulator")
+
 # Full list of 30 Indian stocks
 INITIAL_STOCKS = [
     {"symbol": "RELIANCE", "name": "Reliance Industries", "price": 2800.0},
@@ -40,47 +48,148 @@ INITIAL_STOCKS = [
     {"symbol": "JSWSTEEL", "name": "JSW Steel", "price": 820.0},
 ]
 
+MODELS = ("random_walk", "gbm")
+
+
+class _StockView(Mapping):
+    """Read-only ``symbol -> Stock`` mapping over the simulator's arrays; Stocks are built on access."""
+
+    def __init__(self, simulator: "MarketSimulator"):
+        self._simulator = simulator
+
+    def __getitem__(self, symbol: str) -> Stock:
+        stock = self._simulator.get_stock(symbol)
+        if stock is None:
+            raise KeyError(symbol)
+        return stock
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._simulator.symbols)
+
+    def __len__(self) -> int:
+        return len(self._simulator.symbols)
+
+
 class MarketSimulator:
-    def __init__(self):
-        self.stocks: Dict[str, Stock] = {}
-        for s in INITIAL_STOCKS:
-            self.stocks[s["symbol"]] = Stock(
-                symbol=s["symbol"],
-                name=s["name"],
-                price=s["price"],
-                change=0.0
-            )
+    """
+    Columnar market simulator: prices and changes live in NumPy arrays indexed
+    by position, so a tick over tens of thousands of symbols is a handful of
+    vectorized operations. ``Stock`` objects are only created when asked for.
+    """
+
+    def __init__(
+        self,
+        num_symbols: int = len(INITIAL_STOCKS),
+        tick_seconds: float = 60.0,
+        seed: Optional[int] = None,
+        model: str = "random_walk",
+        volatility: float = 0.015,
+    ):
+        if model not in MODELS:
+            raise ValueError(f"Unknown market model {model!r}; expected one of {MODELS}")
+        self.tick_seconds = tick_seconds
+        self.model = model
+        self.volatility = volatility
+        self._rng = np.random.default_rng(seed)
+
+        seeds = INITIAL_STOCKS[:num_symbols]
+        self.symbols: List[str] = [s["symbol"] for s in seeds]
+        self.names: List[str] = [s["name"] for s in seeds]
+        prices = [s["price"] for s in seeds]
+        # Load testing beyond the 30 real names: synthetic symbols with random starting prices
+        extra = num_symbols - len(seeds)
+        if extra > 0:
+            self.symbols += [f"SIM{i:05d}" for i in range(extra)]
+            self.names += [f"Simulated Stock {i}" for i in range(extra)]
+            prices += list(np.round(self._rng.uniform(50.0, 5000.0, extra), 2))
+
+        self._index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.prices = np.asarray(prices, dtype=np.float64)
+        self.changes = np.zeros(len(self.symbols), dtype=np.float64)
+        self.stocks = _StockView(self)
+
+    def _stock_at(self, i: int) -> Stock:
+        return Stock(
+            symbol=self.symbols[i],
+            name=self.names[i],
+            price=float(self.prices[i]),
+            change=float(self.changes[i])
+        )
 
     def get_all_stocks(self) -> List[Stock]:
-        return list(self.stocks.values())
+        return [self._stock_at(i) for i in range(len(self.symbols))]
+
+    def get_stock(self, symbol: str) -> Optional[Stock]:
+        i = self._index.get(symbol.upper())
+        return None if i is None else self._stock_at(i)
+
+    def price_of(self, symbol: str) -> Optional[float]:
+        """Current price without building a Stock; for hot paths such as order matching."""
+        i = self._index.get(symbol)
+        return None if i is None else float(self.prices[i])
 
-    def get_stock(self, symbol: str) -> Stock:
-        return self.stocks.get(symbol.upper())
+    def apply_tick(self, symbol: str, price: float, change: float) -> bool:
+        """Take a price from elsewhere (the cluster's market leader) instead of simulating it."""
+        i = self._index.get(symbol)
+        if i is None:
+            return False
+        self.prices[i] = price
+        self.changes[i] = change
+        return True
+
+    def _returns(self, size: int) -> np.ndarray:
+        if self.model == "gbm":
+            # Zero-drift geometric Brownian motion step
+            sigma = self.volatility
+            return np.expm1(self._rng.normal(-0.5 * sigma * sigma, sigma, size))
+        # Uniform random walk between -volatility and +volatility
+        return self._rng.uniform(-self.volatility, self.volatility, size)
 
     async def update_prices(self):
         """Randomly fluctuate a subset of prices every tick"""
-        # Pick 5-10 random stocks to update each minute for a more natural feel
-        num_to_update = random.randint(5, 15)
-        symbols = list(self.stocks.keys())
-        to_update = random.sample(symbols, num_to_update)
-
-        for symbol in to_update:
-            stock = self.stocks[symbol]
-            # Random change between -1.5% and +1.5%
-            change_percent = random.uniform(-0.015, 0.015)
-            old_price = stock.price
-            new_price = old_price * (1 + change_percent)
-            
-            new_price = max(1.0, round(new_price, 2))
-            stock.change = round(((new_price - old_price) / old_price) * 100, 2)
-            stock.price = new_price
-            
+        n = len(self.symbols)
+        # Between a sixth and a half of the market moves each tick (5-15 of the default 30)
+        low = max(1, n // 6)
+        high = max(low, n // 2)
+        num_to_update = int(self._rng.integers(low, high + 1))
+        idx = self._rng.choice(n, size=num_to_update, replace=False)
+
+        old = self.prices[idx]
+        new = np.maximum(1.0, np.round(old * (1.0 + self._returns(num_to_update)), 2))
+        self.changes[idx] = np.round((new - old) / old * 100.0, 2)
+        self.prices[idx] = new
+
+        moved = idx[new != old]
+        symbols_moved.inc(len(moved))
+        for i in moved:
+            price_bus.publish(PriceTick(
+                symbol=self.symbols[i],
+                name=self.names[i],
+                price=float(self.prices[i]),
+                change=float(self.changes[i]),
+            ))
+
         logger.info(f"Market tick: Updated {num_to_update} stocks.")
 
-    async def run_forever(self):
-        while True:
-            await self.update_prices()
-            # Update every 60 seconds as requested (every minute)
-            await asyncio.sleep(60)
+    def schedule(self, scheduler: Scheduler) -> ScheduledTask:
+        # Fixed rate: a tick every tick_seconds however long publishing takes
+        return scheduler.every("market", self.update_prices, self.tick_seconds, mode=FIXED_RATE, overlap="skip")
+
+def _build_market() -> MarketSimulator:
+    if settings.MARKET_SOURCE == "replay":
+        # Imported here: tick_replay builds on MarketSimulator from this module
+        from .tick_replay import ReplayMarket
+        return ReplayMarket(
+            settings.MARKET_REPLAY_FILE,
+            speed=settings.MARKET_REPLAY_SPEED,
+            loop=settings.MARKET_REPLAY_LOOP,
+        )
+    return MarketSimulator(
+        num_symbols=settings.MARKET_SYMBOLS,
+        tick_seconds=settings.MARKET_TICK_SECONDS,
+        seed=settings.MARKET_SEED,
+        model=settings.MARKET_MODEL,
+        volatility=settings.MARKET_VOLATILITY,
+    )
 
-market_simulator = MarketSimulator()
+market_simulator = _build_market()
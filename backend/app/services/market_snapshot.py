@@ -0,0 +1,95 @@
+"""
+Versioned, pre-encoded view of the market for GET /api/stocks.
+
+Every batch of price ticks bumps ``seq``. The full response body is encoded at
+most once per sequence number and reused by every request until prices move
+again, and a short log of which symbols changed at each sequence number lets
+clients ask only for what moved since the ``seq`` they last saw.
+
+``seq`` starts at 0 in every process, so the ETag and the ``since`` token
+(``<epoch>.<seq>``) carry a random per-process epoch. A token from another
+worker or from before a restart does not match it, and the client gets the
+full body and a token it can use here.
+"""
+import asyncio
+import logging
+import secrets
+from collections import deque
+from typing import Deque, Iterable, Optional, Set, Tuple
+
+from ..core.events import price_bus
+from ..services.market_simulator import market_simulator
+from ..websocket.codec import dumps
+
+logger = logging.getLogger(__name__)
+
+DELTA_HISTORY = 1024
+
+
+class MarketSnapshot:
+    def __init__(self, market, history: int = DELTA_HISTORY):
+        self.market = market
+        self.epoch = secrets.token_hex(4)
+        self.seq = 0
+        self._body: Optional[bytes] = None
+        self._body_seq = -1
+        # (seq, symbols changed at that seq), oldest first
+        self._log: Deque[Tuple[int, Set[str]]] = deque(maxlen=history)
+
+    @property
+    def etag(self) -> str:
+        return f'W/"market-{self.epoch}-{self.seq}"'
+
+    @property
+    def token(self) -> str:
+        return f"{self.epoch}.{self.seq}"
+
+    def advance(self, symbols: Iterable[str]):
+        self.seq += 1
+        self._log.append((self.seq, set(symbols)))
+
+    @staticmethod
+    def _encode(stocks) -> bytes:
+        return dumps([
+            {"symbol": s.symbol, "name": s.name, "price": s.price, "change": s.change}
+            for s in stocks
+        ])
+
+    def full(self) -> bytes:
+        if self._body_seq != self.seq:
+            self._body = self._encode(self.market.get_all_stocks())
+            self._body_seq = self.seq
+        return self._body
+
+    def delta(self, token: str) -> Optional[bytes]:
+        """Stocks changed after ``token``; None (send the full body) if it is not from this process or too old."""
+        epoch, _, seq = token.partition(".")
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self.seq:
+            return None
+        since = int(seq)
+        if since == self.seq:
+            return b"[]"
+        if not self._log or since < self._log[0][0] - 1:
+            return None
+        changed: Set[str] = set()
+        for seq, symbols in reversed(self._log):
+            if seq <= since:
+                break
+            changed.update(symbols)
+        stocks = [self.market.get_stock(symbol) for symbol in sorted(changed)]
+        return self._encode(s for s in stocks if s is not None)
+
+
+market_snapshot = MarketSnapshot(market_simulator)
+
+
+async def _follow_prices():
+    subscription = price_bus.subscribe()
+    while True:
+        # A simulator tick publishes all of its symbols at once, so one batch is one version
+        ticks = await subscription.get_batch()
+        market_snapshot.advance(tick.symbol for tick in ticks)
+
+
+async def start_market_snapshot():
+    asyncio.create_task(_follow_prices())
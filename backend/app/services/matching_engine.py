@@ -0,0 +1,356 @@
+"""
+Paper-trading exchange: one in-memory limit order book per symbol.
+
+Orders are matched with price-time priority. Resting user orders are the
+first source of liquidity; beyond that the simulated market is an unlimited
+counterparty at its current price, so
+
+* a market order fills immediately, against the book while it is at least
+  as good as the market price, and at the market price after that;
+* a limit order fills the same way up to its limit and rests for the rest,
+  filling later when the market price crosses it;
+* a stop order waits until the market trades through its stop price and is
+  then executed as a market order.
+
+The book itself is plain Python with ``__slots__`` objects: a sorted list of
+price levels per side (levels are few, orders are many) and a FIFO deque per
+level. Cancels are lazy; a cancelled order is skipped when it reaches the
+front of its level. ``submit``/``cancel``/``on_price`` are synchronous and
+only append to ``pending_fills``, so the hot path never awaits.
+
+There is one exchange per cluster. With ``REDIS_URL`` set, only the holder
+of the ``market`` lease matches orders; the API of every other worker
+forwards ``submit_paper_order``, ``cancel_paper_order`` and ``book_depth`` to
+it (see ``services/cluster.py``). Resting orders live in memory only and do
+not survive a restart or a change of leader.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from bisect import insort
+from collections import deque
+from typing import Callable, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+from ..core.events import price_bus
+from ..core.metrics import registry
+from ..services.market_simulator import market_simulator
+from ..websocket.price_socket import manager
+
+logger = logging.getLogger(__name__)
+
+BUY, SELL = "buy", "sell"
+MARKET, LIMIT, STOP = "market", "limit", "stop"
+ORDER_KINDS = (MARKET, LIMIT, STOP)
+
+
+class BookOrder:
+    __slots__ = (
+        "id", "user_id", "symbol", "side", "kind", "price", "stop_price",
+        "quantity", "remaining", "filled_value", "status",
+    )
+
+    def __init__(self, id: int, user_id: str, symbol: str, side: str, kind: str, quantity: int,
+                 price: Optional[float] = None, stop_price: Optional[float] = None):
+        self.id = id
+        self.user_id = user_id
+        self.symbol = symbol
+        self.side = side
+        self.kind = kind
+        self.price = price
+        self.stop_price = stop_price
+        self.quantity = quantity
+        self.remaining = quantity
+        self.filled_value = 0.0
+        # open -> filled | cancelled | rejected; stops are "waiting" until triggered
+        self.status = "open"
+
+    @property
+    def filled(self) -> int:
+        return self.quantity - self.remaining
+
+    @property
+    def avg_price(self) -> Optional[float]:
+        return self.filled_value / self.filled if self.filled else None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": str(self.id),
+            "symbol": self.symbol,
+            "side": self.side,
+            "kind": self.kind,
+            "price": self.price,
+            "stop_price": self.stop_price,
+            "quantity": self.quantity,
+            "filled": self.filled,
+            "avg_price": self.avg_price,
+            "status": self.status,
+        }
+
+
+class Fill(NamedTuple):
+    order_id: int
+    user_id: str
+    symbol: str
+    side: str
+    price: float
+    quantity: int
+    timestamp: float
+
+
+class _Side:
+    """One side of a book: ascending list of price levels, FIFO queue of orders per level."""
+
+    __slots__ = ("is_bid", "prices", "levels")
+
+    def __init__(self, is_bid: bool):
+        self.is_bid = is_bid
+        self.prices: List[float] = []
+        self.levels: Dict[float, Deque[BookOrder]] = {}
+
+    def add(self, order: BookOrder):
+        level = self.levels.get(order.price)
+        if level is None:
+            level = self.levels[order.price] = deque()
+            insort(self.prices, order.price)
+        level.append(order)
+
+    def best(self) -> Optional[Tuple[float, Deque[BookOrder]]]:
+        while self.prices:
+            price = self.prices[-1] if self.is_bid else self.prices[0]
+            level = self.levels[price]
+            while level and not level[0].remaining:
+                # Lazily discard cancelled orders
+                level.popleft()
+            if level:
+                return price, level
+            del self.levels[price]
+            self.prices.pop(-1 if self.is_bid else 0)
+        return None
+
+    def depth(self, levels: int) -> List[Tuple[float, int]]:
+        prices = reversed(self.prices) if self.is_bid else iter(self.prices)
+        out = []
+        for price in prices:
+            quantity = sum(order.remaining for order in self.levels[price])
+            if quantity:
+                out.append((price, quantity))
+                if len(out) == levels:
+                    break
+        return out
+
+
+class OrderBook:
+    __slots__ = ("symbol", "bids", "asks", "buy_stops", "sell_stops")
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        self.bids = _Side(is_bid=True)
+        self.asks = _Side(is_bid=False)
+        # Heaps keyed so the first stop to trigger is on top: buy stops fire as the
+        # price rises (lowest first), sell stops as it falls (highest first)
+        self.buy_stops: List[Tuple[float, int, BookOrder]] = []
+        self.sell_stops: List[Tuple[float, int, BookOrder]] = []
+
+
+class MatchingEngine:
+    def __init__(self, price_of: Callable[[str], Optional[float]]):
+        self.price_of = price_of
+        self.books: Dict[str, OrderBook] = {}
+        self.orders: Dict[int, BookOrder] = {}
+        self.pending_fills: List[Fill] = []
+        self._ids = itertools.count(1)
+        self.submitted = 0
+        self.fills = 0
+
+    def book(self, symbol: str) -> OrderBook:
+        book = self.books.get(symbol)
+        if book is None:
+            book = self.books[symbol] = OrderBook(symbol)
+        return book
+
+    def submit(self, user_id: str, symbol: str, side: str, quantity: int, kind: str = MARKET,
+               price: Optional[float] = None, stop_price: Optional[float] = None) -> BookOrder:
+        order = BookOrder(next(self._ids), user_id, symbol, side, kind, quantity, price, stop_price)
+        self.submitted += 1
+        market = self.price_of(symbol)
+        if market is None or quantity <= 0:
+            order.status = "rejected"
+            return order
+        book = self.books.get(symbol) or self.book(symbol)
+        if kind == STOP:
+            if (side == BUY and market >= stop_price) or (side == SELL and market <= stop_price):
+                self._execute(book, order, market)
+            else:
+                order.status = "waiting"
+                self.orders[order.id] = order
+                if side == BUY:
+                    heapq.heappush(book.buy_stops, (stop_price, order.id, order))
+                else:
+                    heapq.heappush(book.sell_stops, (-stop_price, order.id, order))
+            return order
+        self._execute(book, order, market)
+        return order
+
+    def _execute(self, book: OrderBook, order: BookOrder, market: float):
+        """Match against resting orders, then the market; rest whatever a limit order has left."""
+        buying = order.side == BUY
+        opposite = book.asks if buying else book.bids
+        limit = order.price if order.kind == LIMIT else None
+        while order.remaining:
+            best = opposite.best()
+            if best is None:
+                break
+            level_price, level = best
+            # Resting liquidity is used only while it beats (or equals) the market price
+            if (level_price > market) if buying else (level_price < market):
+                break
+            if limit is not None and ((level_price > limit) if buying else (level_price < limit)):
+                break
+            while order.remaining and level:
+                maker = level[0]
+                if not maker.remaining:
+                    level.popleft()
+                    continue
+                quantity = min(order.remaining, maker.remaining)
+                self._fill(maker, level_price, quantity)
+                self._fill(order, level_price, quantity)
+                if not maker.remaining:
+                    level.popleft()
+        if order.remaining and (limit is None or ((market <= limit) if buying else (market >= limit))):
+            self._fill(order, market, order.remaining)
+        if order.remaining:
+            self.orders[order.id] = order
+            (book.bids if buying else book.asks).add(order)
+
+    def _fill(self, order: BookOrder, price: float, quantity: int):
+        order.remaining -= quantity
+        order.filled_value += price * quantity
+        self.pending_fills.append(Fill(order.id, order.user_id, order.symbol, order.side, price, quantity, time.time()))
+        self.fills += 1
+        if not order.remaining:
+            order.status = "filled"
+            self.orders.pop(order.id, None)
+
+    def cancel(self, order_id: int, user_id: Optional[str] = None) -> Optional[BookOrder]:
+        order = self.orders.get(order_id)
+        if order is None or (user_id is not None and order.user_id != user_id):
+            return None
+        del self.orders[order_id]
+        order.status = "cancelled"
+        # Left in its level/heap; skipped when it reaches the front
+        order.remaining = 0
+        return order
+
+    def on_price(self, symbol: str, price: float):
+        """A new market price: trigger stops, then fill resting orders the market has crossed."""
+        book = self.books.get(symbol)
+        if book is None:
+            return
+        while book.buy_stops and book.buy_stops[0][0] <= price:
+            _, _, order = heapq.heappop(book.buy_stops)
+            if order.remaining:
+                # A triggered stop executes like a market order
+                self._execute(book, order, price)
+        while book.sell_stops and -book.sell_stops[0][0] >= price:
+            _, _, order = heapq.heappop(book.sell_stops)
+            if order.remaining:
+                # A triggered stop executes like a market order
+                self._execute(book, order, price)
+        # Resting bids at or above the market (asks at or below) fill at the market price
+        self._sweep(book.bids, price, lambda level_price: level_price >= price)
+        self._sweep(book.asks, price, lambda level_price: level_price <= price)
+
+    def _sweep(self, side: _Side, price: float, crossed: Callable[[float], bool]):
+        while True:
+            best = side.best()
+            if best is None or not crossed(best[0]):
+                return
+            level_price, level = best
+            while level:
+                order = level.popleft()
+                if order.remaining:
+                    self._fill(order, price, order.remaining)
+
+    def take_fills(self) -> List[Fill]:
+        fills, self.pending_fills = self.pending_fills, []
+        return fills
+
+    def depth(self, symbol: str, levels: int = 10) -> dict:
+        book = self.books.get(symbol)
+        if book is None:
+            return {"symbol": symbol, "bids": [], "asks": []}
+        return {"symbol": symbol, "bids": book.bids.depth(levels), "asks": book.asks.depth(levels)}
+
+    def clear(self):
+        """Drop every book and open order, e.g. when another worker becomes the exchange."""
+        self.books.clear()
+        self.orders.clear()
+        self.pending_fills = []
+
+    def stats(self) -> dict:
+        return {
+            "books": len(self.books),
+            "open_orders": len(self.orders),
+            "submitted": self.submitted,
+            "fills": self.fills,
+        }
+
+
+matching_engine = MatchingEngine(market_simulator.price_of)
+fill_listeners: List[Callable[[List[Fill]], None]] = []
+
+
+@registry.collector
+def _collect():
+    return [
+        ("paper_books", "gauge", "Symbols with an order book", [({}, len(matching_engine.books))]),
+        ("paper_open_orders", "gauge", "Resting and waiting paper orders", [({}, len(matching_engine.orders))]),
+        ("paper_orders_submitted_total", "counter", "Paper orders submitted", [({}, matching_engine.submitted)]),
+        ("paper_fills_total", "counter", "Paper order fills", [({}, matching_engine.fills)]),
+    ]
+
+
+def dispatch_fills():
+    """Hand fills produced since the last call to listeners and to each user's websocket."""
+    fills = matching_engine.take_fills()
+    if not fills:
+        return
+    for listener in fill_listeners:
+        try:
+            listener(fills)
+        except Exception:
+            logger.exception("Fill listener failed")
+    for fill in fills:
+        manager.notify_user(fill.user_id, {"type": "fill", "fill": {**fill._asdict(), "order_id": str(fill.order_id)}})
+
+
+async def submit_paper_order(user_id: str, symbol: str, side: str, quantity: int, kind: str = MARKET,
+                             price: Optional[float] = None, stop_price: Optional[float] = None) -> dict:
+    order = matching_engine.submit(user_id, symbol, side, quantity, kind=kind, price=price, stop_price=stop_price)
+    dispatch_fills()
+    return order.to_dict()
+
+
+async def cancel_paper_order(order_id: int, user_id: str) -> Optional[dict]:
+    order = matching_engine.cancel(order_id, user_id)
+    return order.to_dict() if order is not None else None
+
+
+async def book_depth(symbol: str, levels: int = 10) -> dict:
+    return matching_engine.depth(symbol, levels)
+
+
+async def _follow_prices():
+    subscription = price_bus.subscribe()
+    while True:
+        # Every tick, not just the latest per symbol: a spike can cross a resting order
+        ticks = await subscription.get_batch(coalesce=False)
+        for tick in ticks:
+            matching_engine.on_price(tick.symbol, tick.price)
+        dispatch_fills()
+
+
+async def start_matching_engine():
+    asyncio.create_task(_follow_prices())
@@ -0,0 +1,270 @@
+"""
+Checkout and broker submission for cart orders.
+
+``checkout`` snapshots a user's cart into the ``orders`` collection with one
+``insert_many``, so its cost does not grow with the number of items. Every
+order carries the checkout's idempotency key; the unique
+``(user_id, idempotency_key)`` index (see ``db/schema.py``) makes a retried
+checkout insert only the symbols its first attempt did not.
+
+Inserted orders are handed to ``OrderPipeline``: a bounded queue drained by a
+fixed number of workers that submit to the broker with retries and
+exponential backoff. A worker first claims the order in Mongo
+(``pending`` -> ``processing``), so an order queued in two processes (e.g. by
+the recovery sweep of each worker at boot) is placed once. Status changes are
+collected and written back in batches, and pushed to the user's websocket.
+"""
+import asyncio
+import logging
+import random
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from ..core.config import settings
+from ..core.metrics import registry
+from ..models.order import Order
+from ..services.broker_service import place_order_for_user
+from ..services.sharding import worker_id
+from ..websocket.price_socket import manager
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+def order_from_doc(doc: dict) -> Order:
+    return Order(
+        id=str(doc["_id"]),
+        symbol=doc["symbol"],
+        name=doc.get("name", doc["symbol"]),
+        price=doc["price"],
+        quantity=doc["quantity"],
+        side=doc.get("side", "buy"),
+        status=doc.get("status", "pending"),
+        checkout_id=doc["checkout_id"],
+        created_at=doc["created_at"],
+        attempts=doc.get("attempts", 0),
+        broker_ref=doc.get("broker_ref"),
+        error=doc.get("error"),
+        fill_price=doc.get("fill_price"),
+    )
+
+
+async def checkout(db, user_id: str, items: List[dict], checkout_id: Optional[str] = None) -> Tuple[str, List[dict], List[dict]]:
+    """
+    Turn cart items into orders. Returns ``(checkout_id, order docs, inserted)``.
+    The docs are every order of the checkout, including ones stored by an earlier
+    attempt with the same id; ``inserted`` are the ones this call created, the
+    only ones to submit.
+    """
+    checkout_id = checkout_id or uuid.uuid4().hex
+    now = time.time()
+    docs = [
+        {
+            "_id": ObjectId(),
+            "user_id": user_id,
+            "checkout_id": checkout_id,
+            # One key per (checkout, symbol): a replayed checkout collides on every row
+            "idempotency_key": f"{checkout_id}:{item['symbol']}",
+            "symbol": item["symbol"],
+            "name": item.get("name", item["symbol"]),
+            "price": item["price"],
+            "quantity": item.get("quantity", 1),
+            "side": "buy",
+            "status": "pending",
+            "attempts": 0,
+            "created_at": now,
+        }
+        for item in items
+    ]
+    if not docs:
+        return checkout_id, await _existing(db, user_id, checkout_id), []
+    try:
+        await db["orders"].insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(error.get("code") != DUPLICATE_KEY for error in errors):
+            raise
+        # Same checkout retried: symbols it already ordered collided, anything
+        # added to the cart since went in
+        rejected = {error["index"] for error in errors}
+        inserted = [doc for i, doc in enumerate(docs) if i not in rejected]
+        return checkout_id, await _existing(db, user_id, checkout_id), inserted
+    return checkout_id, docs, docs
+
+
+async def _existing(db, user_id: str, checkout_id: str) -> List[dict]:
+    cursor = db["orders"].find({"user_id": user_id, "checkout_id": checkout_id}).sort("_id", ASCENDING)
+    return [doc async for doc in cursor]
+
+
+class OrderPipeline:
+    def __init__(
+        self,
+        workers: int = 4,
+        max_retries: int = 3,
+        retry_base_seconds: float = 0.5,
+        queue_size: int = 10000,
+        flush_seconds: float = 0.2,
+    ):
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.flush_seconds = flush_seconds
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._updates: Dict[ObjectId, dict] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._db = None
+        self.submitted = 0
+        self.placed = 0
+        self.failed = 0
+        self.retries = 0
+        self.overflow = 0
+        self.claim_lost = 0
+
+    def submit(self, docs: List[dict]):
+        for doc in docs:
+            try:
+                self.queue.put_nowait(doc)
+            except asyncio.QueueFull:
+                # Still pending in Mongo; the recovery sweep at next startup picks it up
+                self.overflow += 1
+                continue
+            self.submitted += 1
+
+    async def start(self, db):
+        self._db = db
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._flush_loop()))
+        # Orders accepted before a restart and never claimed. One left "processing"
+        # by a crash may already be with the broker, so it is not retried blindly.
+        cursor = db["orders"].find({"status": "pending"}).sort("_id", ASCENDING).limit(self.queue.maxsize)
+        recovered = [doc async for doc in cursor]
+        self.submit(recovered)
+        if recovered:
+            logger.info(f"Re-queued {len(recovered)} pending orders")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        await self.flush()
+
+    async def _claim(self, doc: dict) -> bool:
+        claimed = await self._db["orders"].find_one_and_update(
+            {"_id": doc["_id"], "status": "pending"},
+            {"$set": {"status": "processing", "claimed_by": worker_id}},
+            projection={"_id": 1},
+        )
+        if claimed is None:
+            # Another worker (or an earlier run of this one) already took it
+            self.claim_lost += 1
+            return False
+        doc["status"] = "processing"
+        return True
+
+    async def _work(self):
+        while True:
+            doc = await self.queue.get()
+            try:
+                if await self._claim(doc):
+                    await self._place(doc)
+            except Exception:
+                logger.exception(f"Order {doc['_id']} crashed its worker")
+            finally:
+                self.queue.task_done()
+
+    async def _place(self, doc: dict):
+        error = None
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                result = await place_order_for_user(doc["user_id"], doc["symbol"], doc["quantity"])
+            except Exception as e:
+                error = str(e) or type(e).__name__
+                if attempt < self.max_retries:
+                    self.retries += 1
+                    # Exponential backoff with jitter so retries of one outage do not synchronize
+                    await asyncio.sleep(self.retry_base_seconds * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+                continue
+            self.placed += 1
+            self._record(doc, {
+                "status": result.get("status", "placed"),
+                "attempts": attempt,
+                "broker_ref": result.get("order_id"),
+                "fill_price": result.get("avg_price"),
+            })
+            return
+        self.failed += 1
+        self._record(doc, {"status": "failed", "attempts": self.max_retries, "error": error})
+
+    def _record(self, doc: dict, changes: dict):
+        doc.update(changes)
+        self._updates[doc["_id"]] = {**self._updates.get(doc["_id"], {}), **changes}
+        manager.notify_user(doc["user_id"], {"type": "order", "order": order_from_doc(doc).model_dump()})
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Order status flush failed")
+
+    async def flush(self):
+        """Write every status change since the last flush in one bulk_write."""
+        if not self._updates or self._db is None:
+            return
+        updates, self._updates = self._updates, {}
+        ops = [UpdateOne({"_id": order_id}, {"$set": changes}) for order_id, changes in updates.items()]
+        try:
+            await self._db["orders"].bulk_write(ops, ordered=False)
+        except Exception:
+            # Keep them for the next flush, without overwriting anything newer
+            for order_id, changes in updates.items():
+                self._updates[order_id] = {**changes, **self._updates.get(order_id, {})}
+            raise
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "submitted": self.submitted,
+            "placed": self.placed,
+            "failed": self.failed,
+            "retries": self.retries,
+            "overflow": self.overflow,
+            "claim_lost": self.claim_lost,
+            "unflushed": len(self._updates),
+        }
+
+
+order_pipeline = OrderPipeline(
+    workers=settings.ORDER_WORKERS,
+    max_retries=settings.ORDER_MAX_RETRIES,
+    retry_base_seconds=settings.ORDER_RETRY_BASE_SECONDS,
+    queue_size=settings.ORDER_QUEUE_SIZE,
+    flush_seconds=settings.ORDER_FLUSH_SECONDS,
+)
+
+
+@registry.collector
+def _collect():
+    pipeline = order_pipeline
+    return [
+        ("order_queue_depth", "gauge", "Orders waiting for a broker worker", [({}, pipeline.queue.qsize())]),
+        ("order_unflushed_updates", "gauge", "Order status changes not yet written to Mongo", [({}, len(pipeline._updates))]),
+        ("orders_submitted_total", "counter", "Orders queued for the broker", [({}, pipeline.submitted)]),
+        ("orders_placed_total", "counter", "Orders the broker accepted", [({}, pipeline.placed)]),
+        ("orders_failed_total", "counter", "Orders that failed after every retry", [({}, pipeline.failed)]),
+        ("order_retries_total", "counter", "Broker submission retries", [({}, pipeline.retries)]),
+        ("order_queue_overflow_total", "counter", "Orders left pending because the queue was full", [({}, pipeline.overflow)]),
+        ("order_claims_lost_total", "counter", "Queued orders another worker had already claimed", [({}, pipeline.claim_lost)]),
+    ]
+
+
+async def start_order_pipeline(db):
+    await order_pipeline.start(db)
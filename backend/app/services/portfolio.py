@@ -0,0 +1,293 @@
+"""
+Positions and P&L built from executed fills.
+
+Each user's positions carry quantity, average cost and realized P&L. A
+``symbol -> holders`` reverse index means a price tick only touches the
+users who hold the symbol that moved: each holder's unrealized P&L changes
+by ``(new - old) * quantity`` and their portfolio total is adjusted by the
+same delta, so nothing is re-summed. Users with an open socket get the
+delta pushed as a ``pnl`` message, coalesced so a slow client only ever
+has the latest one queued.
+
+Positions are persisted to the ``positions`` collection in batches and
+loaded back at startup. Fills only come from the matching engine, which runs
+on the ``market`` lease holder alone (see ``services/cluster.py``), so that
+worker is the only writer: only while the book is active does it apply fills
+and schedule the flush. A worker that takes the lease activates the book,
+reloading it from Mongo, and one that loses it flushes and deactivates it.
+"""
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional, Set
+
+from pymongo import UpdateOne
+
+from ..core.config import settings
+from ..core.events import price_bus
+from ..core.metrics import registry
+from ..core.scheduler import FIXED_DELAY, scheduler
+from ..services.matching_engine import BUY, Fill, fill_listeners
+from ..services.market_simulator import market_simulator
+from ..websocket.price_socket import manager
+
+logger = logging.getLogger(__name__)
+
+
+class Position:
+    __slots__ = ("symbol", "quantity", "avg_cost", "realized", "price")
+
+    def __init__(self, symbol: str, quantity: int = 0, avg_cost: float = 0.0, realized: float = 0.0, price: float = 0.0):
+        self.symbol = symbol
+        self.quantity = quantity
+        self.avg_cost = avg_cost
+        self.realized = realized
+        self.price = price
+
+    @property
+    def unrealized(self) -> float:
+        return (self.price - self.avg_cost) * self.quantity
+
+    def apply(self, side: str, quantity: int, price: float):
+        """Average-cost accounting; quantity is signed, so sells past zero open a short."""
+        signed = quantity if side == BUY else -quantity
+        if self.quantity == 0 or (self.quantity > 0) == (signed > 0):
+            total = self.quantity + signed
+            self.avg_cost = (self.avg_cost * abs(self.quantity) + price * quantity) / abs(total)
+            self.quantity = total
+            return
+        # Reducing (or flipping) the position realizes P&L on the closed part
+        closed = min(quantity, abs(self.quantity))
+        direction = 1 if self.quantity > 0 else -1
+        self.realized += (price - self.avg_cost) * closed * direction
+        self.quantity += signed
+        if self.quantity == 0:
+            self.avg_cost = 0.0
+        elif (self.quantity > 0) != (direction > 0):
+            # Flipped through zero: the remainder was opened at this fill's price
+            self.avg_cost = price
+
+    def to_dict(self) -> dict:
+        return {
+            "symbol": self.symbol,
+            "quantity": self.quantity,
+            "avg_cost": round(self.avg_cost, 4),
+            "price": self.price,
+            "market_value": round(self.price * self.quantity, 2),
+            "unrealized_pnl": round(self.unrealized, 2),
+            "realized_pnl": round(self.realized, 2),
+        }
+
+
+class PortfolioBook:
+    def __init__(self):
+        self.positions: Dict[str, Dict[str, Position]] = {}
+        # symbol -> users with a non-zero position in it
+        self.holders: Dict[str, Set[str]] = {}
+        self.unrealized: Dict[str, float] = {}
+        self.last_price: Dict[str, float] = {}
+        self._dirty: Set[tuple] = set()
+        self.ticks = 0
+        self.holders_updated = 0
+
+    def apply_fill(self, fill: Fill):
+        user_positions = self.positions.setdefault(fill.user_id, {})
+        position = user_positions.get(fill.symbol)
+        if position is None:
+            position = user_positions[fill.symbol] = Position(fill.symbol)
+        before = position.unrealized
+        position.price = self.last_price.get(fill.symbol, fill.price)
+        position.apply(fill.side, fill.quantity, fill.price)
+        self.unrealized[fill.user_id] = self.unrealized.get(fill.user_id, 0.0) + position.unrealized - before
+        if position.quantity:
+            self.holders.setdefault(fill.symbol, set()).add(fill.user_id)
+        else:
+            self._drop_holder(fill.symbol, fill.user_id)
+        self._dirty.add((fill.user_id, fill.symbol))
+
+    def _drop_holder(self, symbol: str, user_id: str):
+        holders = self.holders.get(symbol)
+        if holders is not None:
+            holders.discard(user_id)
+            if not holders:
+                del self.holders[symbol]
+
+    def on_price(self, symbol: str, price: float) -> Dict[str, List[Position]]:
+        """Reprice one symbol for its holders only; returns the positions that changed per user."""
+        old = self.last_price.get(symbol)
+        self.last_price[symbol] = price
+        holders = self.holders.get(symbol)
+        if not holders or old == price:
+            return {}
+        self.ticks += 1
+        changed: Dict[str, List[Position]] = {}
+        for user_id in holders:
+            position = self.positions[user_id][symbol]
+            delta = (price - position.price) * position.quantity
+            position.price = price
+            self.unrealized[user_id] += delta
+            changed[user_id] = [position]
+        self.holders_updated += len(holders)
+        return changed
+
+    def user_positions(self, user_id: str) -> List[Position]:
+        return list(self.positions.get(user_id, {}).values())
+
+    def summary(self, user_id: str) -> dict:
+        positions = self.user_positions(user_id)
+        return {
+            "positions": [p.to_dict() for p in positions if p.quantity or p.realized],
+            "market_value": round(sum(p.price * p.quantity for p in positions), 2),
+            "cost_basis": round(sum(p.avg_cost * p.quantity for p in positions), 2),
+            "unrealized_pnl": round(self.unrealized.get(user_id, 0.0), 2),
+            "realized_pnl": round(sum(p.realized for p in positions), 2),
+        }
+
+    def load(self, docs: Iterable[dict]):
+        for doc in docs:
+            symbol = doc["symbol"]
+            price = market_simulator.price_of(symbol) or doc.get("avg_cost", 0.0)
+            self.last_price.setdefault(symbol, price)
+            position = Position(symbol, doc["quantity"], doc["avg_cost"], doc.get("realized", 0.0), self.last_price[symbol])
+            self.positions.setdefault(doc["user_id"], {})[symbol] = position
+            self.unrealized[doc["user_id"]] = self.unrealized.get(doc["user_id"], 0.0) + position.unrealized
+            if position.quantity:
+                self.holders.setdefault(symbol, set()).add(doc["user_id"])
+
+    def take_dirty(self) -> Set[tuple]:
+        dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def mark_dirty(self, keys: Iterable[tuple]):
+        self._dirty.update(keys)
+
+    def upserts(self, keys: Iterable[tuple]) -> List[UpdateOne]:
+        ops = []
+        for user_id, symbol in keys:
+            position = self.positions[user_id][symbol]
+            ops.append(UpdateOne(
+                {"user_id": user_id, "symbol": symbol},
+                {"$set": {"quantity": position.quantity, "avg_cost": position.avg_cost, "realized": position.realized}},
+                upsert=True,
+            ))
+        return ops
+
+    def clear(self):
+        self.positions.clear()
+        self.holders.clear()
+        self.unrealized.clear()
+        self._dirty.clear()
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self.positions),
+            "held_symbols": len(self.holders),
+            "ticks": self.ticks,
+            "holders_updated": self.holders_updated,
+        }
+
+
+portfolio_book = PortfolioBook()
+
+
+@registry.collector
+def _collect():
+    book = portfolio_book
+    return [
+        ("portfolio_users", "gauge", "Users with positions in memory", [({}, len(book.positions))]),
+        ("portfolio_held_symbols", "gauge", "Symbols held by at least one user", [({}, len(book.holders))]),
+        ("portfolio_unflushed_positions", "gauge", "Changed positions not yet written to Mongo", [({}, len(book._dirty))]),
+        ("portfolio_ticks_total", "counter", "Price ticks that repriced held positions", [({}, book.ticks)]),
+        ("portfolio_holders_updated_total", "counter", "Holder positions repriced", [({}, book.holders_updated)]),
+    ]
+
+
+def _push_pnl(user_id: str, positions: Optional[List[Position]] = None):
+    # In a cluster the user's socket may be held by another worker; the relay finds it
+    if manager.fanout is None and user_id not in manager.active_connections:
+        return
+    message = {"type": "pnl", "unrealized_pnl": round(portfolio_book.unrealized.get(user_id, 0.0), 2)}
+    if positions:
+        message["positions"] = [p.to_dict() for p in positions]
+    # Coalesced per user: a queued, not yet sent P&L update is replaced, not appended
+    manager.notify_user(user_id, message, key=("pnl",))
+
+
+def _on_fills(fills: List[Fill]):
+    touched: Dict[str, Dict[str, Position]] = {}
+    for fill in fills:
+        portfolio_book.apply_fill(fill)
+        touched.setdefault(fill.user_id, {})[fill.symbol] = portfolio_book.positions[fill.user_id][fill.symbol]
+    for user_id, positions in touched.items():
+        _push_pnl(user_id, list(positions.values()))
+
+
+async def _follow_prices():
+    subscription = price_bus.subscribe()
+    while True:
+        # P&L only needs the latest price per symbol
+        ticks = await subscription.get_batch()
+        changed: Dict[str, List[Position]] = {}
+        for tick in ticks:
+            for user_id, positions in portfolio_book.on_price(tick.symbol, tick.price).items():
+                changed.setdefault(user_id, []).extend(positions)
+        for user_id, positions in changed.items():
+            _push_pnl(user_id, positions)
+
+
+async def _flush_positions(db):
+    dirty = portfolio_book.take_dirty()
+    if not dirty:
+        return
+    try:
+        await db["positions"].bulk_write(portfolio_book.upserts(dirty), ordered=False)
+    except BaseException:
+        # Retried on the next run, after the scheduler's backoff. A run cancelled
+        # on deactivation keeps its positions too, for the final flush.
+        portfolio_book.mark_dirty(dirty)
+        raise
+
+
+async def portfolio_summary(user_id: str) -> dict:
+    return portfolio_book.summary(user_id)
+
+
+async def activate_portfolio(db):
+    """Own the positions, e.g. on becoming the market leader: load them, apply fills, flush them."""
+    # Fills made while Mongo is read are applied on top of what it returns
+    pending: List[Fill] = []
+    buffer = pending.extend
+    fill_listeners.append(buffer)
+    try:
+        docs = [doc async for doc in db["positions"].find({})]
+    finally:
+        fill_listeners.remove(buffer)
+    portfolio_book.clear()
+    portfolio_book.load(docs)
+    _on_fills(pending)
+    if _on_fills not in fill_listeners:
+        fill_listeners.append(_on_fills)
+    scheduler.every("portfolio_flush", lambda: _flush_positions(db), settings.PORTFOLIO_FLUSH_SECONDS, mode=FIXED_DELAY)
+
+
+async def deactivate_portfolio(db):
+    """Stop applying fills and hand the positions back to Mongo for the next leader."""
+    if _on_fills in fill_listeners:
+        fill_listeners.remove(_on_fills)
+    flush = scheduler.tasks.get("portfolio_flush")
+    if flush is not None:
+        flush.cancel()
+    try:
+        await _flush_positions(db)
+    finally:
+        portfolio_book.clear()
+
+
+async def flush_portfolio(db):
+    await _flush_positions(db)
+
+
+async def start_portfolio(db):
+    asyncio.create_task(_follow_prices())
+    # In a cluster the market leader activates the book when it takes the lease
+    if not settings.REDIS_URL:
+        await activate_portfolio(db)
@@ -0,0 +1,461 @@
+"""
+Batched, rate-limited quote fetching for the real-data price sources.
+
+``QuoteFetcher.get`` is what request handlers await. Lookups go through a
+bounded TTL cache; a fresh entry is returned as is, a stale one is returned
+immediately while a background refresh runs (stale-while-revalidate), and a
+miss waits for the next batch. Concurrent misses for a symbol share one
+in-flight future, and misses arriving within ``batch_window`` are grouped
+into multi-symbol requests per source. Blocking SDK calls (nsepython,
+yfinance, requests) run in a thread pool so they never stall the event loop,
+and each source spends tokens from its own bucket before calling upstream.
+
+Sources are tried in priority order, but a source whose circuit breaker is
+open is skipped, and if the current source has not answered within its p95
+latency the request is hedged to the next one; whichever answers first wins.
+"""
+import asyncio
+import logging
+import random
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Sequence, Set
+
+from ..core.cache import TTLCache
+from ..core.config import settings
+from ..core.metrics import registry
+from ..models.stock import Stock
+from .source_health import CircuitBreaker, SourceHealth
+
+try:
+    import yfinance as yf
+    YFINANCE_AVAILABLE = True
+except ImportError:
+    YFINANCE_AVAILABLE = False
+
+try:
+    from nsepython import nse_quote
+    NSE_AVAILABLE = True
+except ImportError:
+    NSE_AVAILABLE = False
+
+try:
+    import requests
+    REQUESTS_AVAILABLE = True
+except ImportError:
+    REQUESTS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+# Demo stocks for fallback
+DEMO_STOCKS: list[Stock] = [
+    Stock(symbol="RELIANCE", name="Reliance Industries", price=2800, change=0.8),
+    Stock(symbol="TCS", name="TCS", price=3900, change=-0.4),
+    Stock(symbol="HDFCBANK", name="HDFC Bank", price=1550, change=1.1),
+    Stock(symbol="INFY", name="Infosys", price=1450, change=1.2),
+    Stock(symbol="ICICIBANK", name="ICICI Bank", price=950, change=-0.3),
+    Stock(symbol="HINDUNILVR", name="Hindustan Unilever", price=2400, change=0.5),
+    Stock(symbol="ITC", name="ITC Limited", price=420, change=0.9),
+    Stock(symbol="SBIN", name="State Bank of India", price=580, change=-0.6),
+    Stock(symbol="BHARTIARTL", name="Bharti Airtel", price=850, change=1.5),
+    Stock(symbol="KOTAKBANK", name="Kotak Mahindra Bank", price=1750, change=0.7),
+]
+
+
+class TokenBucket:
+    """Allows ``rate`` calls per second on average with bursts of up to ``burst``."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.waited_seconds = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0):
+        if self.rate <= 0:
+            return
+        # The lock keeps waiters in FIFO order instead of all waking on the same refill
+        async with self._lock:
+            self._refill()
+            if self._tokens < tokens:
+                wait = (tokens - self._tokens) / self.rate
+                self.waited_seconds += wait
+                await asyncio.sleep(wait)
+                self._refill()
+            self._tokens -= tokens
+
+
+class QuoteSource(ABC):
+    """One upstream. ``fetch_many`` returns the symbols it could price; the rest fall through."""
+
+    name = "base"
+    # Largest number of symbols sent in one upstream call
+    batch_size = 1
+
+    def __init__(self, rate: float = 0.0, executor: Optional[ThreadPoolExecutor] = None):
+        self.bucket = TokenBucket(rate)
+        self.executor = executor
+        self.calls = 0
+        self.health = SourceHealth()
+        self.breaker = CircuitBreaker(
+            self.health,
+            failure_threshold=settings.QUOTE_BREAKER_FAILURES,
+            error_rate=settings.QUOTE_BREAKER_ERROR_RATE,
+            reset_seconds=settings.QUOTE_BREAKER_RESET_SECONDS,
+        )
+
+    @property
+    def available(self) -> bool:
+        return True
+
+    async def fetch_many(self, symbols: Sequence[str]) -> Dict[str, Stock]:
+        await self.bucket.acquire()
+        self.calls += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._fetch_blocking, list(symbols))
+
+    @abstractmethod
+    def _fetch_blocking(self, symbols: List[str]) -> Dict[str, Stock]:
+        """Quotes for ``symbols`` from upstream; runs in the executor, so it may block."""
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "rate_limited_seconds": round(self.bucket.waited_seconds, 3),
+            **self.health.stats(),
+            "breaker": self.breaker.stats(),
+        }
+
+
+class NSESource(QuoteSource):
+    name = "nse"
+    # nsepython has no multi-symbol quote, but one executor hop can serve several
+    batch_size = 5
+
+    @property
+    def available(self) -> bool:
+        return NSE_AVAILABLE
+
+    def _fetch_blocking(self, symbols: List[str]) -> Dict[str, Stock]:
+        quotes = {}
+        for symbol in symbols:
+            try:
+                quote = nse_quote(symbol)
+            except Exception as e:
+                logger.warning(f"NSE Python error for {symbol}: {e}")
+                continue
+            if not quote:
+                continue
+            price = float(quote.get('lastPrice', 0))
+            if not price:
+                continue
+            quotes[symbol] = Stock(
+                symbol=symbol,
+                name=quote.get('info', {}).get('companyName', symbol),
+                price=round(price, 2),
+                change=round(float(quote.get('pChange', 0)), 2),
+            )
+        return quotes
+
+
+class YahooSource(QuoteSource):
+    name = "yahoo"
+    batch_size = 50
+
+    @property
+    def available(self) -> bool:
+        return YFINANCE_AVAILABLE
+
+    def _fetch_blocking(self, symbols: List[str]) -> Dict[str, Stock]:
+        # NSE symbols need .NS suffix for Yahoo Finance; one download covers the whole batch
+        tickers = {f"{symbol}.NS": symbol for symbol in symbols}
+        frame = yf.download(
+            tickers=" ".join(tickers), period="5d", interval="1d",
+            group_by="ticker", progress=False, threads=False,
+        )
+        quotes = {}
+        for ticker, symbol in tickers.items():
+            try:
+                closes = (frame[ticker] if len(tickers) > 1 else frame)["Close"].dropna()
+            except KeyError:
+                continue
+            if closes.empty:
+                continue
+            price = float(closes.iloc[-1])
+            prev_close = float(closes.iloc[-2]) if len(closes) > 1 else price
+            change = (price - prev_close) / prev_close * 100 if prev_close else 0.0
+            quotes[symbol] = Stock(symbol=symbol, name=symbol, price=round(price, 2), change=round(change, 2))
+        return quotes
+
+
+class HTTPQuoteSource(QuoteSource):
+    """
+    Quotes from a JSON endpoint: ``GET {base_url}/quotes?symbols=A,B`` returning a
+    list of ``{"symbol", "name", "price", "change"}``. Used for a local fake quote
+    server in benchmarks and load tests, or an internal market-data gateway.
+    """
+
+    name = "http"
+    batch_size = 100
+
+    def __init__(self, base_url: str, rate: float = 0.0, executor: Optional[ThreadPoolExecutor] = None, timeout: float = 5.0):
+        super().__init__(rate, executor)
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    @property
+    def available(self) -> bool:
+        return REQUESTS_AVAILABLE
+
+    def _fetch_blocking(self, symbols: List[str]) -> Dict[str, Stock]:
+        response = requests.get(
+            f"{self.base_url}/quotes", params={"symbols": ",".join(symbols)}, timeout=self.timeout
+        )
+        response.raise_for_status()
+        return {item["symbol"]: Stock(**item) for item in response.json()}
+
+
+class DemoSource(QuoteSource):
+    name = "demo"
+    batch_size = 1000
+
+    async def fetch_many(self, symbols: Sequence[str]) -> Dict[str, Stock]:
+        # Pure Python and instant; no need for the executor or a rate limit
+        self.calls += 1
+        return self._fetch_blocking(list(symbols))
+
+    def _fetch_blocking(self, symbols: List[str]) -> Dict[str, Stock]:
+        quotes = {}
+        for symbol in symbols:
+            base = next((s for s in DEMO_STOCKS if s.symbol == symbol), None)
+            if base is None:
+                continue
+            # Simulate realistic price movement
+            price = max(1.0, base.price + random.uniform(-10, 10))
+            change = (price - base.price) / base.price * 100
+            quotes[symbol] = Stock(symbol=base.symbol, name=base.name, price=round(price, 2), change=round(change, 2))
+        return quotes
+
+
+class QuoteFetcher:
+    def __init__(
+        self,
+        sources: Sequence[QuoteSource],
+        ttl_seconds: float = 1.0,
+        stale_seconds: float = 30.0,
+        max_entries: int = 5000,
+        batch_window: float = 0.01,
+        hedge_seconds: float = 0.5,
+        source_timeout: float = 5.0,
+    ):
+        self.sources = [source for source in sources if source.available]
+        self.ttl_seconds = ttl_seconds
+        # Entries live for ttl + stale; past ttl they are served while being refreshed
+        self._cache: TTLCache = TTLCache(max_entries, ttl_seconds + stale_seconds)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._pending: Set[str] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self.batch_window = batch_window
+        # Hedge delay for a source until it has enough latency samples for a p95
+        self.hedge_seconds = hedge_seconds
+        self.source_timeout = source_timeout
+        self.hedged = 0
+        self.coalesced = 0
+        self.stale_served = 0
+        self.batches = 0
+
+    async def get(self, symbol: str) -> Optional[Stock]:
+        entry = self._cache.get(symbol)
+        if entry is not None:
+            fetched_at, stock = entry
+            if time.monotonic() - fetched_at >= self.ttl_seconds:
+                self.stale_served += 1
+                self._schedule(symbol)
+            return stock
+        # Shielded: one caller giving up must not cancel the future the others share
+        return await asyncio.shield(self._schedule(symbol))
+
+    async def get_many(self, symbols: Iterable[str]) -> List[Stock]:
+        results = await asyncio.gather(*(self.get(symbol) for symbol in symbols))
+        return [stock for stock in results if stock is not None]
+
+    def _schedule(self, symbol: str) -> asyncio.Future:
+        """Single flight: every caller for a symbol shares the future of the next batch."""
+        future = self._inflight.get(symbol)
+        if future is not None:
+            self.coalesced += 1
+            return future
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[symbol] = future
+        self._pending.add(symbol)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_after_window())
+        return future
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self.batch_window)
+        self._flush_task = None
+        symbols, self._pending = sorted(self._pending), set()
+        self.batches += 1
+        try:
+            quotes = await self._fetch(symbols)
+        except Exception:
+            logger.exception(f"Quote batch for {len(symbols)} symbols failed")
+            quotes = {}
+        now = time.monotonic()
+        for symbol in symbols:
+            stock = quotes.get(symbol)
+            if stock is not None:
+                self._cache.set(symbol, (now, stock))
+            else:
+                # Keep serving the stale value over nothing if a refresh failed
+                entry = self._cache.get(symbol)
+                stock = entry[1] if entry is not None else None
+            future = self._inflight.pop(symbol, None)
+            if future is not None and not future.done():
+                future.set_result(stock)
+
+    async def _fetch(self, symbols: List[str]) -> Dict[str, Stock]:
+        """Keep asking healthy sources, in priority order, for whatever is still unpriced."""
+        quotes: Dict[str, Stock] = {}
+        remaining = list(symbols)
+        tried: Set[str] = set()
+        while remaining:
+            candidates = [source for source in self.sources if source.name not in tried and source.breaker.available()]
+            if not candidates:
+                break
+            result, used = await self._hedged(remaining, candidates)
+            if not used:
+                break
+            tried.update(used)
+            quotes.update(result)
+            remaining = [symbol for symbol in remaining if symbol not in quotes]
+        return quotes
+
+    async def _hedged(self, symbols: List[str], candidates: List[QuoteSource]):
+        """
+        Start with the first candidate; each time the newest request has run past
+        that source's p95 (or failed), also ask the next one. The first non-empty
+        answer wins and the rest are cancelled.
+        """
+        pending: Set[asyncio.Task] = set()
+        used: List[str] = []
+        try:
+            for i, source in enumerate(candidates):
+                # Only a source that is actually called claims a half-open probe
+                if not source.breaker.allow():
+                    continue
+                if pending:
+                    self.hedged += 1
+                pending.add(asyncio.create_task(self._call_source(source, symbols)))
+                used.append(source.name)
+                last = i == len(candidates) - 1
+                delay = None if last else source.health.hedge_delay(self.hedge_seconds)
+                while pending:
+                    done, pending = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.result():
+                            return task.result(), used
+                    if not last:
+                        # Too slow or came back empty: bring in the next source
+                        break
+            return {}, used
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _call_source(self, source: QuoteSource, symbols: List[str]) -> Dict[str, Stock]:
+        """One source, all its chunks; never raises, records latency and outcome for the breaker."""
+        chunks = [symbols[i:i + source.batch_size] for i in range(0, len(symbols), source.batch_size)]
+
+        async def fetch_chunks():
+            return await asyncio.gather(*(source.fetch_many(chunk) for chunk in chunks), return_exceptions=True)
+
+        start = time.monotonic()
+        try:
+            results = await asyncio.wait_for(fetch_chunks(), timeout=self.source_timeout)
+        except asyncio.TimeoutError:
+            results = [asyncio.TimeoutError(f"no answer within {self.source_timeout}s")]
+        except asyncio.CancelledError:
+            # Lost a hedge race; neither a success nor a failure
+            source.health.hedges_lost += 1
+            source.breaker.release()
+            raise
+        quotes: Dict[str, Stock] = {}
+        errors = []
+        for result in results:
+            if isinstance(result, Exception):
+                errors.append(result)
+            else:
+                quotes.update(result)
+        ok = bool(quotes) or not errors
+        source.health.record(time.monotonic() - start, ok)
+        if ok:
+            source.breaker.record_success()
+        else:
+            logger.warning(f"Quote source {source.name} failed: {errors[0]}")
+            source.breaker.record_failure()
+        return quotes
+
+    def stats(self) -> dict:
+        return {
+            "cache": self._cache.stats(),
+            "inflight": len(self._inflight),
+            "coalesced": self.coalesced,
+            "stale_served": self.stale_served,
+            "batches": self.batches,
+            "hedged": self.hedged,
+            "sources": {source.name: source.stats() for source in self.sources},
+        }
+
+
+def _default_sources(executor: ThreadPoolExecutor) -> List[QuoteSource]:
+    sources: List[QuoteSource] = []
+    if settings.QUOTE_SERVER_URL:
+        sources.append(HTTPQuoteSource(settings.QUOTE_SERVER_URL, settings.QUOTE_SERVER_RATE_PER_SECOND, executor))
+    # NSE first (most accurate for Indian stocks), then Yahoo, then demo data
+    sources.append(NSESource(settings.NSE_RATE_PER_SECOND, executor))
+    sources.append(YahooSource(settings.YAHOO_RATE_PER_SECOND, executor))
+    sources.append(DemoSource())
+    return sources
+
+
+quote_executor = ThreadPoolExecutor(max_workers=settings.QUOTE_EXECUTOR_WORKERS, thread_name_prefix="quotes")
+quote_fetcher = QuoteFetcher(
+    _default_sources(quote_executor),
+    ttl_seconds=settings.QUOTE_CACHE_TTL_SECONDS,
+    stale_seconds=settings.QUOTE_STALE_SECONDS,
+    max_entries=settings.QUOTE_CACHE_MAX_ENTRIES,
+    batch_window=settings.QUOTE_BATCH_WINDOW_MS / 1000,
+    hedge_seconds=settings.QUOTE_HEDGE_DEFAULT_MS / 1000,
+    source_timeout=settings.QUOTE_SOURCE_TIMEOUT_SECONDS,
+)
+
+
+@registry.collector
+def _collect():
+    cache = quote_fetcher._cache
+    lookups = cache.hits + cache.misses
+    sources = quote_fetcher.sources
+    return [
+        ("quote_cache_hits_total", "counter", "Quote lookups served from cache, fresh or stale", [({}, cache.hits)]),
+        ("quote_cache_misses_total", "counter", "Quote lookups that needed an upstream fetch", [({}, cache.misses)]),
+        ("quote_cache_hit_ratio", "gauge", "Quote cache hits over lookups", [({}, cache.hits / lookups if lookups else 0.0)]),
+        ("quote_coalesced_total", "counter", "Quote requests that joined an in-flight fetch", [({}, quote_fetcher.coalesced)]),
+        ("quote_stale_served_total", "counter", "Stale quotes served while revalidating", [({}, quote_fetcher.stale_served)]),
+        ("quote_hedged_total", "counter", "Quote fetches hedged to a second source", [({}, quote_fetcher.hedged)]),
+        ("quote_source_calls_total", "counter", "Upstream calls per quote source", [({"source": s.name}, s.calls) for s in sources]),
+        ("quote_source_failures_total", "counter", "Failed upstream calls per quote source", [({"source": s.name}, s.health.failures) for s in sources]),
+        ("quote_source_breaker_open", "gauge", "1 while a source's circuit breaker is not closed", [
+            ({"source": s.name}, 0 if s.breaker.state == s.breaker.CLOSED else 1) for s in sources
+        ]),
+    ]
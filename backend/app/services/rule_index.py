@@ -0,0 +1,266 @@
+"""
+In-memory index of active automation rules.
+
+Rules are grouped per (symbol, series) and each group keeps its min/max
+boundaries in sorted arrays. The series is the price itself for range rules,
+or an indicator value (RSI, a moving-average spread, ...) for indicator rules.
+When a series moves from ``a`` to ``b`` only rules with a boundary between
+``a`` and ``b`` can have changed state, so finding the rules that entered or
+exited costs O(log n + k) per moved series instead of a scan over every rule.
+Each evaluation also returns the rules that are still inside their band, so
+the automation engine can keep those cart prices current. That adds
+O(|inside|) per moved series, independent of how many rules are outside.
+"""
+import logging
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set
+
+from ..services.indicators import PRICE_SERIES, SeriesKey, indicator_registry, series_key
+from ..services.sharding import shard_map
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class IndexedRule:
+    rule_id: str
+    user_id: str
+    symbol: str
+    # Bounds of the band on the rule's series; a price range for plain rules
+    min_price: float
+    max_price: float
+    quantity: int = 1
+    series: SeriesKey = PRICE_SERIES
+
+    def contains(self, price: float) -> bool:
+        return self.min_price <= price <= self.max_price
+
+    @classmethod
+    def from_doc(cls, doc: dict) -> "IndexedRule":
+        indicator = doc.get("indicator", "price")
+        if indicator == "price":
+            low, high = doc["min_price"], doc["max_price"]
+        else:
+            low, high = doc.get("min_value"), doc.get("max_value")
+        return cls(
+            rule_id=str(doc["_id"]),
+            user_id=str(doc["user_id"]),
+            symbol=doc["symbol"],
+            min_price=float("-inf") if low is None else low,
+            max_price=float("inf") if high is None else high,
+            quantity=doc.get("quantity", 1),
+            series=series_key(indicator, doc.get("window"), doc.get("slow_window")),
+        )
+
+
+@dataclass(slots=True)
+class SymbolMatch:
+    """Result of evaluating one series of a symbol at a new value."""
+    symbol: str
+    price: float
+    series: SeriesKey = PRICE_SERIES
+    entered: List[IndexedRule] = field(default_factory=list)
+    exited: List[IndexedRule] = field(default_factory=list)
+    # Every rule still in its band, not only those near the move: O(|inside|) to build
+    inside: List[IndexedRule] = field(default_factory=list)
+
+
+class _SortedBoundaries:
+    """Parallel sorted arrays of (boundary, rule_id)."""
+
+    def __init__(self):
+        self.keys: List[float] = []
+        self.ids: List[str] = []
+
+    def add(self, key: float, rule_id: str):
+        i = bisect_right(self.keys, key)
+        self.keys.insert(i, key)
+        self.ids.insert(i, rule_id)
+
+    def remove(self, key: float, rule_id: str):
+        i = bisect_left(self.keys, key)
+        j = bisect_right(self.keys, key)
+        for k in range(i, j):
+            if self.ids[k] == rule_id:
+                del self.keys[k]
+                del self.ids[k]
+                return
+
+    def between(self, low: float, high: float) -> List[str]:
+        """Rule ids whose boundary lies in the closed interval [low, high]."""
+        return self.ids[bisect_left(self.keys, low):bisect_right(self.keys, high)]
+
+
+class _BandIndex:
+    """All rules watching one series of one symbol."""
+
+    def __init__(self):
+        self.rules: Dict[str, IndexedRule] = {}
+        self.lows = _SortedBoundaries()
+        self.highs = _SortedBoundaries()
+        self.inside: Set[str] = set()
+        self.pending: Set[str] = set()
+        self.last_price: Optional[float] = None
+
+    def add(self, rule: IndexedRule):
+        self.rules[rule.rule_id] = rule
+        self.lows.add(rule.min_price, rule.rule_id)
+        self.highs.add(rule.max_price, rule.rule_id)
+        self.pending.add(rule.rule_id)
+
+    def remove(self, rule_id: str) -> Optional[IndexedRule]:
+        rule = self.rules.pop(rule_id, None)
+        if rule is None:
+            return None
+        self.lows.remove(rule.min_price, rule_id)
+        self.highs.remove(rule.max_price, rule_id)
+        self.inside.discard(rule_id)
+        self.pending.discard(rule_id)
+        return rule
+
+    def evaluate(self, symbol: str, series: SeriesKey, price: float) -> SymbolMatch:
+        match = SymbolMatch(symbol=symbol, price=price, series=series)
+        previous = self.last_price
+        self.last_price = price
+
+        if previous is None:
+            # First price for this symbol: every rule needs a full evaluation
+            candidates = set(self.rules)
+            forced = candidates
+        else:
+            low, high = min(previous, price), max(previous, price)
+            candidates = set(self.lows.between(low, high))
+            candidates.update(self.highs.between(low, high))
+            candidates.update(self.pending)
+            forced = self.pending
+        self.pending = set()
+
+        for rule_id in candidates:
+            rule = self.rules[rule_id]
+            was_inside = rule_id in self.inside
+            if rule.contains(price):
+                self.inside.add(rule_id)
+                if rule_id in forced or not was_inside:
+                    match.entered.append(rule)
+            else:
+                if rule_id in forced or was_inside:
+                    match.exited.append(rule)
+                self.inside.discard(rule_id)
+
+        entered = {rule.rule_id for rule in match.entered}
+        match.inside = [self.rules[r] for r in self.inside if r not in entered]
+        return match
+
+
+class RuleIndex:
+    def __init__(self):
+        self._bands: Dict[str, Dict[SeriesKey, _BandIndex]] = {}
+        self._by_id: Dict[str, IndexedRule] = {}
+        self._by_user: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def symbols(self) -> List[str]:
+        return list(self._bands.keys())
+
+    def has_user(self, user_id: str) -> bool:
+        return user_id in self._by_user
+
+    def user_ids(self) -> List[str]:
+        return list(self._by_user.keys())
+
+    def user_symbols(self, user_id: str) -> Set[str]:
+        return {self._by_id[rule_id].symbol for rule_id in self._by_user.get(user_id, ())}
+
+    def add(self, rule: IndexedRule):
+        if rule.rule_id in self._by_id:
+            self.remove(rule.rule_id)
+        self._by_id[rule.rule_id] = rule
+        self._by_user.setdefault(rule.user_id, set()).add(rule.rule_id)
+        self._bands.setdefault(rule.symbol, {}).setdefault(rule.series, _BandIndex()).add(rule)
+        indicator_registry.acquire(rule.symbol, rule.series)
+
+    def remove(self, rule_id: str) -> Optional[IndexedRule]:
+        rule = self._by_id.pop(rule_id, None)
+        if rule is None:
+            return None
+        series_bands = self._bands.get(rule.symbol, {})
+        band = series_bands.get(rule.series)
+        if band is not None:
+            band.remove(rule_id)
+            if not band.rules:
+                del series_bands[rule.series]
+            if not series_bands:
+                del self._bands[rule.symbol]
+        indicator_registry.release(rule.symbol, rule.series)
+        user_rules = self._by_user.get(rule.user_id)
+        if user_rules is not None:
+            user_rules.discard(rule_id)
+            if not user_rules:
+                del self._by_user[rule.user_id]
+        return rule
+
+    def remove_user(self, user_id: str) -> int:
+        rule_ids = list(self._by_user.get(user_id, ()))
+        for rule_id in rule_ids:
+            self.remove(rule_id)
+        return len(rule_ids)
+
+    def deactivate(self, user_id: str, symbol: str) -> int:
+        """Drop every rule a user has on a symbol (mirrors the cart-removal update_many)."""
+        rule_ids = [
+            rule_id for rule_id in self._by_user.get(user_id, ())
+            if self._by_id[rule_id].symbol == symbol
+        ]
+        for rule_id in rule_ids:
+            self.remove(rule_id)
+        return len(rule_ids)
+
+    def mark_pending(self, user_id: str):
+        """Force a full re-evaluation of a user's rules on the next tick, e.g. after their cart was bought."""
+        for rule_id in self._by_user.get(user_id, ()):
+            rule = self._by_id[rule_id]
+            band = self._bands[rule.symbol][rule.series]
+            band.inside.discard(rule_id)
+            band.pending.add(rule_id)
+
+    def evaluate(self, symbol: str, price: float) -> List[SymbolMatch]:
+        """
+        Evaluate every series of a symbol at its current value.
+
+        Indicator values must already have been fed with this tick through
+        ``indicator_registry.update``. Series that have not moved and have no
+        pending rules are skipped, as are indicators still warming up.
+        """
+        series_bands = self._bands.get(symbol)
+        if not series_bands:
+            return []
+        values = indicator_registry.values(symbol)
+        matches = []
+        for series, band in series_bands.items():
+            value = price if series == PRICE_SERIES else values.get(series)
+            if value is None:
+                continue
+            if not band.pending and band.last_price == value:
+                continue
+            matches.append(band.evaluate(symbol, series, value))
+        return matches
+
+    def load(self, docs: Iterable[dict]):
+        self._bands.clear()
+        self._by_id.clear()
+        self._by_user.clear()
+        for doc in docs:
+            self.add(IndexedRule.from_doc(doc))
+        logger.info(f"Rule index loaded {len(self._by_id)} rules across {len(self._bands)} symbols.")
+
+
+rule_index = RuleIndex()
+
+
+async def load_rule_index(db):
+    # In a cluster each worker indexes only the users it owns
+    docs = [doc async for doc in db["rules"].find({"active": True}) if shard_map.owns(doc["user_id"])]
+    rule_index.load(docs)
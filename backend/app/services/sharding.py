@@ -0,0 +1,104 @@
+"""
+Partitioning per-user work across the live workers of a cluster.
+
+``Membership`` keeps each worker's heartbeat in a Redis sorted set. The
+score is the heartbeat's expiry time, so a worker that stops beating drops
+out after ``ttl_seconds``. ``ShardMap`` assigns every user to one live
+worker by rendezvous (highest random weight) hashing. Each worker computes
+the same owner from the same member list without any coordination. When a
+worker joins or leaves, only the users it gains or loses change owner;
+everyone else stays where they were.
+
+Run as a single process, the map has one member and owns every user.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import socket
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _weight(worker: str, key: str) -> int:
+    # Python's hash() is salted per process; workers need to agree
+    return int.from_bytes(hashlib.blake2b(f"{worker}|{key}".encode(), digest_size=8).digest(), "big")
+
+
+class ShardMap:
+    def __init__(self, worker: str):
+        self.worker = worker
+        self.members: List[str] = [worker]
+        self._owners: Dict[str, str] = {}
+        self.rebalances = 0
+
+    def set_members(self, members: List[str]) -> bool:
+        """Replace the member list; returns True when ownership may have changed."""
+        members = sorted(set(members) | {self.worker})
+        if members == self.members:
+            return False
+        self.members = members
+        self._owners.clear()
+        self.rebalances += 1
+        return True
+
+    def owner(self, key: str) -> str:
+        owner = self._owners.get(key)
+        if owner is None:
+            owner = self._owners[key] = max(self.members, key=lambda worker: _weight(worker, key))
+        return owner
+
+    def owns(self, key: str) -> bool:
+        return len(self.members) == 1 or self.owner(key) == self.worker
+
+    def stats(self) -> dict:
+        return {"worker": self.worker, "members": self.members, "rebalances": self.rebalances}
+
+
+shard_map = ShardMap(worker_id)
+
+
+class Membership:
+    def __init__(self, redis, key: str, shards: ShardMap, ttl_seconds: float = 3.0,
+                 on_change: Optional[Callable[[], Awaitable[None]]] = None):
+        self.redis = redis
+        self.key = key
+        self.shards = shards
+        self.ttl_seconds = ttl_seconds
+        self.on_change = on_change
+        self._rebalance_pending = False
+
+    async def beat(self):
+        now = time.time()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(self.key, {self.shards.worker: now + self.ttl_seconds})
+            pipe.zremrangebyscore(self.key, "-inf", now)
+            pipe.zrange(self.key, 0, -1)
+            _, _, members = await pipe.execute()
+        members = [m.decode() if isinstance(m, bytes) else m for m in members]
+        if self.shards.set_members(members):
+            logger.info(f"Cluster members now {self.shards.members}")
+            self._rebalance_pending = True
+        if self._rebalance_pending and self.on_change is not None:
+            # Cleared only once it succeeds, so a failed rebalance is retried on the next beat
+            await self.on_change()
+        self._rebalance_pending = False
+
+    async def run(self):
+        interval = self.ttl_seconds / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.beat()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Keep the last known members; a short Redis blip should not reshuffle every shard
+                logger.warning(f"Cluster heartbeat failed: {e}")
+
+    async def leave(self):
+        await self.redis.zrem(self.key, self.shards.worker)
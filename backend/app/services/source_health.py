@@ -0,0 +1,134 @@
+"""
+Health tracking and circuit breaking for upstream quote sources.
+
+``SourceHealth`` keeps a rolling window of call latencies and outcomes, from
+which it derives latency percentiles, an error rate and the delay after which
+a hedged request should go to the next source. ``CircuitBreaker`` stops calls
+to a source that keeps failing and lets a single probe through after a
+cool-down to find out whether it has recovered.
+"""
+import time
+from collections import deque
+from typing import Deque, Optional
+
+
+class SourceHealth:
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self.successes = 0
+        self.failures = 0
+        self.hedges_lost = 0
+
+    def record(self, latency: float, ok: bool):
+        self._outcomes.append(ok)
+        if ok:
+            # Failures are often timeouts; keeping them out keeps p95 meaningful
+            self._latencies.append(latency)
+            self.successes += 1
+        else:
+            self.failures += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    @property
+    def samples(self) -> int:
+        return len(self._outcomes)
+
+    @property
+    def error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return 1.0 - sum(self._outcomes) / len(self._outcomes)
+
+    def hedge_delay(self, default: float) -> float:
+        """How long to wait for this source before also asking the next one: its p95 once known."""
+        if len(self._latencies) < self.min_samples:
+            return default
+        return self.percentile(0.95)
+
+    def stats(self) -> dict:
+        def ms(value: Optional[float]) -> Optional[float]:
+            return None if value is None else round(value * 1000, 2)
+        return {
+            "successes": self.successes,
+            "failures": self.failures,
+            "hedges_lost": self.hedges_lost,
+            "error_rate": round(self.error_rate, 4),
+            "p50_ms": ms(self.percentile(0.50)),
+            "p95_ms": ms(self.percentile(0.95)),
+            "p99_ms": ms(self.percentile(0.99)),
+        }
+
+
+class CircuitBreaker:
+    """
+    closed -> open after ``failure_threshold`` consecutive failures, or once the
+    rolling error rate reaches ``error_rate`` over enough samples.
+    open -> half_open after ``reset_seconds``; one probe call is let through.
+    half_open -> closed on success, back to open on failure.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, health: SourceHealth, failure_threshold: int = 5, error_rate: float = 0.5, reset_seconds: float = 30.0):
+        self.health = health
+        self.failure_threshold = failure_threshold
+        self.max_error_rate = error_rate
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probing = False
+
+    def available(self) -> bool:
+        """Whether ``allow`` would let a call through, without claiming the half-open probe."""
+        if self.state == self.OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_seconds
+        return self.state == self.CLOSED or not self._probing
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self._probing = False
+        self.state = self.CLOSED
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN:
+            self._open()
+        elif self.state == self.CLOSED and (
+            self.consecutive_failures >= self.failure_threshold
+            or (self.health.samples >= self.health.min_samples and self.health.error_rate >= self.max_error_rate)
+        ):
+            self._open()
+
+    def release(self):
+        """A probe was cancelled before it finished; let the next call probe instead."""
+        self._probing = False
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.trips += 1
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.consecutive_failures, "trips": self.trips}
@@ -0,0 +1,238 @@
+"""
+Replay a recorded tick file through the price bus.
+
+A pluggable price source for capacity testing: instead of the simulator's
+random walk, ticks are streamed from a file through a generator pipeline
+
+    read_ticks(path) -> chunks -> batches(...) -> ReplayMarket.run_forever
+
+and applied to the same columnar arrays ``MarketSimulator`` uses, so every
+consumer (``fetch_live_price``, the snapshot, websockets, the automation
+engine) sees them without changes. Set ``MARKET_SOURCE=replay`` and
+``MARKET_REPLAY_FILE`` to swap it in for ``market_simulator``.
+
+Supported files, one row per tick with ``ts`` (unix seconds), ``symbol``,
+``price`` and optionally ``name``:
+
+* ``.csv``, optionally compressed (``.csv.gz``, ``.csv.bz2``, ``.csv.xz``)
+* ``.parquet`` (needs pyarrow)
+* ``.npy`` structured arrays of ``TICK_DTYPE``, memory-mapped so a replay of a
+  file larger than RAM only pages in the chunk being played
+
+``speed`` is a multiplier on the recorded pacing; 0 plays as fast as possible.
+"""
+import asyncio
+import bz2
+import csv
+import gzip
+import logging
+import lzma
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from ..core.events import PriceTick, price_bus
+from ..core.scheduler import ScheduledTask, Scheduler
+from .market_simulator import MarketSimulator
+
+try:
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+TICK_DTYPE = np.dtype([("ts", "<f8"), ("symbol", "S16"), ("price", "<f8")])
+CHUNK_ROWS = 65536
+
+# (timestamps, symbols as bytes, prices, names or None), all the same length
+Chunk = Tuple[np.ndarray, np.ndarray, np.ndarray, Optional[List[str]]]
+
+_OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+
+def _read_csv(path: str, chunk_rows: int) -> Iterator[Chunk]:
+    opener = next((fn for ext, fn in _OPENERS.items() if path.endswith(ext)), open)
+    with opener(path, "rt", newline="") as f:
+        reader = csv.DictReader(f)
+        while True:
+            rows = [row for _, row in zip(range(chunk_rows), reader)]
+            if not rows:
+                return
+            names = [row["name"] for row in rows] if "name" in rows[0] else None
+            yield (
+                np.fromiter((float(row["ts"]) for row in rows), dtype=np.float64, count=len(rows)),
+                np.array([row["symbol"].encode() for row in rows], dtype="S16"),
+                np.fromiter((float(row["price"]) for row in rows), dtype=np.float64, count=len(rows)),
+                names,
+            )
+
+
+def _read_parquet(path: str, chunk_rows: int) -> Iterator[Chunk]:
+    if not PARQUET_AVAILABLE:
+        raise RuntimeError("Replaying parquet files requires pyarrow")
+    parquet = pq.ParquetFile(path)
+    for batch in parquet.iter_batches(batch_size=chunk_rows):
+        columns = batch.to_pydict()
+        yield (
+            np.asarray(columns["ts"], dtype=np.float64),
+            np.array([s.encode() for s in columns["symbol"]], dtype="S16"),
+            np.asarray(columns["price"], dtype=np.float64),
+            columns.get("name"),
+        )
+
+
+def _read_npy(path: str, chunk_rows: int) -> Iterator[Chunk]:
+    ticks = np.load(path, mmap_mode="r")
+    for start in range(0, len(ticks), chunk_rows):
+        # Slicing a memmap only touches the pages of this chunk
+        chunk = ticks[start:start + chunk_rows]
+        yield np.asarray(chunk["ts"]), np.asarray(chunk["symbol"]), np.asarray(chunk["price"]), None
+
+
+def read_ticks(path: str, chunk_rows: int = CHUNK_ROWS) -> Iterator[Chunk]:
+    """Stream a tick file as columnar chunks, never holding more than one chunk in memory."""
+    if path.endswith(".npy"):
+        return _read_npy(path, chunk_rows)
+    if path.endswith(".parquet"):
+        return _read_parquet(path, chunk_rows)
+    return _read_csv(path, chunk_rows)
+
+
+def batches(chunks: Iterable[Chunk]) -> Iterator[Chunk]:
+    """Split chunks into runs of ticks that share a timestamp; each run is published together."""
+    for ts, symbols, prices, names in chunks:
+        bounds = np.flatnonzero(np.diff(ts)) + 1
+        start = 0
+        for end in (*bounds.tolist(), len(ts)):
+            yield ts[start:end], symbols[start:end], prices[start:end], None if names is None else names[start:end]
+            start = end
+
+
+def save_ticks(path: str, chunks: Iterable[Chunk]):
+    """Write ticks as a ``TICK_DTYPE`` .npy file so later replays can memory-map it."""
+    parts = []
+    for ts, symbols, prices, _ in chunks:
+        part = np.empty(len(ts), dtype=TICK_DTYPE)
+        part["ts"], part["symbol"], part["price"] = ts, symbols, prices
+        parts.append(part)
+    np.save(path, np.concatenate(parts) if parts else np.empty(0, dtype=TICK_DTYPE))
+
+
+class ReplayMarket(MarketSimulator):
+    """A ``MarketSimulator`` whose prices come from a tick file instead of a random walk."""
+
+    def __init__(self, path: str, speed: float = 1.0, loop: bool = False):
+        super().__init__(num_symbols=0)
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.ticks_replayed = 0
+        self.lag_seconds = 0.0
+        # Last timestamp published; the replay clock never goes back past it
+        self.clock: Optional[float] = None
+        self._scan()
+
+    def _scan(self):
+        """One pass over the file for the symbol universe and each symbol's opening price."""
+        first: Dict[bytes, Tuple[float, str]] = {}
+        self.first_ts: Optional[float] = None
+        self.last_ts: Optional[float] = None
+        self.tick_count = 0
+        for ts, symbols, prices, names in read_ticks(self.path):
+            if not len(ts):
+                continue
+            self.tick_count += len(ts)
+            if self.first_ts is None:
+                self.first_ts = float(ts[0])
+            self.last_ts = float(ts[-1])
+            unique, positions = np.unique(symbols, return_index=True)
+            for symbol, i in zip(unique.tolist(), positions.tolist()):
+                if symbol not in first:
+                    first[symbol] = (float(prices[i]), names[i] if names else symbol.decode())
+        self.symbols = [symbol.decode() for symbol in first]
+        self.names = [name for _, name in first.values()]
+        self.prices = np.asarray([price for price, _ in first.values()], dtype=np.float64)
+        self.changes = np.zeros(len(self.symbols), dtype=np.float64)
+        self._index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self._codes = {symbol: i for i, symbol in enumerate(first)}
+        logger.info(f"Replay file {self.path}: {len(self.symbols)} symbols")
+
+    def _positions(self, symbols: np.ndarray) -> np.ndarray:
+        unique, inverse = np.unique(symbols, return_inverse=True)
+        lookup = np.fromiter((self._codes[s] for s in unique.tolist()), dtype=np.int64, count=len(unique))
+        return lookup[inverse]
+
+    def apply(self, ts: float, symbols: np.ndarray, prices: np.ndarray):
+        """Apply one batch of ticks to the arrays and publish the symbols that moved."""
+        idx = self._positions(symbols)
+        old = self.prices[idx]
+        moved = prices != old
+        self.changes[idx] = np.round((prices - old) / old * 100.0, 2)
+        self.prices[idx] = prices
+        self.ticks_replayed += len(idx)
+        for i in idx[moved].tolist():
+            price_bus.publish(PriceTick(
+                symbol=self.symbols[i],
+                name=self.names[i],
+                price=float(self.prices[i]),
+                change=float(self.changes[i]),
+                timestamp=ts,
+            ))
+
+    def _gap(self) -> float:
+        # Between the end of one pass and the start of the next: the file's mean spacing
+        if self.tick_count > 1 and self.last_ts > self.first_ts:
+            return (self.last_ts - self.first_ts) / (self.tick_count - 1)
+        return 1.0
+
+    async def update_prices(self):
+        """Replay the whole file once, paced by ``speed``."""
+        if self.first_ts is None:
+            return
+        started = time.monotonic()
+        # Replayed ticks are stamped on a market clock that keeps the recorded
+        # spacing, so bars and indicators stay meaningful at any speed. A pass
+        # starts now, or just after the previous pass's last tick if that is
+        # later (speed > 1 runs ahead of the wall clock): indicators drop any
+        # tick not newer than the last one they saw.
+        start = time.time()
+        if self.clock is not None:
+            start = max(start, self.clock + self._gap())
+        offset = start - self.first_ts
+        for ts, symbols, prices, _ in batches(read_ticks(self.path)):
+            if self.speed > 0:
+                due = started + (ts[0] - self.first_ts) / self.speed
+                delay = due - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    self.lag_seconds = float(-delay)
+                    await asyncio.sleep(0)
+            else:
+                # As fast as possible, but let subscribers drain between batches
+                await asyncio.sleep(0)
+            self.clock = float(ts[0]) + offset
+            self.apply(self.clock, symbols, prices)
+        logger.info(f"Replay of {self.path} finished: {self.ticks_replayed} ticks")
+
+    async def run_forever(self):
+        while True:
+            await self.update_prices()
+            if not self.loop:
+                return
+
+    def schedule(self, scheduler: Scheduler) -> ScheduledTask:
+        # Paced by the file itself; restarted from the top if it crashes
+        return scheduler.supervise("market", self.run_forever)
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "speed": self.speed,
+            "symbols": len(self.symbols),
+            "ticks_replayed": self.ticks_replayed,
+            "lag_seconds": round(self.lag_seconds, 3),
+        }
@@ -0,0 +1,216 @@
+"""
+Append-only price history with incremental OHLCV bars.
+
+Each symbol gets a ring of raw ticks plus one ring of bars per interval
+(1m/5m/1h). Rings are columnar NumPy buffers that start small and double up
+to a fixed cap, so memory follows the data actually seen. Bars are built as
+ticks arrive (O(1) per tick per interval); a history query binary-searches
+the bar ring and never touches raw ticks. Closed bars can optionally be
+spilled to a Mongo time-series collection for longer retention.
+"""
+import asyncio
+import logging
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from pymongo.errors import BulkWriteError
+
+from ..core.config import settings
+from ..core.events import PriceTick, price_bus
+from ..core.scheduler import FIXED_DELAY, scheduler
+
+logger = logging.getLogger(__name__)
+
+INTERVALS: Dict[str, int] = {"1m": 60, "5m": 300, "1h": 3600}
+BAR_FIELDS = ("t", "o", "h", "l", "c", "v")
+BARS_COLLECTION = "price_bars"
+
+
+class _Ring:
+    """Fixed-cap columnar ring buffer of float64 rows, oldest first."""
+
+    def __init__(self, columns: int, max_capacity: int, initial_capacity: int = 64):
+        self.max_capacity = max_capacity
+        self._data = np.empty((min(initial_capacity, max_capacity), columns), dtype=np.float64)
+        self._start = 0
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def append(self, row: Tuple[float, ...]):
+        capacity = self._data.shape[0]
+        if self._len == capacity and capacity < self.max_capacity:
+            # Never wrapped before reaching the cap, so growing is a plain copy
+            grown = np.empty((min(capacity * 2, self.max_capacity), self._data.shape[1]), dtype=np.float64)
+            grown[:capacity] = self._data
+            self._data = grown
+            capacity = grown.shape[0]
+        if self._len < capacity:
+            self._data[(self._start + self._len) % capacity] = row
+            self._len += 1
+        else:
+            self._data[self._start] = row
+            self._start = (self._start + 1) % capacity
+
+    def key(self, i: int) -> float:
+        """First column of the i-th oldest row."""
+        return self._data[(self._start + i) % self._data.shape[0], 0]
+
+    def rows(self, lo: int, hi: int) -> np.ndarray:
+        capacity = self._data.shape[0]
+        idx = (self._start + np.arange(lo, hi)) % capacity
+        return self._data[idx]
+
+
+class _Keys:
+    """Sequence view over a ring's first column so ``bisect`` can search it."""
+
+    def __init__(self, ring: _Ring):
+        self._ring = ring
+
+    def __len__(self) -> int:
+        return len(self._ring)
+
+    def __getitem__(self, i: int) -> float:
+        return self._ring.key(i)
+
+
+class _BarSeries:
+    def __init__(self, seconds: int, max_bars: int):
+        self.seconds = seconds
+        self.closed = _Ring(len(BAR_FIELDS), max_bars)
+        self.current: Optional[List[float]] = None
+
+    def update(self, ts: float, price: float) -> Optional[List[float]]:
+        """Fold a tick into the open bar; returns the bar that was closed, if any."""
+        bucket = ts - (ts % self.seconds)
+        bar = self.current
+        if bar is not None and bucket == bar[0]:
+            bar[2] = max(bar[2], price)
+            bar[3] = min(bar[3], price)
+            bar[4] = price
+            bar[5] += 1
+            return None
+        finished = None
+        if bar is not None and bucket > bar[0]:
+            self.closed.append(tuple(bar))
+            finished = bar
+        elif bar is not None:
+            # Out-of-order tick for an older bucket: fold into the open bar rather than rewrite history
+            bar[4] = price
+            bar[5] += 1
+            return None
+        self.current = [bucket, price, price, price, price, 1.0]
+        return finished
+
+    def range(self, start: float, end: float, limit: int) -> List[List[float]]:
+        keys = _Keys(self.closed)
+        lo = bisect_left(keys, start)
+        hi = bisect_right(keys, end)
+        bars = self.closed.rows(max(lo, hi - limit), hi).tolist()
+        if self.current is not None and start <= self.current[0] <= end:
+            bars.append(list(self.current))
+        return bars[-limit:]
+
+
+class _SymbolHistory:
+    def __init__(self):
+        self.ticks = _Ring(2, settings.TICK_STORE_MAX_TICKS)
+        self.bars = {
+            name: _BarSeries(seconds, settings.TICK_STORE_MAX_BARS)
+            for name, seconds in INTERVALS.items()
+        }
+
+
+class TickStore:
+    def __init__(self):
+        self._symbols: Dict[str, _SymbolHistory] = {}
+        self._spill: List[dict] = []
+        self.ticks_recorded = 0
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self._symbols
+
+    def record(self, symbol: str, ts: float, price: float):
+        history = self._symbols.get(symbol)
+        if history is None:
+            history = self._symbols[symbol] = _SymbolHistory()
+        history.ticks.append((ts, price))
+        self.ticks_recorded += 1
+        for name, series in history.bars.items():
+            finished = series.update(ts, price)
+            if finished is not None and settings.TICK_STORE_SPILL_TO_MONGO:
+                self._spill.append(_bar_document(symbol, name, finished))
+
+    def bars(self, symbol: str, interval: str, start: float, end: float, limit: int) -> List[dict]:
+        history = self._symbols.get(symbol)
+        if history is None:
+            return []
+        rows = history.bars[interval].range(start, end, limit)
+        return [dict(zip(BAR_FIELDS, row)) for row in rows]
+
+    def take_spill(self) -> List[dict]:
+        spill, self._spill = self._spill, []
+        return spill
+
+    def return_spill(self, docs: List[dict]):
+        """Put bars that failed to spill back in front of the next batch."""
+        self._spill[:0] = docs
+
+
+def _bar_document(symbol: str, interval: str, bar: List[float]) -> dict:
+    return {
+        "ts": datetime.fromtimestamp(bar[0], tz=timezone.utc),
+        "meta": {"symbol": symbol, "interval": interval},
+        "open": bar[1],
+        "high": bar[2],
+        "low": bar[3],
+        "close": bar[4],
+        "ticks": int(bar[5]),
+    }
+
+
+tick_store = TickStore()
+
+
+async def _record_ticks():
+    subscription = price_bus.subscribe()
+    while True:
+        # Every tick matters for OHLC, so no per-symbol coalescing here
+        tick: PriceTick = await subscription.get()
+        tick_store.record(tick.symbol, tick.timestamp, tick.price)
+
+
+async def _spill_bars(db):
+    docs = tick_store.take_spill()
+    if not docs:
+        return
+    try:
+        await db[BARS_COLLECTION].insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        # Unordered: the rest went in, so only the rejected bars are retried
+        failed = [docs[error["index"]] for error in e.details.get("writeErrors", [])]
+        tick_store.return_spill(failed)
+        logger.error(f"Failed to spill {len(failed)} of {len(docs)} bars to Mongo; retrying next spill")
+    except Exception:
+        tick_store.return_spill(docs)
+        logger.exception(f"Failed to spill {len(docs)} bars to Mongo; retrying next spill")
+
+
+async def _ensure_bars_collection(db):
+    if BARS_COLLECTION in await db.list_collection_names():
+        return
+    await db.create_collection(
+        BARS_COLLECTION,
+        timeseries={"timeField": "ts", "metaField": "meta", "granularity": "minutes"},
+    )
+
+
+async def start_tick_store(db=None):
+    asyncio.create_task(_record_ticks())
+    if settings.TICK_STORE_SPILL_TO_MONGO and db is not None:
+        await _ensure_bars_collection(db)
+        scheduler.every("tick_spill", lambda: _spill_bars(db), settings.TICK_STORE_SPILL_SECONDS, mode=FIXED_DELAY)
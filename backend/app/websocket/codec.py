@@ -0,0 +1,84 @@
+"""
+Wire encodings for websocket messages.
+
+Every outbound message is encoded once per broadcast into an ``OutboundMessage``
+and the same bytes are handed to each subscriber. Clients choose a format when
+they connect (``/ws/{user_id}?format=binary``):
+
+* ``json`` (default): a text frame, encoded with orjson when it is installed.
+* ``binary``: price updates use a fixed struct layout, everything else is a
+  JSON body behind a one-byte type tag.
+
+Binary frame layout (little endian)::
+
+    0x01 | symbol_len: u8 | symbol: utf-8 | price: f64 | change: f64
+    0x00 | json body
+"""
+import json
+import struct
+from typing import Any, Optional
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+FORMATS = ("json", "binary")
+
+FRAME_JSON = 0x00
+FRAME_PRICE = 0x01
+_PRICE_TAIL = struct.Struct("<dd")
+
+
+def dumps(obj: Any) -> bytes:
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def encode_price_frame(symbol: str, price: float, change: float) -> bytes:
+    encoded = symbol.encode()
+    return bytes((FRAME_PRICE, len(encoded))) + encoded + _PRICE_TAIL.pack(price, change)
+
+
+def decode_frame(frame: bytes) -> dict:
+    """Inverse of the binary encoding; used by tests, tools and Python clients."""
+    if frame[0] == FRAME_PRICE:
+        length = frame[1]
+        symbol = frame[2:2 + length].decode()
+        price, change = _PRICE_TAIL.unpack_from(frame, 2 + length)
+        return {"type": "price", "symbol": symbol, "price": price, "change": change}
+    return json.loads(frame[1:])
+
+
+class OutboundMessage:
+    """A message encoded at most once per format, shared by every recipient."""
+
+    __slots__ = ("_obj", "_text", "_binary", "_price")
+
+    def __init__(self, obj: dict, price: Optional[tuple] = None):
+        self._obj = obj
+        self._price = price
+        self._text: Optional[str] = None
+        self._binary: Optional[bytes] = None
+
+    @classmethod
+    def price(cls, symbol: str, price: float, change: float) -> "OutboundMessage":
+        obj = {"type": "price", "symbol": symbol, "price": price, "change": change}
+        return cls(obj, price=(symbol, price, change))
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = dumps(self._obj).decode()
+        return self._text
+
+    @property
+    def binary(self) -> bytes:
+        if self._binary is None:
+            if self._price is not None:
+                self._binary = encode_price_frame(*self._price)
+            else:
+                self._binary = bytes((FRAME_JSON,)) + dumps(self._obj)
+        return self._binary
@@ -1,50 +1,368 @@
-from typing import Dict, List
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+import asyncio
+import itertools
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, List, Optional, Set
+from fastapi import APIRouter, Depends, Query, WebSocket, WebSocketDisconnect, status
+from ..api.auth import websocket_user
+from ..core.config import settings
+from ..core.security import token_expires_in
+from ..core.events import PriceTick, price_bus
+from ..core.metrics import registry
+from .codec import FORMATS, OutboundMessage
 from ..models.cart import CartItem
+from ..db.session import get_db
+from ..services.market_simulator import market_simulator
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+QUEUE_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+# Path of the unauthenticated socket, which only gets the public price channel
+GUEST = "guest"
+
+send_latency = registry.histogram(
+    "ws_send_seconds",
+    "Time for one websocket send to complete",
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0, 5.0),
+)
+
+
+class ClientConnection:
+    """
+    One websocket plus its bounded outbound queue and writer task.
+
+    Producers call ``send`` which never awaits the socket. When the queue is
+    full the policy decides: ``drop_oldest`` discards the oldest message,
+    ``coalesce`` additionally replaces a queued message that has the same key
+    (e.g. an older price for the same symbol), and ``disconnect`` evicts the
+    client. Clients that time out on a send or keep overflowing are evicted.
+    """
+
+    _sequence = itertools.count()
+
+    def __init__(self, manager: "ConnectionManager", user_id: Optional[str], websocket: WebSocket, wire_format: str = "json"):
+        self.manager = manager
+        self.user_id = user_id
+        self.websocket = websocket
+        self.binary = wire_format == "binary"
+        self.max_queue = settings.WS_SEND_QUEUE_SIZE
+        self.policy = settings.WS_QUEUE_POLICY if settings.WS_QUEUE_POLICY in QUEUE_POLICIES else "drop_oldest"
+        self._queue: "OrderedDict[Hashable, OutboundMessage]" = OrderedDict()
+        self._ready = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.consecutive_drops = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def send(self, message: OutboundMessage, key: Optional[Hashable] = None):
+        if self.closed:
+            return
+        if key is not None and self.policy == "coalesce" and key in self._queue:
+            # Keep the queue position, replace the stale payload
+            self._queue[key] = message
+            self.coalesced += 1
+            self.manager.coalesced += 1
+            return
+        if len(self._queue) >= self.max_queue:
+            if self.policy == "disconnect":
+                self.evict("send queue overflow")
+                return
+            self._queue.popitem(last=False)
+            self.dropped += 1
+            self.manager.dropped += 1
+            self.consecutive_drops += 1
+            if self.consecutive_drops >= settings.WS_MAX_CONSECUTIVE_DROPS:
+                self.evict("too many dropped messages")
+                return
+        self._queue[key if key is not None else ("msg", next(self._sequence))] = message
+        self._ready.set()
+
+    async def _write_loop(self):
+        while not self.closed:
+            if not self._queue:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            _, message = self._queue.popitem(last=False)
+            # The message encodes itself once per format; every recipient shares the result
+            if self.binary:
+                send = self.websocket.send_bytes(message.binary)
+            else:
+                send = self.websocket.send_text(message.text)
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(send, timeout=settings.WS_SEND_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                self.evict("send timed out")
+                return
+            except Exception:
+                self.evict("send failed")
+                return
+            send_latency.observe(time.perf_counter() - started)
+            self.sent += 1
+            self.manager.sent += 1
+            self.consecutive_drops = 0
+
+    def evict(self, reason: str):
+        if self.closed:
+            return
+        logger.info(f"Evicting websocket for user {self.user_id or GUEST}: {reason}")
+        self.manager.evicted += 1
+        self.close()
+        self.manager.disconnect(self.user_id, self.websocket)
+        asyncio.create_task(self._close_socket())
+
+    async def _close_socket(self):
+        try:
+            await self.websocket.close(code=1013)
+        except Exception:
+            pass
+
+    def close(self):
+        self.closed = True
+        self._queue.clear()
+        self._ready.set()
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+
+
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, List[WebSocket]] = {}
+        self.clients: Dict[WebSocket, ClientConnection] = {}
+        # Market-data channel: symbol -> sockets subscribed to it, and the reverse
+        self.symbol_subscribers: Dict[str, Set[WebSocket]] = {}
+        self.socket_symbols: Dict[WebSocket, Set[str]] = {}
+        # Set by services.cluster when running as one of several workers
+        self.fanout = None
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.evicted = 0
 
-    async def connect(self, user_id: str, websocket: WebSocket):
+    async def connect(self, user_id: Optional[str], websocket: WebSocket, wire_format: str = "json"):
+        """Accept a socket; only an authenticated one (``user_id`` set) receives that user's messages."""
         await websocket.accept()
-        if user_id not in self.active_connections:
-            self.active_connections[user_id] = []
-        self.active_connections[user_id].append(websocket)
+        if user_id is not None:
+            self.active_connections.setdefault(user_id, []).append(websocket)
+        client = ClientConnection(self, user_id, websocket, wire_format)
+        self.clients[websocket] = client
+        client.start()
 
-    def disconnect(self, user_id: str, websocket: WebSocket):
+    def disconnect(self, user_id: Optional[str], websocket: WebSocket):
         if user_id in self.active_connections:
             self.active_connections[user_id] = [
                 ws for ws in self.active_connections[user_id] if ws != websocket
             ]
             if not self.active_connections[user_id]:
                 del self.active_connections[user_id]
+        self.unsubscribe(websocket, list(self.socket_symbols.get(websocket, ())))
+        self.socket_symbols.pop(websocket, None)
+        client = self.clients.pop(websocket, None)
+        if client is not None:
+            client.close()
+
+    def subscribe(self, websocket: WebSocket, symbols: Iterable[str]) -> Set[str]:
+        added = set()
+        subscribed = self.socket_symbols.setdefault(websocket, set())
+        for symbol in symbols:
+            symbol = symbol.upper()
+            if symbol in subscribed:
+                continue
+            if len(subscribed) >= settings.WS_MAX_SYMBOLS:
+                break
+            subscribed.add(symbol)
+            self.symbol_subscribers.setdefault(symbol, set()).add(websocket)
+            added.add(symbol)
+        return added
+
+    def unsubscribe(self, websocket: WebSocket, symbols: Iterable[str]):
+        subscribed = self.socket_symbols.get(websocket, set())
+        for symbol in symbols:
+            symbol = symbol.upper()
+            subscribed.discard(symbol)
+            sockets = self.symbol_subscribers.get(symbol)
+            if sockets is None:
+                continue
+            sockets.discard(websocket)
+            if not sockets:
+                del self.symbol_subscribers[symbol]
+
+    def _send(self, websocket: WebSocket, message: OutboundMessage, key: Optional[Hashable] = None):
+        client = self.clients.get(websocket)
+        if client is not None:
+            client.send(message, key)
 
     async def broadcast_price_update(self, user_id: str, message_type: str, item: CartItem):
         """Sends a notification to the user about cart changes (add/remove)."""
-        if user_id not in self.active_connections:
-            return
-            
-        message = {
+        self.notify_user(user_id, {
             "type": message_type,
             "item": item.model_dump() if hasattr(item, 'model_dump') else item.dict(),
+        })
+
+    def notify_user(self, user_id: str, message: dict, key: Optional[Hashable] = None):
+        """Queues a message for every socket of one user, in this worker and, in a cluster, the others."""
+        self.deliver(user_id, message, key)
+        if self.fanout is not None:
+            self.fanout.relay(user_id, message, key)
+
+    def deliver(self, user_id: str, message: dict, key: Optional[Hashable] = None):
+        """Queues a message for this worker's sockets of one user; ``key`` lets a newer message replace a queued one."""
+        sockets = self.active_connections.get(user_id)
+        if not sockets:
+            return
+        outbound = OutboundMessage(message)
+        for websocket in list(sockets):
+            self._send(websocket, outbound, key)
+
+    async def publish_prices(self, ticks: List[PriceTick]):
+        """Pushes changed prices to the sockets subscribed to each symbol, encoding each update once."""
+        for tick in ticks:
+            sockets = self.symbol_subscribers.get(tick.symbol)
+            if not sockets:
+                continue
+            message = OutboundMessage.price(tick.symbol, tick.price, tick.change)
+            key = ("price", tick.symbol)
+            for websocket in list(sockets):
+                self._send(websocket, message, key)
+
+    async def handle_client_message(self, websocket: WebSocket, raw: str):
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            return
+        if not isinstance(message, dict):
+            return
+        action = message.get("action")
+        symbols = message.get("symbols") or []
+        if (
+            not isinstance(symbols, list)
+            or len(symbols) > settings.WS_MAX_SYMBOLS
+            or not all(isinstance(symbol, str) for symbol in symbols)
+        ):
+            self._send(websocket, OutboundMessage({
+                "type": "error",
+                "detail": f"symbols must be a list of at most {settings.WS_MAX_SYMBOLS} strings",
+            }))
+            return
+        if action == "subscribe":
+            added = self.subscribe(websocket, symbols)
+            # Start the client off with a snapshot; after this it only receives deltas
+            snapshot = []
+            for symbol in sorted(added):
+                stock = market_simulator.get_stock(symbol)
+                if stock is not None:
+                    snapshot.append({"symbol": stock.symbol, "price": stock.price, "change": stock.change})
+            self._send(websocket, OutboundMessage({"type": "prices", "items": snapshot}))
+        elif action == "unsubscribe":
+            self.unsubscribe(websocket, symbols)
+
+    def stats(self) -> dict:
+        depths = [client.depth for client in self.clients.values()]
+        return {
+            "connections": len(self.clients),
+            "binary_connections": sum(1 for client in self.clients.values() if client.binary),
+            "users": len(self.active_connections),
+            "subscribed_symbols": len(self.symbol_subscribers),
+            "queue_policy": settings.WS_QUEUE_POLICY,
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "evicted": self.evicted,
+            "cluster": self.fanout.stats() if self.fanout is not None else None,
         }
-        
-        for websocket in self.active_connections[user_id]:
-            try:
-                await websocket.send_json(message)
-            except Exception:
-                pass
 
 manager = ConnectionManager()
 
+
+@registry.collector
+def _collect():
+    depths = [client.depth for client in manager.clients.values()]
+    return [
+        ("ws_connections", "gauge", "Open websocket connections", [({}, len(manager.clients))]),
+        ("ws_users", "gauge", "Users with at least one open websocket", [({}, len(manager.active_connections))]),
+        ("ws_queue_depth", "gauge", "Messages queued across all connections", [({}, sum(depths))]),
+        ("ws_messages_sent_total", "counter", "Websocket messages sent", [({}, manager.sent)]),
+        ("ws_messages_coalesced_total", "counter", "Queued messages replaced by a newer one", [({}, manager.coalesced)]),
+        ("ws_messages_dropped_total", "counter", "Messages dropped from full queues", [({}, manager.dropped)]),
+        ("ws_evictions_total", "counter", "Slow or failed connections evicted", [({}, manager.evicted)]),
+    ]
+
+
+async def _stream_prices():
+    subscription = price_bus.subscribe()
+    while True:
+        ticks = await subscription.get_batch()
+        try:
+            await manager.publish_prices(ticks)
+        except Exception:
+            logger.exception("Price fan-out failed")
+
+
+async def start_price_stream():
+    asyncio.create_task(_stream_prices())
+
+
+@router.get("/stats")
+async def websocket_stats():
+    return manager.stats()
+
 @router.websocket("/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: str):
-    await manager.connect(user_id, websocket)
+async def websocket_endpoint(
+    websocket: WebSocket,
+    user_id: str,
+    wire_format: str = Query("json", alias="format"),
+    token: Optional[str] = Query(None),
+    db=Depends(get_db),
+):
+    if wire_format not in FORMATS:
+        wire_format = "json"
+    expires_in = None
+    if user_id == GUEST:
+        user_id = None
+    else:
+        # Fills, orders, P&L and cart changes are private: the token must belong to this user
+        user = await websocket_user(token, db)
+        if user is None or user.id != user_id:
+            # Closing before accept() rejects the handshake
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+        expires_in = token_expires_in(token)
+    await manager.connect(user_id, websocket, wire_format)
     try:
-        while True:
-            await websocket.receive_text()
-    except WebSocketDisconnect:
+        # Private pushes (P&L keeps streaming on every tick) stop with the token;
+        # the client reconnects with a fresh one
+        async with asyncio.timeout(expires_in):
+            while True:
+                raw = await websocket.receive_text()
+                await manager.handle_client_message(websocket, raw)
+    except TimeoutError:
+        manager.disconnect(user_id, websocket)
+        try:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        except RuntimeError:
+            pass
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: the socket was already closed by a slow-consumer eviction
+        pass
+    except Exception:
+        logger.exception(f"Websocket of user {user_id or GUEST} failed")
+    finally:
+        # Whatever ended the loop, drop the subscriptions and stop the writer
         manager.disconnect(user_id, websocket)
@@ -0,0 +1,78 @@
+"""
+Event-loop lag during a login storm, before and after offloading pbkdf2.
+
+Run from the backend directory:
+
+    python -m benchmarks.login_storm --logins 200
+
+"inline" verifies passwords on the event loop the way the login handler used
+to; "pool" goes through core.security.password_hasher. A heartbeat coroutine
+sleeps for a fixed interval and records how late it wakes up.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from app.core.security import PasswordHasher, hash_password, verify_password
+
+HEARTBEAT_SECONDS = 0.005
+
+
+async def _heartbeat(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(HEARTBEAT_SECONDS)
+        lags.append(time.perf_counter() - start - HEARTBEAT_SECONDS)
+
+
+async def _inline_login(password: str, hashed: str) -> bool:
+    return verify_password(password, hashed)
+
+
+async def _storm(mode: str, logins: int, hasher: PasswordHasher, hashed: str) -> dict:
+    lags: list = []
+    stop = asyncio.Event()
+    heartbeat = asyncio.create_task(_heartbeat(lags, stop))
+    await asyncio.sleep(HEARTBEAT_SECONDS * 2)
+
+    start = time.perf_counter()
+    if mode == "inline":
+        await asyncio.gather(*(_inline_login("secret", hashed) for _ in range(logins)))
+    else:
+        await asyncio.gather(*(hasher.verify("secret", hashed) for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await heartbeat
+    lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+    return {
+        "mode": mode,
+        "logins": logins,
+        "seconds": round(elapsed, 3),
+        "logins_per_s": round(logins / elapsed, 1),
+        "lag_p50_ms": round(statistics.median(lags_ms), 2),
+        "lag_p99_ms": round(lags_ms[int(len(lags_ms) * 0.99) - 1], 2),
+        "lag_max_ms": round(lags_ms[-1], 2),
+        "max_queue_depth": hasher.max_queue_depth if mode != "inline" else 0,
+    }
+
+
+async def main(logins: int, executor: str, workers: int, concurrency: int):
+    hashed = hash_password("secret")
+    hasher = PasswordHasher(executor=executor, workers=workers, max_concurrency=concurrency)
+    try:
+        for mode in ("inline", "pool"):
+            print(await _storm(mode, logins, hasher, hashed))
+    finally:
+        hasher.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--executor", choices=("process", "thread"), default="process")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    asyncio.run(main(args.logins, args.executor, args.workers, args.concurrency))
@@ -0,0 +1,124 @@
+"""
+Throughput and latency of the paper-trading matching engine.
+
+Run from the backend directory:
+
+    python -m benchmarks.matching_engine --orders 500000 --symbols 100
+
+Submits a mix of limit (mostly resting), market, stop orders and cancels
+against MatchingEngine with a random-walk reference price per symbol, moving
+one symbol's price every ``--tick-every`` orders. Reports orders per second
+(untimed calls) and per-call latency percentiles (a second, timed pass).
+With a large resting book most of the tail is cyclic GC walking the live
+orders; ``--no-gc`` shows the engine's cost without it.
+
+Measured on the development machine (CPython 3.11, 300k-500k orders, 100
+symbols): about 130k-140k orders/s with p50 3us and p99 7-8us, and about
+235k-245k orders/s with ``--no-gc``. The target was hundreds of thousands of
+orders per second in one process, and that is only reached with the GC off.
+With it on, the engine is at roughly half the target. About 40% of the
+runtime is then full collections, each of which walks the ~110k resting
+orders. Trimming the matching code itself (one clock read per match instead
+of per fill) made no measurable difference.
+"""
+import argparse
+import gc
+import random
+import time
+
+from app.services.matching_engine import BUY, LIMIT, MARKET, SELL, STOP, MatchingEngine
+
+
+def _stream(rng: random.Random, symbols: list, prices: dict, orders: int, tick_every: int) -> list:
+    """Pre-generated orders and price moves, so the timed loop covers only the engine."""
+    walk = dict(prices)
+    stream = []
+    for i in range(orders):
+        symbol = rng.choice(symbols)
+        side = BUY if rng.random() < 0.5 else SELL
+        roll = rng.random()
+        offset = walk[symbol] * rng.uniform(0.0, 0.02)
+        quantity = rng.randint(1, 100)
+        if roll < 0.70:
+            price = round(walk[symbol] - offset if side == BUY else walk[symbol] + offset, 1)
+            stream.append((symbol, side, LIMIT, quantity, price, None))
+        elif roll < 0.85:
+            stream.append((symbol, side, MARKET, quantity, None, None))
+        elif roll < 0.95:
+            stop = round(walk[symbol] + offset if side == BUY else walk[symbol] - offset, 1)
+            stream.append((symbol, side, STOP, quantity, None, stop))
+        else:
+            stream.append((symbol, None, "cancel", rng.random(), None, None))
+        if i % tick_every == 0:
+            moved = rng.choice(symbols)
+            walk[moved] *= 1 + rng.uniform(-0.01, 0.01)
+            stream.append((moved, None, "tick", walk[moved], None, None))
+    return stream
+
+
+def _run(stream: list, prices: dict, measure: bool) -> tuple:
+    prices = dict(prices)
+    engine = MatchingEngine(prices.get)
+    latencies = []
+    open_ids = []
+    perf = time.perf_counter
+    start = perf()
+    for symbol, side, kind, quantity, price, stop in stream:
+        t0 = perf() if measure else 0.0
+        if kind == "tick":
+            prices[symbol] = quantity
+            engine.on_price(symbol, quantity)
+            continue
+        if kind == "cancel":
+            if open_ids:
+                # Swap-remove so picking a random open order stays O(1)
+                i = int(quantity * len(open_ids))
+                open_ids[i], open_ids[-1] = open_ids[-1], open_ids[i]
+                engine.cancel(open_ids.pop())
+        else:
+            order = engine.submit("user", symbol, side, quantity, kind=kind, price=price, stop_price=stop)
+            if order.remaining:
+                open_ids.append(order.id)
+        if measure:
+            latencies.append(perf() - t0)
+        if len(engine.pending_fills) > 10_000:
+            engine.take_fills()
+    return perf() - start, latencies, engine
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=500_000)
+    parser.add_argument("--symbols", type=int, default=100)
+    parser.add_argument("--tick-every", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--no-gc", action="store_true", help="disable the cyclic garbage collector while timing")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    symbols = [f"SYM{i:04d}" for i in range(args.symbols)]
+    prices = {symbol: rng.uniform(100, 1000) for symbol in symbols}
+    stream = _stream(rng, symbols, prices, args.orders, args.tick_every)
+    gc.collect()
+    if args.no_gc:
+        gc.disable()
+
+    # Throughput without per-call timers, then the same stream again for latencies
+    elapsed, _, engine = _run(stream, prices, measure=False)
+    _, latencies, _ = _run(stream, prices, measure=True)
+
+    latencies.sort()
+    pick = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1e6, 2)
+    print({
+        "orders": args.orders,
+        "seconds": round(elapsed, 3),
+        "orders_per_s": int(args.orders / elapsed),
+        "p50_us": pick(0.50),
+        "p99_us": pick(0.99),
+        "p999_us": pick(0.999),
+        **engine.stats(),
+    })
+
+
+if __name__ == "__main__":
+    main()
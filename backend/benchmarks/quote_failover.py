@@ -0,0 +1,89 @@
+"""
+Failover between quote sources with stand-in fake upstreams.
+
+Run from the backend directory:
+
+    python -m benchmarks.quote_failover --batches 300
+
+The primary source answers in ~20ms but has a slow tail (5% of calls take
+1s) and, halfway through, starts failing outright. The backup is a steady
+~60ms. "fixed" walks the sources in order with no hedging or breaker, the
+way fetch_live_price used to; "hedged" uses QuoteFetcher with per-source
+health tracking, p95 hedging and circuit breakers.
+"""
+import argparse
+import asyncio
+import random
+import time
+from typing import Dict, List, Sequence
+
+from app.models.stock import Stock
+from app.services.quote_fetcher import QuoteFetcher, QuoteSource
+
+
+class FakeSource(QuoteSource):
+    def __init__(self, name: str, latency: float, slow_rate: float = 0.0, slow_latency: float = 1.0):
+        super().__init__()
+        self.name = name
+        self.latency = latency
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.failing = False
+
+    async def fetch_many(self, symbols: Sequence[str]) -> Dict[str, Stock]:
+        self.calls += 1
+        delay = self.slow_latency if random.random() < self.slow_rate else self.latency
+        await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+        if self.failing:
+            raise ConnectionError(f"{self.name} unavailable")
+        return self._fetch_blocking(list(symbols))
+
+    def _fetch_blocking(self, symbols: List[str]) -> Dict[str, Stock]:
+        return {s: Stock(symbol=s, name=s, price=100.0, change=0.0) for s in symbols}
+
+
+async def _fixed(sources: List[FakeSource], symbols: List[str]) -> Dict[str, Stock]:
+    for source in sources:
+        try:
+            return await source.fetch_many(symbols)
+        except Exception:
+            continue
+    return {}
+
+
+async def _run(mode: str, batches: int) -> dict:
+    primary = FakeSource("primary", 0.02, slow_rate=0.05)
+    backup = FakeSource("backup", 0.06)
+    fetcher = QuoteFetcher([primary, backup], hedge_seconds=0.1, source_timeout=2.0)
+    fetcher.sources[0].breaker.reset_seconds = 1.0
+    latencies = []
+    for i in range(batches):
+        primary.failing = batches // 2 <= i < batches * 3 // 4
+        symbols = [f"SYM{i}"]
+        start = time.perf_counter()
+        if mode == "fixed":
+            await _fixed([primary, backup], symbols)
+        else:
+            await fetcher._fetch(symbols)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    pick = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 1)
+    result = {"mode": mode, "p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "total_s": round(sum(latencies), 2)}
+    if mode == "hedged":
+        result["hedged"] = fetcher.hedged
+        result["sources"] = {s.name: {k: v for k, v in s.stats().items() if k in ("calls", "p95_ms", "error_rate", "breaker")} for s in fetcher.sources}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batches", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    for mode in ("fixed", "hedged"):
+        random.seed(args.seed)
+        print(asyncio.run(_run(mode, args.batches)))
+
+
+if __name__ == "__main__":
+    main()
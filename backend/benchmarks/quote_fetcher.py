@@ -0,0 +1,96 @@
+"""
+Quote fetching against a local fake quote server.
+
+Run from the backend directory:
+
+    python -m benchmarks.quote_fetcher --callers 2000 --symbols 200
+
+Starts an HTTP server on localhost that answers ``/quotes?symbols=...`` after a
+fixed delay, then has many concurrent callers ask for overlapping symbols.
+"naive" makes one upstream request per call; "fetcher" goes through
+services.quote_fetcher (single flight, batching, rate limit, TTL cache).
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from app.services.quote_fetcher import HTTPQuoteSource, QuoteFetcher
+
+
+class _FakeQuotes(BaseHTTPRequestHandler):
+    delay = 0.02
+    requests = 0
+
+    def do_GET(self):
+        type(self).requests += 1
+        time.sleep(self.delay)
+        query = parse_qs(urlparse(self.path).query)
+        symbols = query.get("symbols", [""])[0].split(",")
+        body = json.dumps([
+            {"symbol": s, "name": s, "price": round(100 + random.random(), 2), "change": 0.0}
+            for s in symbols if s
+        ]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _start_server() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeQuotes)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def _run(mode: str, url: str, callers: int, symbols: list, rate: float) -> dict:
+    executor = ThreadPoolExecutor(max_workers=16)
+    source = HTTPQuoteSource(url, rate=rate, executor=executor)
+    _FakeQuotes.requests = 0
+    wanted = [random.choice(symbols) for _ in range(callers)]
+    start = time.perf_counter()
+    if mode == "naive":
+        results = await asyncio.gather(*(source.fetch_many([symbol]) for symbol in wanted))
+        priced = sum(1 for result in results if result)
+    else:
+        fetcher = QuoteFetcher([source], ttl_seconds=1.0, stale_seconds=30.0)
+        results = await fetcher.get_many(wanted)
+        priced = len(results)
+    elapsed = time.perf_counter() - start
+    executor.shutdown()
+    return {
+        "mode": mode,
+        "callers": callers,
+        "priced": priced,
+        "upstream_requests": _FakeQuotes.requests,
+        "seconds": round(elapsed, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--callers", type=int, default=2000)
+    parser.add_argument("--symbols", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=0.0, help="token-bucket rate per second, 0 = unlimited")
+    parser.add_argument("--modes", default="naive,fetcher")
+    args = parser.parse_args()
+
+    server = _start_server()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    symbols = [f"SYM{i}" for i in range(args.symbols)]
+    for mode in args.modes.split(","):
+        print(asyncio.run(_run(mode, url, args.callers, symbols, args.rate)))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
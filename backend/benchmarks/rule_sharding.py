@@ -0,0 +1,109 @@
+"""
+Rule evaluation split across cluster workers by ShardMap.
+
+Run from the backend directory:
+
+    python -m benchmarks.rule_sharding --rules 200000 --users 20000 --workers 1 2 4 8
+
+For each worker count, every worker builds a RuleIndex over the users it owns
+and replays the same random-walk tick stream. The workers run in parallel in
+a real cluster, so cluster throughput is the number of ticks over the slowest
+worker's time. The benchmark then removes one worker and reports how many
+users change owner. Rendezvous hashing moves only the lost worker's users.
+"""
+import argparse
+import random
+import time
+
+from app.services.rule_index import IndexedRule, RuleIndex
+from app.services.sharding import ShardMap
+
+
+def _rules(rng: random.Random, rules: int, users: int, symbols: list, prices: dict) -> list:
+    out = []
+    for i in range(rules):
+        symbol = rng.choice(symbols)
+        low = prices[symbol] * rng.uniform(0.9, 1.0)
+        out.append(IndexedRule(
+            rule_id=str(i),
+            user_id=f"user{rng.randrange(users)}",
+            symbol=symbol,
+            min_price=low,
+            max_price=low * rng.uniform(1.01, 1.1),
+        ))
+    return out
+
+
+def _ticks(rng: random.Random, symbols: list, prices: dict, count: int) -> list:
+    walk = dict(prices)
+    ticks = []
+    for _ in range(count):
+        symbol = rng.choice(symbols)
+        walk[symbol] *= 1 + rng.uniform(-0.01, 0.01)
+        ticks.append((symbol, walk[symbol]))
+    return ticks
+
+
+def _worker_seconds(rules: list, ticks: list) -> float:
+    index = RuleIndex()
+    for rule in rules:
+        index.add(rule)
+    start = time.perf_counter()
+    for symbol, price in ticks:
+        index.evaluate(symbol, price)
+    elapsed = time.perf_counter() - start
+    for rule in rules:
+        index.remove(rule.rule_id)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rules", type=int, default=200_000)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--ticks", type=int, default=50_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    symbols = [f"SYM{i:04d}" for i in range(args.symbols)]
+    prices = {symbol: rng.uniform(100, 1000) for symbol in symbols}
+    rules = _rules(rng, args.rules, args.users, symbols, prices)
+    ticks = _ticks(rng, symbols, prices, args.ticks)
+    users = sorted({rule.user_id for rule in rules})
+
+    baseline = None
+    for count in args.workers:
+        members = [f"worker{i}" for i in range(count)]
+        shards = ShardMap(members[0])
+        shards.set_members(members)
+        owned = {member: [] for member in members}
+        for rule in rules:
+            owned[shards.owner(rule.user_id)].append(rule)
+        slowest = max(_worker_seconds(owned[member], ticks) for member in members)
+        throughput = args.ticks / slowest
+        baseline = baseline or throughput
+
+        moved = None
+        if count > 1:
+            before = {user: shards.owner(user) for user in users}
+            lost = members[-1]
+            shards.set_members(members[:-1])
+            moved = sum(1 for user in users if shards.owner(user) != before[user])
+            # Users of the surviving workers must not move
+            assert all(before[user] == lost for user in users if shards.owner(user) != before[user])
+
+        print({
+            "workers": count,
+            "max_rules_per_worker": max(len(r) for r in owned.values()),
+            "ticks_per_s": int(throughput),
+            "speedup": round(throughput / baseline, 2),
+            "users_moved_on_loss": moved,
+            "users_moved_pct": None if moved is None else round(100 * moved / len(users), 1),
+        })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Replay throughput for recorded tick files.
+
+Run from the backend directory:
+
+    python -m benchmarks.tick_replay --ticks 1000000 --symbols 500
+
+Writes a synthetic bursty tick file as .csv.gz and as a memory-mapped .npy,
+then replays each as fast as possible through ReplayMarket while a price-bus
+subscriber drains the ticks, and reports ticks per second. Pass --file to
+replay an existing recording instead.
+"""
+import argparse
+import asyncio
+import csv
+import gzip
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from app.core.events import price_bus
+from app.services.tick_replay import ReplayMarket, read_ticks, save_ticks
+
+
+def _synthetic(path_csv: str, ticks: int, symbols: int, seed: int):
+    rng = np.random.default_rng(seed)
+    # Bursts: most timestamps carry a handful of ticks, some carry hundreds
+    per_ts = np.where(rng.random(ticks) < 0.02, rng.integers(50, 400, ticks), rng.integers(1, 6, ticks))
+    ts = np.repeat(1_700_000_000 + np.arange(ticks) * 0.05, per_ts)[:ticks]
+    names = np.array([f"SYM{i:04d}" for i in range(symbols)])
+    picks = rng.integers(0, symbols, ticks)
+    base = rng.uniform(50, 5000, symbols)
+    prices = np.round(base[picks] * (1 + rng.normal(0, 0.002, ticks)), 2)
+    with gzip.open(path_csv, "wt", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["ts", "symbol", "price"])
+        writer.writerows(zip(ts.tolist(), names[picks].tolist(), prices.tolist()))
+
+
+async def _drain(stop: asyncio.Event, counter: list):
+    subscription = price_bus.subscribe(maxsize=1_000_000)
+    while not stop.is_set():
+        try:
+            ticks = await asyncio.wait_for(subscription.get_batch(coalesce=False), timeout=0.1)
+        except asyncio.TimeoutError:
+            continue
+        counter[0] += len(ticks)
+    subscription.close()
+
+
+async def _replay(path: str) -> dict:
+    start = time.perf_counter()
+    market = ReplayMarket(path, speed=0)
+    scanned = time.perf_counter() - start
+    stop, counter = asyncio.Event(), [0]
+    drain = asyncio.create_task(_drain(stop, counter))
+    start = time.perf_counter()
+    await market.run_forever()
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(0.2)
+    stop.set()
+    await drain
+    return {
+        "file": os.path.basename(path),
+        "bytes": os.path.getsize(path),
+        "scan_s": round(scanned, 2),
+        "replay_s": round(elapsed, 2),
+        "ticks": market.ticks_replayed,
+        "ticks_per_s": int(market.ticks_replayed / elapsed) if elapsed else None,
+        "published": counter[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ticks", type=int, default=1_000_000)
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--file", help="replay this recording instead of a synthetic one")
+    args = parser.parse_args()
+
+    if args.file:
+        print(asyncio.run(_replay(args.file)))
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        path_csv = os.path.join(tmp, "ticks.csv.gz")
+        path_npy = os.path.join(tmp, "ticks.npy")
+        _synthetic(path_csv, args.ticks, args.symbols, args.seed)
+        save_ticks(path_npy, read_ticks(path_csv))
+        for path in (path_csv, path_npy):
+            print(asyncio.run(_replay(path)))
+
+
+if __name__ == "__main__":
+    main()
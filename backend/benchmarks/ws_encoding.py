@@ -0,0 +1,59 @@
+"""
+Encode cost and bytes on the wire for one price broadcast to N subscribers.
+
+Run from the backend directory:
+
+    python -m benchmarks.ws_encoding --subscribers 1000
+
+"per-socket json" is the old behaviour (json.dumps for every socket); the
+others encode once per broadcast through app.websocket.codec.
+"""
+import argparse
+import json
+import time
+
+from app.websocket import codec
+
+
+def _per_socket_json(subscribers: int):
+    message = {"type": "price", "symbol": "RELIANCE", "price": 2812.35, "change": 0.44}
+    return [json.dumps(message).encode() for _ in range(subscribers)]
+
+
+def _encode_once_text(subscribers: int):
+    message = codec.OutboundMessage.price("RELIANCE", 2812.35, 0.44)
+    return [message.text.encode() for _ in range(subscribers)]
+
+
+def _encode_once_binary(subscribers: int):
+    message = codec.OutboundMessage.price("RELIANCE", 2812.35, 0.44)
+    return [message.binary for _ in range(subscribers)]
+
+
+def _measure(fn, subscribers: int, rounds: int) -> dict:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        frames = fn(subscribers)
+    elapsed = time.perf_counter() - start
+    return {
+        "us_per_broadcast": round(elapsed / rounds * 1e6, 1),
+        "bytes_per_broadcast": sum(len(frame) for frame in frames),
+    }
+
+
+def main(subscribers: int, rounds: int):
+    print(f"orjson available: {codec.ORJSON_AVAILABLE}; {subscribers} subscribers, {rounds} rounds")
+    for name, fn in (
+        ("per-socket json", _per_socket_json),
+        ("encode-once json", _encode_once_text),
+        ("encode-once binary", _encode_once_binary),
+    ):
+        print(f"{name:>20}: {_measure(fn, subscribers, rounds)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subscribers", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+    main(args.subscribers, args.rounds)
@@ -0,0 +1,51 @@
+"""
+Fixtures for tests that need a real mongod.
+
+``TEST_MONGO_URI`` points at the server (a local mongod by default). Each test
+gets a database of its own, dropped afterwards. Without a reachable server
+those tests are skipped.
+"""
+import asyncio
+import os
+import uuid
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+TEST_MONGO_URI = os.environ.get("TEST_MONGO_URI", "mongodb://localhost:27017")
+
+
+def _mongod_available() -> bool:
+    client = MongoClient(TEST_MONGO_URI, serverSelectionTimeoutMS=500)
+    try:
+        client.admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+    finally:
+        client.close()
+
+
+@pytest.fixture(scope="session")
+def mongod():
+    if not _mongod_available():
+        pytest.skip(f"No mongod at {TEST_MONGO_URI}")
+    return TEST_MONGO_URI
+
+
+@pytest.fixture
+def run_with_db(mongod):
+    """Run ``fn(db)`` on a fresh, throwaway database and return its result."""
+    def run(fn):
+        async def main():
+            client = AsyncIOMotorClient(mongod)
+            name = f"stockdb_test_{uuid.uuid4().hex[:8]}"
+            try:
+                return await fn(client[name])
+            finally:
+                await client.drop_database(name)
+                client.close()
+        return asyncio.run(main())
+    return run
@@ -0,0 +1,60 @@
+import pytest
+from bson import ObjectId
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app.core.security import create_access_token
+from app.db.session import get_db
+from app.websocket import price_socket
+from app.websocket.price_socket import manager
+
+USER_ID = ObjectId()
+EMAIL = "trader@example.com"
+
+
+class _Users:
+    async def find_one(self, query):
+        return {"_id": USER_ID, "email": EMAIL} if query.get("email") == EMAIL else None
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(price_socket.router, prefix="/ws")
+
+    async def fake_db():
+        return {"users": _Users()}
+
+    app.dependency_overrides[get_db] = fake_db
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("query", ["", "?token=not-a-jwt", "?token={other}"])
+def test_user_socket_needs_that_users_token(client, query):
+    other = create_access_token("someone-else@example.com")
+    with pytest.raises(WebSocketDisconnect) as rejected:
+        with client.websocket_connect(f"/ws/{USER_ID}{query.format(other=other)}"):
+            pass
+    assert rejected.value.code == 1008
+
+
+def test_pnl_reaches_only_the_authenticated_socket(client):
+    token = create_access_token(EMAIL)
+    with client.websocket_connect(f"/ws/{USER_ID}?token={token}") as own, client.websocket_connect("/ws/guest") as guest:
+        assert list(manager.active_connections) == [str(USER_ID)]
+        manager.notify_user(str(USER_ID), {"type": "pnl", "unrealized_pnl": 1.5})
+        assert own.receive_json() == {"type": "pnl", "unrealized_pnl": 1.5}
+        # The guest socket only has the public price channel
+        guest.send_text('{"action": "subscribe", "symbols": []}')
+        assert guest.receive_json()["type"] == "prices"
+    assert manager.active_connections == {}
+
+
+def test_socket_closes_when_its_token_expires(client):
+    token = create_access_token(EMAIL, expires_minutes=0.02)
+    with client.websocket_connect(f"/ws/{USER_ID}?token={token}") as own:
+        with pytest.raises(WebSocketDisconnect) as closed:
+            own.receive_json()
+    assert closed.value.code == 1008
+    assert manager.active_connections == {}
@@ -0,0 +1,47 @@
+from app.db.schema import HOT_QUERIES, INDEXES, HotQuery, audit_queries, ensure_indexes, plan_stages
+
+
+def test_plan_stages_classic_layout():
+    plan = {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "status"}}
+    assert plan_stages(plan) == ["FETCH", "IXSCAN"]
+
+
+def test_plan_stages_sbe_layout():
+    plan = {"queryPlan": {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}, "slotBasedPlan": {}}
+    assert plan_stages(plan) == ["SORT", "COLLSCAN"]
+
+
+def test_plan_stages_branches():
+    plan = {"stage": "OR", "inputStages": [{"stage": "IXSCAN"}, {"stage": "COLLSCAN"}]}
+    assert sorted(plan_stages(plan)) == ["COLLSCAN", "IXSCAN", "OR"]
+
+
+def test_ensure_indexes_creates_declared_indexes(run_with_db):
+    async def check(db):
+        await ensure_indexes(db)
+        # A second run must be a no-op, as it is on every boot
+        await ensure_indexes(db)
+        return {name: await db[name].index_information() for name in INDEXES}
+
+    created = run_with_db(check)
+    for collection, indexes in INDEXES.items():
+        for index in indexes:
+            spec = index.document
+            assert spec["name"] in created[collection], f"{collection}.{spec['name']} missing"
+            info = created[collection][spec["name"]]
+            assert info["key"] == list(spec["key"].items())
+            assert info.get("unique", False) == spec.get("unique", False)
+
+
+def test_audit_flags_unindexed_query(run_with_db):
+    unindexed = HotQuery("orders.by_fill_price", "orders", {"fill_price": 100.0})
+
+    async def check(db):
+        await ensure_indexes(db)
+        return await audit_queries(db, [unindexed, *HOT_QUERIES])
+
+    report = {entry["query"]: entry for entry in run_with_db(check)}
+    assert report["orders.by_fill_price"]["collscan"]
+    assert "COLLSCAN" in report["orders.by_fill_price"]["stages"]
+    scanning = [name for name, entry in report.items() if entry["collscan"] and name != unindexed.name]
+    assert scanning == []
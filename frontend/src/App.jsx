@@ -17,6 +17,7 @@ import Privacy from "./pages/Privacy";
 import { Toaster } from 'react-hot-toast';
 import { setCart, addToCart, removeFromCart } from "./redux/cartSlice";
 import toast from "react-hot-toast";
+import { addSocketListener, connectSocket } from "./api/socket";
 
 function App() {
   const dispatch = useDispatch();
@@ -40,14 +41,20 @@ function App() {
     }
   }, [token, dispatch]);
 
-  // WebSocket Listener for Automation Triggers (Smart Buy/Remove Notifications)
+  // The one websocket of this tab: per user when logged in, shared "guest" otherwise
   useEffect(() => {
     if (token && user) {
-      const socket = new WebSocket(`ws://localhost:8000/ws/${user.id}`);
+      connectSocket(user.id, token);
+    } else {
+      connectSocket("guest");
+    }
+  }, [token, user]);
 
-      socket.onmessage = (event) => {
+  // WebSocket Listener for Automation Triggers (Smart Buy/Remove Notifications)
+  useEffect(() => {
+    if (token && user) {
+      return addSocketListener((data) => {
         try {
-          const data = JSON.parse(event.data);
           const stock = data.item;
 
           if (data.type === "cart_add") {
@@ -80,11 +87,9 @@ function App() {
             );
           }
         } catch (err) {
-          console.error("WS Message Parse Error", err);
+          console.error("WS Message Error", err);
         }
-      };
-
-      return () => socket.close();
+      });
     }
   }, [token, user, dispatch]);
 
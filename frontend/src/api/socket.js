@@ -0,0 +1,70 @@
+import { API_BASE_URL } from "../utils/constants";
+
+// One websocket per tab, shared by everything that wants pushed updates
+// (cart notifications in App, live prices on the Dashboard)
+const WS_URL = API_BASE_URL.replace(/^http/, "ws").replace(/\/api\/?$/, "/ws");
+
+let socket = null;
+let socketKey = null;
+const listeners = new Set();
+// symbol -> number of components that want it
+const subscriptions = new Map();
+
+function send(message) {
+  if (socket && socket.readyState === WebSocket.OPEN) {
+    socket.send(JSON.stringify(message));
+  }
+}
+
+// A user's socket carries their fills, orders, P&L and cart changes, so the
+// server only accepts it with that user's token; without one, connect as "guest"
+export function connectSocket(userId, token) {
+  const key = `${userId}:${token || ""}`;
+  if (socket && socketKey === key) return;
+  if (socket) socket.close();
+  socketKey = key;
+  const query = token ? `?token=${encodeURIComponent(token)}` : "";
+  socket = new WebSocket(`${WS_URL}/${encodeURIComponent(userId)}${query}`);
+
+  socket.onopen = () => {
+    // Symbols subscribed while connecting (or on a previous socket)
+    if (subscriptions.size) {
+      send({ action: "subscribe", symbols: [...subscriptions.keys()] });
+    }
+  };
+  socket.onmessage = (event) => {
+    let data;
+    try {
+      data = JSON.parse(event.data);
+    } catch (err) {
+      console.error("WS Message Parse Error", err);
+      return;
+    }
+    listeners.forEach((listener) => listener(data));
+  };
+}
+
+export function addSocketListener(listener) {
+  listeners.add(listener);
+  return () => listeners.delete(listener);
+}
+
+export function subscribeSymbols(symbols) {
+  const added = symbols.filter((symbol) => !subscriptions.has(symbol));
+  symbols.forEach((symbol) => subscriptions.set(symbol, (subscriptions.get(symbol) || 0) + 1));
+  if (added.length) send({ action: "subscribe", symbols: added });
+
+  return () => {
+    const removed = [];
+    symbols.forEach((symbol) => {
+      const count = (subscriptions.get(symbol) || 0) - 1;
+      if (count > 0) {
+        subscriptions.set(symbol, count);
+      } else {
+        subscriptions.delete(symbol);
+        removed.push(symbol);
+      }
+    });
+    if (removed.length) send({ action: "unsubscribe", symbols: removed });
+  };
+}
@@ -3,7 +3,8 @@ import { useDispatch, useSelector } from "react-redux";
 import { Link, useNavigate } from "react-router-dom";
 import StockCard from "../components/StockCard/StockCard";
 import { addToCart } from "../redux/cartSlice";
-import { setStocks } from "../redux/stockSlice";
+import { setStocks, applyPriceUpdates } from "../redux/stockSlice";
+import { addSocketListener, subscribeSymbols } from "../api/socket";
 import toast from "react-hot-toast";
 import axios from "axios";
 import {
@@ -92,18 +93,35 @@ function Dashboard() {
 
   useEffect(() => {
     fetchLiveStocks();
-    const interval = setInterval(fetchLiveStocks, 10000);
 
     if (token) {
       fetchRules();
     }
-
-    return () => clearInterval(interval);
   }, [token, dispatch]);
 
+  // Live prices: subscribe once to the symbols on screen and apply pushed deltas
+  const symbolKey = stocks.map((s) => s.symbol).join(",");
+  useEffect(() => {
+    if (!symbolKey) return undefined;
+    // Rides on the app's shared socket (see api/socket.js) instead of opening a second one
+    const removeListener = addSocketListener((data) => {
+      if (data.type === "price") {
+        dispatch(applyPriceUpdates([data]));
+      } else if (data.type === "prices") {
+        dispatch(applyPriceUpdates(data.items));
+      }
+    });
+    const unsubscribe = subscribeSymbols(symbolKey.split(","));
+
+    return () => {
+      unsubscribe();
+      removeListener();
+    };
+  }, [symbolKey, dispatch]);
+
   useEffect(() => {
     if (stocks.length > 0) checkMatches(stocks);
-  }, [rules]);
+  }, [rules, stocks]);
 
   const handleAddToCart = async (stock) => {
     if (!token) {
@@ -14,6 +14,16 @@ const stockSlice = createSlice({
     setStocks(state, action) {
       state.list = action.payload;
     },
+    applyPriceUpdates(state, action) {
+      const updates = action.payload;
+      for (const update of updates) {
+        const stock = state.list.find((item) => item.symbol === update.symbol);
+        if (stock) {
+          stock.price = update.price;
+          stock.change = update.change;
+        }
+      }
+    },
     setSelectedStock(state, action) {
       state.selected = action.payload;
     },
@@ -26,7 +36,7 @@ const stockSlice = createSlice({
   },
 });
 
-export const { setStocks, setSelectedStock, setStockStatus, setStockError } =
+export const { setStocks, applyPriceUpdates, setSelectedStock, setStockStatus, setStockError } =
   stockSlice.actions;
 
 export default stockSlice.reducer;